@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import RevokedToken
 
-# Register your models here.
+
+@admin.register(RevokedToken)
+class RevokedTokenAdmin(admin.ModelAdmin):
+    list_display = ['id', 'jti', 'token_type', 'user', 'expires_at', 'created_at']
+    list_display_links = ['id', 'jti']
+    list_filter = ['token_type']
+    search_fields = ['jti']
+    raw_id_fields = ['user']
@@ -1,9 +1,12 @@
 from rest_framework import authentication
 from django.conf import settings
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from geopoints.throttling import LoginThrottle
 from .services import TokenJWT
+from . import revocation
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
+from geopoints.db_router import use_primary_if_pinned
 
 
 class AuthenticationJWT(authentication.BaseAuthentication):
@@ -31,5 +34,29 @@ class AuthenticationJWT(authentication.BaseAuthentication):
             raise AuthenticationFailed('Cannot decode token', code='decode_error')
         if not TokenJWT.validate_token(decode_payload, 'access'):
             raise AuthenticationFailed('Invalid token', code='invalid_token')
+        if revocation.revoked_access.is_revoked(revocation.token_id(decode_payload, signature)):
+            raise AuthenticationFailed('Token revoked', code='token_revoked')
         user = get_object_or_404(get_user_model(), id=decode_payload['id'])
+        use_primary_if_pinned(user.id)
         return user, token
+
+
+class ThrottledBasicAuthentication(authentication.BasicAuthentication):
+    '''BasicAuthentication с ограничением подбора пароля: неудачная проверка списывает попытку
+    из бакета LoginThrottle адреса, при пустом бакете пароль не проверяется (429).
+    Успешные запросы попыток не расходуют
+    '''
+
+    def authenticate(self, request):
+        auth = authentication.get_authorization_header(request).split()
+        if not auth or auth[0].lower() != b'basic':
+            return None
+        throttle = LoginThrottle()
+        key = throttle.ip_key(request)
+        if not throttle.take(key, 1, peek=True):
+            raise Throttled(throttle.wait())
+        try:
+            return super().authenticate(request)
+        except AuthenticationFailed:
+            throttle.take(key, 1)
+            raise
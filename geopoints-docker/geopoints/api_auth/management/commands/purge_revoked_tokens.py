@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api_auth import revocation
+
+
+class Command(BaseCommand):
+    help = 'Удаление записей об отозванных токенах, срок действия которых уже истек'
+
+    def handle(self, *args, **options):
+        deleted = revocation.purge_expired()
+        self.stdout.write(f'Удалено записей: {deleted}')
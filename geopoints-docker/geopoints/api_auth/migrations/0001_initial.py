@@ -0,0 +1,33 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jti', models.CharField(max_length=64, unique=True, verbose_name='jti')),
+                ('token_type', models.CharField(choices=[('access', 'access'), ('refresh', 'refresh')], max_length=10, verbose_name='Тип токена')),
+                ('expires_at', models.DateTimeField(verbose_name='Истекает')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Отозван')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revoked_tokens', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Отозванный токен',
+                'verbose_name_plural': 'Отозванные токены',
+                'indexes': [models.Index(fields=['token_type', 'created_at'], name='revoked_type_created_idx'), models.Index(fields=['expires_at'], name='revoked_expires_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,38 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class RevokedToken(models.Model):
+    '''Отозванный JWT (по jti): refresh после ротации или выхода, access после выхода.
+    Строка нужна только до истечения токена, затем удаляется purge_revoked_tokens
+    '''
+    ACCESS = 'access'
+    REFRESH = 'refresh'
+    TOKEN_TYPES = [
+        (ACCESS, 'access'),
+        (REFRESH, 'refresh'),
+    ]
+
+    jti = models.CharField(max_length=64, unique=True, verbose_name='jti')
+    token_type = models.CharField(max_length=10, choices=TOKEN_TYPES, verbose_name='Тип токена')
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='revoked_tokens',
+        verbose_name='Пользователь'
+    )
+    expires_at = models.DateTimeField(verbose_name='Истекает')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Отозван')
+
+    def __str__(self):
+        return f'{self.token_type} {self.jti}'
+
+    class Meta:
+        verbose_name = 'Отозванный токен'
+        verbose_name_plural = 'Отозванные токены'
+        indexes = [
+            models.Index(fields=['token_type', 'created_at'], name='revoked_type_created_idx'),
+            models.Index(fields=['expires_at'], name='revoked_expires_idx'),
+        ]
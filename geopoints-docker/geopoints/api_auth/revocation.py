@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from api_geopoints.caching import bump_version, get_version
+from .models import RevokedToken
+
+DEFAULTS = {
+    'SYNC_INTERVAL': 5,
+    'PRUNE_INTERVAL': 60,
+    'POLL_INTERVAL': 1,
+    'BACKGROUND_SYNC': True,
+}
+VERSION_KEY = 'geopoints:revoked-access-version'
+
+logger = logging.getLogger('geopoints.revocation')
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'TOKEN_REVOCATION', {}))
+    return config
+
+
+def token_id(payload, signature):
+    '''jti токена. У токенов, выпущенных до появления jti, вместо него хэш подписи'''
+    return payload.get('jti') or hashlib.sha256(signature.encode()).hexdigest()[:32]
+
+
+def revoke(payload, signature, user=None):
+    '''Запись токена в отозванные. False - токен уже был отозван (повторное использование refresh)'''
+    jti = token_id(payload, signature)
+    expires_at = datetime.fromtimestamp(payload['exp'], tz=timezone.utc)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(
+                jti=jti, token_type=payload['token_type'], user=user, expires_at=expires_at
+            )
+    except IntegrityError:
+        return False
+    if payload['token_type'] == RevokedToken.ACCESS:
+        revoked_access.add(jti, payload['exp'])
+        transaction.on_commit(lambda: bump_version(VERSION_KEY))
+    return True
+
+
+def purge_expired():
+    '''Удаление строк истекших токенов, возвращает число удаленных'''
+    deleted, _ = RevokedToken.objects.filter(expires_at__lte=datetime.now(timezone.utc)).delete()
+    return deleted
+
+
+class RevokedAccessTokens:
+    '''Множество jti отозванных и еще не истекших access токенов в памяти воркера.
+    Проверка - поиск в словаре без запросов к БД. Строки RevokedToken, созданные после прошлой
+    синхронизации (с запасом SYNC_INTERVAL на транзакции, закоммиченные позже), подтягивает
+    фоновый поток процесса: раз в POLL_INTERVAL он сверяет версию в кэше (выход в другом воркере)
+    и читает БД, если версия сменилась или прошло SYNC_INTERVAL секунд. Запрос к API в БД не ходит.
+    Первую синхронизацию делает прогрев воркера (geopoints.warmup), без него - поток сразу после старта.
+    Истекшие jti выбрасываются раз в PRUNE_INTERVAL секунд, поэтому размер ограничен
+    числом выходов за время жизни access токена.
+    Refresh токены сюда не попадают: их ротация и так пишет в БД, а повтор ловит unique по jti
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revoked = {}
+        self.since = None
+        self.version = None
+        self.synced_at = None
+        self.pruned_at = 0.0
+        self.thread_pid = None
+
+    def is_revoked(self, jti):
+        self.ensure_syncing()
+        return jti in self.revoked
+
+    def ensure_syncing(self):
+        '''Запуск фонового потока синхронизации, один на процесс: после fork поток не наследуется'''
+        if self.thread_pid == os.getpid() or not get_config()['BACKGROUND_SYNC']:
+            return
+        with self.lock:
+            if self.thread_pid == os.getpid():
+                return
+            self.thread_pid = os.getpid()
+        threading.Thread(target=self.run, name='geopoints-revocation-sync', daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                if self.sync_if_stale():
+                    # соединение этого потока не закрывается обработчиком запросов
+                    connections.close_all()
+            except Exception:
+                logger.exception('Ошибка синхронизации отозванных токенов')
+                connections.close_all()
+            time.sleep(get_config()['POLL_INTERVAL'])
+
+    def add(self, jti, exp):
+        with self.lock:
+            self.revoked[jti] = exp
+
+    def sync_if_stale(self):
+        config = get_config()
+        version = get_version(VERSION_KEY)
+        now = time.monotonic()
+        if version == self.version and self.synced_at is not None and now - self.synced_at < config['SYNC_INTERVAL']:
+            return False
+        self.sync(version, now, config)
+        return True
+
+    def sync(self, version, now, config):
+        with self.lock:
+            started = datetime.now(timezone.utc)
+            # с основной БД: на отставшей реплике окно since прошло бы мимо еще не доехавших строк
+            rows = RevokedToken.objects.using('default').filter(
+                token_type=RevokedToken.ACCESS, expires_at__gt=started
+            )
+            if self.since is not None:
+                rows = rows.filter(created_at__gte=self.since)
+            for jti, expires_at in rows.values_list('jti', 'expires_at'):
+                self.revoked[jti] = expires_at.timestamp()
+            self.since = started - timedelta(seconds=config['SYNC_INTERVAL'])
+            if now - self.pruned_at >= config['PRUNE_INTERVAL']:
+                timestamp = time.time()
+                self.revoked = {jti: exp for jti, exp in self.revoked.items() if exp > timestamp}
+                self.pruned_at = now
+            self.version = version
+            self.synced_at = now
+
+    def clear(self):
+        with self.lock:
+            self.revoked.clear()
+            self.since = None
+            self.version = None
+            self.synced_at = None
+
+
+revoked_access = RevokedAccessTokens()
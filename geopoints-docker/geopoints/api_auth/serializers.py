@@ -34,12 +34,12 @@ class LoginSerializer(serializers.Serializer):
 class RefreshSerializer(serializers.Serializer):
     refresh = serializers.CharField(
         required=True,
-        max_length=300
+        max_length=1000
     )
 
     def validate(self, attrs):
         token_service = TokenJWT()
-        user = token_service.validate_refresh_token(attrs.get('refresh'))
+        user = token_service.rotate_refresh_token(attrs.get('refresh'))
         if user:
             attrs['user'] = user
             return attrs
@@ -73,3 +73,16 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ['username', 'email', 'password', 'password2']
+
+
+class LogoutSerializer(serializers.Serializer):
+    refresh = serializers.CharField(
+        required=False,
+        max_length=1000
+    )
+
+    def validate_refresh(self, value):
+        user = TokenJWT().validate_refresh_token(value)
+        if not user or user != self.context['request'].user:
+            raise serializers.ValidationError('Invalid token')
+        return value
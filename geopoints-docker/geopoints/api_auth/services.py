@@ -4,7 +4,9 @@ from geopoints.settings import SECRET_KEY, JWT
 import hashlib
 import base64
 import json
+import uuid
 from django.contrib.auth import get_user_model
+from . import revocation
 
 
 class TokenJWT:
@@ -20,6 +22,7 @@ class TokenJWT:
             lifetime = JWT['REFRESH_TOKEN_LIFETIME']
         payload['exp'] = int(time.time() + lifetime.total_seconds())
         payload['token_type'] = token_type
+        payload['jti'] = uuid.uuid4().hex
         return payload
 
     def create_token(self, user, token_typ) -> str:
@@ -44,6 +47,26 @@ class TokenJWT:
             return user
         return None
 
+    def rotate_refresh_token(self, token):
+        '''Проверка refresh токена с ротацией: токен отзывается при первом использовании,
+        повторное предъявление (в т.ч. после выхода) возвращает None
+        '''
+        user = self.validate_refresh_token(token)
+        if not user:
+            return None
+        header_bs64, payload_bs64, signature = token.split('.')
+        if not revocation.revoke(self.decode_bs64(payload_bs64), signature, user=user):
+            return None
+        return user
+
+    def revoke_token(self, token, user=None):
+        '''Отзыв подписанного токена (выход), повторный отзыв не считается ошибкой'''
+        header_bs64, payload_bs64, signature = token.split('.')
+        if not self.validate_signature(header_bs64, payload_bs64, signature):
+            return False
+        revocation.revoke(self.decode_bs64(payload_bs64), signature, user=user)
+        return True
+
     @staticmethod
     def encoding_bs64(data: dict):
         data_str = json.dumps(data).encode()
@@ -1,10 +1,21 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import cache
+import base64
 import json
+import threading
+from unittest import mock
 from rest_framework.test import APIClient
 from django.urls import reverse
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from geopoints import hashing
 from .services import TokenJWT
+from datetime import timedelta
+from django.utils import timezone
+from .models import RevokedToken
+from api_geopoints.caching import bump_version
+from .revocation import VERSION_KEY, revoked_access
 
 
 class JWTAuthUnittestTest(TestCase):
@@ -72,11 +83,16 @@ class JWTAuthUnittestTest(TestCase):
         self.assertTrue(len(access) > 10)
         self.assertTrue(len(refresh) > 10)
 
-        access_token = TokenJWT().create_token(user=user, token_typ='access')
-        refresh_token = TokenJWT().create_token(user=user, token_typ='refresh')
+        access_payload = TokenJWT.decode_bs64(access.split('.')[1])
+        refresh_payload = TokenJWT.decode_bs64(refresh.split('.')[1])
+        expected_access = TokenJWT().build_token_payload(user, 'access')
+        expected_refresh = TokenJWT().build_token_payload(user, 'refresh')
 
-        self.assertEqual(access, access_token)
-        self.assertEqual(refresh, refresh_token)
+        self.assertNotEqual(access_payload.pop('jti'), refresh_payload.pop('jti'))
+        expected_access.pop('jti')
+        expected_refresh.pop('jti')
+        self.assertEqual(access_payload, expected_access)
+        self.assertEqual(refresh_payload, expected_refresh)
 
     def test_login_with_invalid_credentials(self):
         """Вход с неправильными данными"""
@@ -162,3 +178,138 @@ class JWTAuthUnittestTest(TestCase):
 
         response = self.client.get(self.login_url)
         self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+@override_settings(THROTTLE_BUCKETS={'login': {'CAPACITY': 3, 'REFILL': 0.01}})
+class LoginThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.login_url = reverse('token_obtain_pair')
+
+    def test_login_attempts_limited(self):
+        """Попытки входа с одного адреса ограничены"""
+
+        data = {'username': 'usertest', 'password': 'wrong-password'}
+        for _ in range(3):
+            response = self.client.post(self.login_url, data=data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.login_url, data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_basic_auth_guessing_limited(self):
+        """Неудачные попытки через Authorization: Basic расходуют тот же бакет, верный пароль - нет"""
+
+        get_user_model().objects.create_user(username='usertest', password='usertest12345')
+        url = reverse('points')
+
+        def basic(password):
+            credentials = base64.b64encode(f'usertest:{password}'.encode()).decode()
+            return self.client.get(url, HTTP_AUTHORIZATION=f'Basic {credentials}').status_code
+
+        for _ in range(5):
+            self.assertEqual(basic('usertest12345'), status.HTTP_200_OK)
+        for _ in range(3):
+            self.assertEqual(basic('wrong-password'), status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(basic('wrong-password'), status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(basic('usertest12345'), status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_forwarded_for_not_trusted(self):
+        """Клиент не получает новый бакет, подменяя X-Forwarded-For: учитывается адрес от прокси"""
+
+        data = {'username': 'usertest', 'password': 'wrong-password'}
+        for i in range(3):
+            self.client.post(self.login_url, data=data, format='json', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}, 192.0.2.1')
+        response = self.client.post(
+            self.login_url, data=data, format='json', HTTP_X_FORWARDED_FOR='10.0.0.99, 192.0.2.1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class TokenRevocationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='usertest', password='usertest12345')
+        self.access = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.refresh = TokenJWT().create_token(user=self.user, token_typ='refresh')
+        self.refresh_url = reverse('token_refresh')
+
+    def test_refresh_token_rotation(self):
+        """Refresh токен одноразовый: повторное использование отклоняется"""
+
+        response = self.client.post(self.refresh_url, data={'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_refresh = response.json()['refresh']
+
+        response = self.client.post(self.refresh_url, data={'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.refresh_url, data={'refresh': new_refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_tokens(self):
+        """После выхода не работают ни access, ни refresh токен"""
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        response = self.client.post(reverse('logout'), data={'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(reverse('points'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        response = self.client.post(self.refresh_url, data={'refresh': self.refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_revoked_check_without_queries(self):
+        """Проверка access токена после синхронизации не обращается к БД"""
+
+        revoked_access.clear()
+        with self.assertNumQueries(0):
+            self.assertFalse(revoked_access.is_revoked('unknown-jti'))
+
+    def test_sync_picks_up_other_workers(self):
+        """Синхронизация подтягивает токены, отозванные в другом процессе, фоновый поток один на процесс"""
+
+        revoked_access.clear()
+        revoked_access.sync_if_stale()
+        RevokedToken.objects.create(
+            jti='other-worker', token_type=RevokedToken.ACCESS, user=self.user,
+            expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        bump_version(VERSION_KEY)
+        self.assertTrue(revoked_access.sync_if_stale())
+        self.assertTrue(revoked_access.is_revoked('other-worker'))
+        self.assertFalse(revoked_access.sync_if_stale())
+
+        with override_settings(TOKEN_REVOCATION={'BACKGROUND_SYNC': True}), \
+                mock.patch('api_auth.revocation.threading.Thread') as thread:
+            revoked_access.thread_pid = None
+            revoked_access.is_revoked('unknown-jti')
+            revoked_access.is_revoked('unknown-jti')
+        thread.return_value.start.assert_called_once_with()
+        revoked_access.thread_pid = None
+
+
+@override_settings(PASSWORD_HASHING={'POOL': 'thread', 'MAX_WORKERS': 1})
+class PasswordHashingPoolTest(TestCase):
+    def test_hash_computed_in_pool(self):
+        """Хэш пароля считается в пуле потоков и совместим с PBKDF2PasswordHasher"""
+
+        threads = []
+        real_pbkdf2 = hashing.pbkdf2
+
+        def pbkdf2(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return real_pbkdf2(*args, **kwargs)
+
+        with mock.patch.object(hashing, 'pbkdf2', pbkdf2):
+            user = get_user_model().objects.create_user(username='usertest', password='usertest12345')
+            response = APIClient().post(
+                reverse('token_obtain_pair'),
+                data={'username': 'usertest', 'password': 'usertest12345'},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertTrue(PBKDF2PasswordHasher().verify('usertest12345', user.password))
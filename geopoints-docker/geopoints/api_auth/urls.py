@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import TokenObtainPairView, TokenRefreshView, RegisterView
+from .views import TokenObtainPairView, TokenRefreshView, RegisterView, LogoutView
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('registration/', RegisterView.as_view(), name='register'),
+    path('logout/', LogoutView.as_view(), name='logout'),
 ]
@@ -1,16 +1,19 @@
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from .serializers import LoginSerializer, RefreshSerializer, UserRegistrationSerializer
-from rest_framework.permissions import AllowAny
+from .serializers import LoginSerializer, RefreshSerializer, UserRegistrationSerializer, LogoutSerializer
+from .services import TokenJWT
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from api_geopoints.serializers import UserSerializer
 from rest_framework import status
 from .mixins import CreateTokenMixins
+from geopoints.throttling import LoginThrottle
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 
 class TokenObtainPairView(GenericAPIView, CreateTokenMixins):
     serializer_class = LoginSerializer
+    throttle_classes = [LoginThrottle]
 
     @swagger_auto_schema(
         operation_summary="Вход пользователя",
@@ -49,6 +52,17 @@ class TokenObtainPairView(GenericAPIView, CreateTokenMixins):
                     }
                 )
             ),
+            429: openapi.Response(
+                description="Слишком много попыток входа",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_STRING
+                        )
+                    }
+                )
+            ),
             500: openapi.Response(
                 description="Внутренняя ошибка сервера",
                 schema=openapi.Schema(
@@ -89,6 +103,8 @@ class TokenRefreshView(GenericAPIView, CreateTokenMixins):
             Обновление токенов
             - access - JWT токен для доступа к API 
             - refresh - JWT токен для обновления access токена
+
+            Refresh токен одноразовый: после обновления он отзывается, использовать нужно новый.
         """,
         request_body=RefreshSerializer,
         responses={
@@ -109,7 +125,7 @@ class TokenRefreshView(GenericAPIView, CreateTokenMixins):
                 )
             ),
             400: openapi.Response(
-                description="Неверный или просроченный refresh токен",
+                description="Неверный, просроченный или уже использованный refresh токен",
                 schema=openapi.Schema(
                     type=openapi.TYPE_OBJECT,
                     properties={
@@ -212,3 +228,71 @@ class RegisterView(GenericAPIView, CreateTokenMixins):
             return Response({
                 'error': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LogoutView(GenericAPIView):
+    serializer_class = LogoutSerializer
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Выход пользователя",
+        operation_description="""
+            Отзыв токенов до истечения срока действия.
+            - access токен из заголовка Authorization отзывается всегда
+            - refresh - refresh токен этого пользователя, отзывается если передан
+        """,
+        request_body=LogoutSerializer,
+        responses={
+            204: openapi.Response(
+                description="Токены отозваны"
+            ),
+            400: openapi.Response(
+                description="Неверный refresh токен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'refresh': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            )
+        },
+        tags=['Пользователь']
+    )
+    def post(self, request):
+        '''Отзыв access и refresh токенов'''
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token_service = TokenJWT()
+        if isinstance(request.auth, str):
+            token_service.revoke_token(request.auth, user=request.user)
+        refresh = serializer.validated_data.get('refresh')
+        if refresh:
+            token_service.revoke_token(refresh, user=request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
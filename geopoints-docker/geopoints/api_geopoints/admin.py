@@ -1,17 +1,137 @@
+import json
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from .models import Point, Message
 
 
+class EstimatedCountPaginator(Paginator):
+    '''Пагинатор списков админки без точного COUNT(*) по большим таблицам Postgres.
+    Без фильтров число строк берется из статистики pg_class.reltuples (с партициями),
+    с фильтрами считается не больше EXACT_LIMIT строк, дальше - оценка планировщика.
+    Маленькие таблицы и другие БД считаются точно
+    '''
+    EXACT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return super().count
+        if not queryset.query.where:
+            estimate = self.table_estimate(queryset)
+            return estimate if estimate > self.EXACT_LIMIT else super().count
+        counted = queryset.order_by()[:self.EXACT_LIMIT + 1].count()
+        if counted <= self.EXACT_LIMIT:
+            return counted
+        return max(counted, self.plan_estimate(queryset))
+
+    @staticmethod
+    def table_estimate(queryset):
+        table = queryset.model._meta.db_table
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                '''
+                SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint FROM pg_class c
+                WHERE c.oid = to_regclass(%s)
+                OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))
+                ''',
+                [table, table]
+            )
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def plan_estimate(queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class InputFilter(admin.SimpleListFilter):
+    '''Фильтр с полем ввода вместо списка всех значений (пользователей, точек)'''
+    template = 'admin/input_filter.html'
+    placeholder = ''
+
+    def lookups(self, request, model_admin):
+        return ((),)
+
+    def choices(self, changelist):
+        query_string = changelist.get_query_string(remove=[self.parameter_name, 'p'])
+        yield {
+            'selected': self.value() is None,
+            'query_string': query_string,
+            'query_parts': [
+                (name, value) for name, values in QueryDict(query_string.lstrip('?')).lists() for value in values
+            ],
+            'display': 'Все',
+        }
+
+
+class UsernameFilter(InputFilter):
+    title = 'пользователю'
+    parameter_name = 'username'
+    placeholder = 'Имя пользователя'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(user__username=self.value())
+        return queryset
+
+
+class PointIdFilter(InputFilter):
+    title = 'точке'
+    parameter_name = 'point_id'
+    placeholder = 'ID точки'
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value is None:
+            return queryset
+        if not value.isdigit():
+            return queryset.none()
+        return queryset.filter(point_id=int(value))
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''Общие настройки админки для таблиц на миллионы строк: оценка числа строк,
+    без второго COUNT(*) по всей таблице и без счетчиков фильтров.
+    Поиск по числу - по первичному ключу, иначе по индексируемым search_fields
+    '''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    ordering = ['-id']
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+
 @admin.register(Point)
-class PointAdmin(admin.ModelAdmin):
-    list_display = ['id', 'name', '__str__']
+class PointAdmin(LargeTableAdmin):
+    list_display = ['id', 'name', '__str__', 'user']
     list_display_links = ['id', 'name']
-    list_filter = ['user', 'created_at']
-    search_fields = ['name', 'user__username']
+    list_filter = [UsernameFilter, 'created_at']
+    list_select_related = ['user']
+    search_fields = ['name__startswith', 'user__username__exact']
+    autocomplete_fields = ['user']
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
-    list_display = ['id', '__str__']
+class MessageAdmin(LargeTableAdmin):
+    list_display = ['id', '__str__', 'created_at']
     list_display_links = ['id', '__str__']
-    list_filter = ['user', 'point', 'created_at']
+    list_filter = [UsernameFilter, PointIdFilter, 'created_at']
+    list_select_related = ['user', 'point']
+    search_fields = ['user__username__exact', 'point__name__startswith']
+    autocomplete_fields = ['user', 'point']
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ApiGeopointsConfig(AppConfig):
     name = 'api_geopoints'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import logging
+import math
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .services import Location
+
+logger = logging.getLogger('geopoints.broadcast')
+
+CHANNEL = 'geopoints_messages'
+CELL_SIZE = 1.0
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    '''Подписка клиента на новые сообщения в радиусе'''
+
+    def __init__(self, latitude, longitude, radius, loop):
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.radius = float(radius)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.cells = []
+
+    def matches(self, latitude, longitude):
+        return Location.is_point_in_radius(self.latitude, self.longitude, latitude, longitude, self.radius)[0]
+
+    def push(self, data):
+        '''Вызывается из любого потока, событие передается в цикл событий подписчика'''
+        def put():
+            if self.queue.full():
+                logger.warning('Очередь подписчика переполнена, событие пропущено')
+                return
+            self.queue.put_nowait(data)
+        self.loop.call_soon_threadsafe(put)
+
+
+class SubscriptionIndex:
+    '''Сетка ячеек CELL_SIZE градусов: ячейка -> подписки, чьи круги ее задевают'''
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def cells_for(self, subscription):
+        cells = set()
+        boxes = Location.get_bounding_boxes(subscription.latitude, subscription.longitude, subscription.radius)
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            lat_from, lon_from = self.cell(min_lat, min_lon)
+            lat_to, lon_to = self.cell(max_lat, max_lon)
+            for lat_cell in range(lat_from, lat_to + 1):
+                for lon_cell in range(lon_from, lon_to + 1):
+                    cells.add((lat_cell, lon_cell))
+        return cells
+
+    def add(self, subscription):
+        subscription.cells = self.cells_for(subscription)
+        for cell in subscription.cells:
+            self.cells.setdefault(cell, set()).add(subscription)
+
+    def remove(self, subscription):
+        for cell in subscription.cells:
+            subscribers = self.cells.get(cell)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.cells[cell]
+
+    def match(self, latitude, longitude):
+        candidates = self.cells.get(self.cell(latitude, longitude), ())
+        return [subscription for subscription in candidates if subscription.matches(latitude, longitude)]
+
+
+def load_message(message_id):
+    '''Сериализованное сообщение для рассылки, None если его уже нет'''
+    from .models import Message
+    from .serializers import MessageSerializer
+
+    message = Message.objects.filter(id=message_id).select_related('point', 'point__user').first()
+    if message is None:
+        return None
+    return json.dumps(MessageSerializer(message).data, ensure_ascii=False)
+
+
+class Hub:
+    '''Подписчики текущего процесса и рассылка им событий'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = SubscriptionIndex()
+        self.count = 0
+
+    def subscribe(self, latitude, longitude, radius):
+        subscription = Subscription(latitude, longitude, radius, asyncio.get_running_loop())
+        with self.lock:
+            self.index.add(subscription)
+            self.count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.index.remove(subscription)
+            self.count -= 1
+
+    def dispatch(self, event):
+        '''Событие {"id", "latitude", "longitude"}: сообщение загружается один раз
+        и только если нашлись подписчики
+        '''
+        with self.lock:
+            subscribers = self.index.match(event['latitude'], event['longitude'])
+        if not subscribers:
+            return 0
+        data = load_message(event['id'])
+        if data is None:
+            return 0
+        for subscription in subscribers:
+            subscription.push((event['id'], data))
+        return len(subscribers)
+
+
+class LocalBroker:
+    '''Доставка только подписчикам текущего процесса'''
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def start(self):
+        pass
+
+    def publish(self, event):
+        self.hub.dispatch(event)
+
+
+class PostgresBroker:
+    '''Доставка между процессами через Postgres LISTEN/NOTIFY.
+    Поток-слушатель запускается при первой подписке в процессе
+    '''
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, json.dumps(event)])
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.listen_forever, name='geopoints-listen', daemon=True)
+                self.thread.start()
+
+    def listen_forever(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.exception('Ошибка LISTEN %s, переподключение', CHANNEL)
+                time.sleep(1)
+
+    def listen(self):
+        import psycopg2
+
+        db = settings.DATABASES['default']
+        conn = psycopg2.connect(
+            dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'], host=db['HOST'], port=db['PORT']
+        )
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                close_old_connections()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    self.hub.dispatch(json.loads(notify.payload))
+        finally:
+            conn.close()
+
+
+BROKERS = {
+    'local': LocalBroker,
+    'postgres': PostgresBroker,
+}
+
+hub = Hub()
+broker = BROKERS[getattr(settings, 'MESSAGE_BROKER', 'local')](hub)
+
+
+def publish_message(message):
+    '''Публикация нового сообщения всем процессам'''
+    point = message.point
+    broker.publish({
+        'id': message.id,
+        'latitude': float(point.latitude),
+        'longitude': float(point.longitude),
+    })
@@ -0,0 +1,187 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+from geopoints.db_router import use_primary
+
+POINTS_VERSION_KEY = 'geopoints:points-version'
+USER_VERSION_KEY = 'geopoints:user-version:{}'
+POINT_IDS_TIMEOUT = 30
+RESPONSE_CACHE_DEFAULTS = {
+    'ENABLED': None,
+    'MAX_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 1024 * 1024,
+}
+CACHED_FORMATS = ('json', 'columnar')
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_cache_shared():
+    '''Кэш по умолчанию общий для всех воркеров (Redis), а не свой у каждого процесса.
+    Только тогда увеличенная в одном воркере версия видна остальным
+    '''
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def get_version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, timeout=None)
+
+
+def get_points_version():
+    '''Текущая версия набора точек, меняется при любом изменении Point'''
+    return get_version(POINTS_VERSION_KEY)
+
+
+def bump_points_version():
+    '''Инвалидирует все закэшированные выборки точек'''
+    bump_version(POINTS_VERSION_KEY)
+
+
+def get_user_version(user_id):
+    '''Версия данных пользователя: его точек и сообщений'''
+    return get_version(USER_VERSION_KEY.format(user_id))
+
+
+def bump_user_versions(user_ids):
+    '''Инвалидирует закэшированные ответы списков пользователей'''
+    for user_id in set(user_ids):
+        bump_version(USER_VERSION_KEY.format(user_id))
+
+
+def get_point_ids_in_radius(location):
+    '''Id точек в радиусе (список или подзапрос) с кэшированием между опросами.
+    Ключ включает версию точек, поэтому новая или измененная точка сбрасывает кэш.
+    Только с общим кэшем: иначе воркер, не видевший новую точку, пропустил бы ее сообщения,
+    а курсор since клиента ушел бы дальше них
+    '''
+    if not is_cache_shared():
+        return location.get_points().values('id')
+    key = 'geopoints:point-ids:{}:{}:{}:{}'.format(
+        get_points_version(), location.center_lat, location.center_lon, location.radius
+    )
+    point_ids = cache.get(key)
+    if point_ids is None:
+        point_ids = list(location.get_points().values_list('id', flat=True))
+        cache.set(key, point_ids, timeout=POINT_IDS_TIMEOUT)
+    return point_ids
+
+
+class ByteLRU:
+    '''LRU кэш байтов в памяти процесса, ограниченный суммарным размером значений.
+    Значения больше max_entry_bytes не кэшируются, чтобы один большой ответ не вытеснял остальные
+    '''
+
+    def __init__(self, max_bytes, max_entry_bytes, size=len):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size_of = size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self.size_of(value)
+        if size > self.max_entry_bytes:
+            return False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.size_of(old)
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.size_of(evicted)
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+def get_response_cache_config():
+    return {**RESPONSE_CACHE_DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def is_response_cache_enabled():
+    '''ENABLED=None: кэш ответов включен только при общем кэше версий.
+    С локальным кэшем запись через другой воркер не сбрасывает байты этого процесса
+    '''
+    enabled = get_response_cache_config()['ENABLED']
+    return is_cache_shared() if enabled is None else enabled
+
+
+def build_response_cache():
+    config = get_response_cache_config()
+    return ByteLRU(config['MAX_BYTES'], config['MAX_ENTRY_BYTES'])
+
+
+response_cache = build_response_cache()
+
+
+class RenderedResponse(Response):
+    '''Response с уже готовыми байтами тела. data заполнен только если ответ собирался заново'''
+
+    def __init__(self, content, data=None, **kwargs):
+        super().__init__(data, **kwargs)
+        self.content_bytes = content
+
+    @property
+    def rendered_content(self):
+        renderer = self.accepted_renderer
+        content_type = self.accepted_media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        self['Content-Type'] = content_type
+        return self.content_bytes
+
+
+def get_user_list_response(request, view, kind, get_data):
+    '''Ответ со списком объектов пользователя из байтов, закэшированных в процессе.
+    Ключ - пользователь, его версия, формат ответа и fields, поэтому повторное чтение
+    стоит одного обращения к кэшу версий. При промахе данные читаются с основной БД,
+    чтобы отставшая реплика не попала в кэш под новой версией.
+    Возвращает None для форматов, которые не кэшируются, и если кэш ответов выключен
+    '''
+    renderer = request.accepted_renderer
+    if renderer.format not in CACHED_FORMATS or not is_response_cache_enabled():
+        return None
+    media_type = request.accepted_media_type
+    key = (
+        kind, request.user.id, get_user_version(request.user.id),
+        renderer.format, media_type, request.query_params.get('fields', '')
+    )
+    content = response_cache.get(key)
+    if content is not None:
+        return RenderedResponse(content)
+    token = use_primary.set(True)
+    try:
+        data = get_data()
+    finally:
+        use_primary.reset(token)
+    content = renderer.render(data, media_type, view.get_renderer_context())
+    response_cache.set(key, content)
+    return RenderedResponse(content, data)
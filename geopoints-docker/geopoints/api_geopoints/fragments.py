@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import ByteLRU, RenderedResponse, is_cache_shared
+from .serializers import PointSerializer, UserSerializer, MessageSerializer
+
+FRAGMENT_CACHE_DEFAULTS = {
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'MAX_ENTRY_BYTES': 64 * 1024,
+}
+USER_FRAGMENT_KEY = 'geopoints:user-fragment:{}'
+USER_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+def parts_size(parts):
+    return len(parts[0]) + len(parts[1])
+
+
+def build_point_fragments():
+    config = {**FRAGMENT_CACHE_DEFAULTS, **getattr(settings, 'FRAGMENT_CACHE', {})}
+    return ByteLRU(config['MAX_BYTES'], config['MAX_ENTRY_BYTES'], size=parts_size)
+
+
+# Ключ (id, update_at) не меняется для одной версии точки, поэтому кэш процесса не нужно сбрасывать
+point_fragments = build_point_fragments()
+
+
+def forget_user(user_id):
+    '''Сброс JSON пользователя после смены имени или email'''
+    cache.delete(USER_FRAGMENT_KEY.format(user_id))
+
+
+class FragmentBuilder:
+    '''Сборка JSON ответа из готовых фрагментов.
+    Точка хранится как байты до и после поля user, пользователь - отдельно (общий кэш по id, только Redis),
+    поэтому сериализуются только новые или измененные точки, а не все строки ответа.
+    Байты совпадают с выводом сериализаторов через тот же рендерер
+    '''
+
+    def __init__(self, request, view):
+        self.renderer = request.accepted_renderer
+        self.media_type = request.accepted_media_type
+        self.context = view.get_renderer_context()
+        self.users = {}
+
+    @classmethod
+    def for_request(cls, request, view):
+        '''Только для обычного JSON: без fields и без отступов'''
+        renderer = request.accepted_renderer
+        if renderer.format != 'json' or request.query_params.get('fields'):
+            return None
+        if renderer.get_indent(request.accepted_media_type, view.get_renderer_context()):
+            return None
+        return cls(request, view)
+
+    def render(self, data):
+        return self.renderer.render(data, self.media_type, self.context)
+
+    def split(self, data, slot):
+        '''Байты объекта data до значения поля slot (включая ключ) и после него'''
+        keys = list(data)
+        index = keys.index(slot)
+        before = self.render({key: data[key] for key in keys[:index]})[:-1]
+        after = self.render({key: data[key] for key in keys[index + 1:]})
+        head = before + (b',' if index else b'') + self.render(slot) + b':'
+        tail = (b',' + after[1:]) if index + 1 < len(keys) else b'}'
+        return head, tail
+
+    def load_users(self, users):
+        '''JSON пользователей из общего кэша одним запросом, отсутствующие сериализуются.
+        С локальным кэшем процесса forget_user сбросил бы только свой воркер,
+        поэтому тогда пользователи сериализуются заново в каждом ответе
+        '''
+        users = {user.id: user for user in users if user.id not in self.users}
+        if not users:
+            return
+        if not is_cache_shared():
+            for user_id, user in users.items():
+                self.users[user_id] = self.render(UserSerializer(user).data)
+            return
+        keys = {USER_FRAGMENT_KEY.format(user_id): user_id for user_id in users}
+        found = cache.get_many(keys)
+        missing = {}
+        for key, user_id in keys.items():
+            if key in found:
+                self.users[user_id] = found[key]
+            else:
+                self.users[user_id] = missing[key] = self.render(UserSerializer(users[user_id]).data)
+        if missing:
+            cache.set_many(missing, timeout=USER_FRAGMENT_TIMEOUT)
+
+    def point(self, point):
+        key = (point.id, point.update_at)
+        parts = point_fragments.get(key)
+        if parts is None:
+            parts = self.split(PointSerializer(point).data, 'user')
+            point_fragments.set(key, parts)
+        if point.user_id not in self.users:
+            self.load_users([point.user])
+        return parts[0] + self.users[point.user_id] + parts[1]
+
+    def points(self, points):
+        points = list(points)
+        self.load_users([point.user for point in points])
+        return self.join(self.point(point) for point in points)
+
+    def message(self, message):
+        '''Поля сообщения сериализуются каждый раз, вложенная точка берется из фрагментов'''
+        data = MessageSerializer(message, context={'detail': False}).data
+        data.pop('point', None)
+        data['point'] = None
+        head, tail = self.split(data, 'point')
+        return head + self.point(message.point) + tail
+
+    def messages(self, messages):
+        messages = list(messages)
+        self.load_users([message.point.user for message in messages])
+        return self.join(self.message(message) for message in messages)
+
+    @staticmethod
+    def join(items):
+        return b'[' + b','.join(items) + b']'
+
+    @staticmethod
+    def response(content):
+        return RenderedResponse(content)
@@ -0,0 +1,155 @@
+import math
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import HeatmapCell, Point, MICRODEGREES
+
+# Пирамида счетчиков точек по тайлам Web Mercator (x, y как у тайлов карты) для zoom 0..MAX_ZOOM.
+# Тайл на zoom z - родитель тайлов (2x, 2y)..(2x+1, 2y+1) на zoom z+1, поэтому номер тайла
+# считается один раз на MAX_ZOOM, а для меньших zoom получается сдвигом.
+# Сигналы точки меняют счетчики одним INSERT ... ON CONFLICT после коммита изменения (on_commit):
+# строку (0, 0, 0) меняет каждая запись точки, и в транзакции точки ее блокировка держалась бы
+# до коммита, выстраивая все записи точек (и целые пачки импорта) в очередь.
+# Изменение, не примененное из-за падения процесса между коммитом и on_commit, исправляет
+# пересборка (manage.py rebuild_heatmap), она же нужна для заполнения и после массовых операций без сигналов
+
+MAX_LATITUDE = 85.0511287798
+
+DEFAULTS = {
+    'MAX_ZOOM': 12,
+    'MAX_CELLS': 65536,
+}
+
+BATCH_SIZE = 5000
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'HEATMAP', {}))
+    return config
+
+
+def tile(latitude_e6, longitude_e6, zoom):
+    '''Номер тайла (x, y) точки на zoom'''
+    n = 1 << zoom
+    latitude = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude_e6 / MICRODEGREES)))
+    x = int((longitude_e6 / MICRODEGREES + 180) / 360 * n)
+    y = int((1 - math.log(math.tan(latitude) + 1 / math.cos(latitude)) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_center(x, y, zoom):
+    '''Широта и долгота центра тайла'''
+    n = 1 << zoom
+    longitude = (x + 0.5) / n * 360 - 180
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 0.5) / n))))
+    return round(latitude, 6), round(longitude, 6)
+
+
+def pyramid(latitude_e6, longitude_e6, max_zoom=None):
+    '''Тайлы точки на всех zoom: [(zoom, x, y), ...]'''
+    max_zoom = get_config()['MAX_ZOOM'] if max_zoom is None else max_zoom
+    x, y = tile(latitude_e6, longitude_e6, max_zoom)
+    return [(zoom, x >> (max_zoom - zoom), y >> (max_zoom - zoom)) for zoom in range(max_zoom + 1)]
+
+
+def apply_delta(latitude_e6, longitude_e6, delta):
+    '''Изменение счетчиков всех уровней пирамиды для одной точки одним запросом'''
+    tiles = pyramid(latitude_e6, longitude_e6)
+    table = connection.ops.quote_name(HeatmapCell._meta.db_table)
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(tiles))
+    params = [value for zoom, x, y in tiles for value in (zoom, x, y, delta)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'''
+            INSERT INTO {table} (zoom, x, y, count) VALUES {values}
+            ON CONFLICT (zoom, x, y) DO UPDATE SET count = {table}.count + excluded.count
+            ''',
+            params
+        )
+
+
+def apply_after_commit(latitude_e6, longitude_e6, delta):
+    '''Изменение счетчиков после коммита текущей транзакции, отдельным коротким запросом'''
+    transaction.on_commit(partial(apply_delta, latitude_e6, longitude_e6, delta))
+
+
+def add_point(point):
+    apply_after_commit(point.latitude_e6, point.longitude_e6, 1)
+
+
+def remove_point(point):
+    apply_after_commit(point.latitude_e6, point.longitude_e6, -1)
+
+
+def move_point(previous, point):
+    '''Точка сменила координаты: previous - прежние (latitude_e6, longitude_e6).
+    В пределах одного тайла MAX_ZOOM счетчики не меняются ни на одном уровне
+    '''
+    max_zoom = get_config()['MAX_ZOOM']
+    if tile(*previous, max_zoom) == tile(point.latitude_e6, point.longitude_e6, max_zoom):
+        return
+    apply_after_commit(*previous, -1)
+    add_point(point)
+
+
+def rebuild():
+    '''Пересчет пирамиды по таблице точек, возвращает число ненулевых счетчиков.
+    В Postgres таблица счетчиков блокируется до чтения точек: изменения точек, закоммиченные
+    после начала выборки, ждут конца пересборки и применяются поверх нее. Точка, закоммиченная
+    в момент взятия блокировки, но еще не применившая on_commit, может быть учтена дважды,
+    поэтому пересборку лучше запускать при небольшой нагрузке на запись
+    '''
+    max_zoom = get_config()['MAX_ZOOM']
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(HeatmapCell._meta.db_table)} IN EXCLUSIVE MODE')
+        counts = Counter(
+            tile(latitude_e6, longitude_e6, max_zoom)
+            for latitude_e6, longitude_e6 in Point.objects.values_list('latitude_e6', 'longitude_e6').iterator(
+                chunk_size=10000
+            )
+        )
+        cells = []
+        for zoom in range(max_zoom, -1, -1):
+            cells.extend(HeatmapCell(zoom=zoom, x=x, y=y, count=count) for (x, y), count in counts.items())
+            parents = Counter()
+            for (x, y), count in counts.items():
+                parents[x >> 1, y >> 1] += count
+            counts = parents
+        HeatmapCell.objects.all().delete()
+        HeatmapCell.objects.bulk_create(cells, batch_size=BATCH_SIZE)
+    return len(cells)
+
+
+def tile_ranges(south, west, north, east, zoom):
+    '''Диапазоны x и y тайлов прямоугольника: [(x_from, x_to)], (y_from, y_to).
+    Если западная долгота больше восточной, диапазонов x два (через антимеридиан)
+    '''
+    west_x, north_y = tile(round(north * MICRODEGREES), round(west * MICRODEGREES), zoom)
+    east_x, south_y = tile(round(south * MICRODEGREES), round(east * MICRODEGREES), zoom)
+    if west <= east:
+        x_ranges = [(west_x, east_x)]
+    else:
+        x_ranges = [(west_x, (1 << zoom) - 1), (0, east_x)]
+    return x_ranges, (north_y, south_y)
+
+
+def count_cells(x_ranges, y_range):
+    return sum(x_to - x_from + 1 for x_from, x_to in x_ranges) * (y_range[1] - y_range[0] + 1)
+
+
+def get_cells(zoom, x_ranges, y_range):
+    '''Ненулевые счетчики тайлов в диапазонах, по индексу (zoom, x, y)'''
+    cells = []
+    for x_from, x_to in x_ranges:
+        cells.extend(
+            HeatmapCell.objects.filter(
+                zoom=zoom, x__gte=x_from, x__lte=x_to, y__gte=y_range[0], y__lte=y_range[1], count__gt=0
+            ).order_by('x', 'y').values_list('x', 'y', 'count')
+        )
+    return cells
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api_geopoints import spatial_index
+
+
+class Command(BaseCommand):
+    help = 'Сборка файла пространственного индекса точек и атомарная подмена файла для воркеров'
+
+    def add_arguments(self, parser):
+        config = spatial_index.get_config()
+        parser.add_argument('--path', default=config['PATH'], help='Путь к файлу, по умолчанию SPATIAL_INDEX PATH')
+        parser.add_argument('--cell-size', type=float, default=config['CELL_SIZE'], help='Размер ячейки в градусах')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError('Не задан путь: --path или SPATIAL_INDEX_PATH')
+        if not 0 < options['cell_size'] <= 10:
+            raise CommandError('--cell-size должен быть больше 0 и не больше 10')
+        start = time.perf_counter()
+        count = spatial_index.build(options['path'], options['cell_size'])
+        self.stdout.write(f'Проиндексировано точек: {count} за {time.perf_counter() - start:.1f} c')
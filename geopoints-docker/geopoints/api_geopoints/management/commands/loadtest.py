@@ -0,0 +1,330 @@
+import base64
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MIX = 'search=40,messages_search=20,points=10,messages=10,create_point=10,create_message=5,refresh=5'
+
+
+def percentile(values, percent):
+    '''Перцентиль по отсортированному списку (метод ближайшего ранга)'''
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def parse_mix(mix):
+    '''Разбор строки вида "search=40,refresh=5" в список (действие, вес)'''
+    result = []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in LoadClient.ACTIONS:
+            raise CommandError(f'Неизвестное действие в --mix: {name}')
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise CommandError(f'Некорректный вес для {name}: {weight}')
+        if weight > 0:
+            result.append((name, weight))
+    if not result:
+        raise CommandError('Пустой --mix')
+    return result
+
+
+class Stats:
+    '''Потокобезопасный сбор задержек и ошибок по endpoint'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint, latency, status):
+        with self.lock:
+            self.latencies[endpoint].append(latency)
+            self.statuses[endpoint][status] += 1
+            if status == 0 or status >= 400:
+                self.errors[endpoint] += 1
+
+    def report(self, elapsed):
+        rows = []
+        total = 0
+        total_errors = 0
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            count = len(values)
+            errors = self.errors[endpoint]
+            total += count
+            total_errors += errors
+            rows.append({
+                'endpoint': endpoint,
+                'count': count,
+                'rps': count / elapsed if elapsed else 0.0,
+                'errors': errors,
+                'error_rate': errors / count * 100 if count else 0.0,
+                'p50': percentile(values, 50) * 1000,
+                'p90': percentile(values, 90) * 1000,
+                'p99': percentile(values, 99) * 1000,
+                'max': values[-1] * 1000 if values else 0.0,
+                'statuses': dict(self.statuses[endpoint]),
+            })
+        return {
+            'elapsed': elapsed,
+            'total': total,
+            'rps': total / elapsed if elapsed else 0.0,
+            'errors': total_errors,
+            'error_rate': total_errors / total * 100 if total else 0.0,
+            'endpoints': rows,
+        }
+
+
+class LoadClient:
+    '''HTTP клиент нагрузочного теста с общей парой JWT токенов'''
+
+    ACTIONS = ['search', 'messages_search', 'points', 'messages', 'create_point', 'create_message', 'refresh']
+
+    def __init__(self, base_url, username, password, stats, timeout, center, spread, radius):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.timeout = timeout
+        self.center = center
+        self.spread = spread
+        self.radius = radius
+        self.lock = threading.Lock()
+        # refresh токен одноразовый (ротация), параллельные обновления одним токеном получили бы 400
+        self.refresh_lock = threading.Lock()
+        self.access = None
+        self.refresh_token = None
+        self.point_ids = []
+
+    def request(self, endpoint, method, path, data=None, params=None, auth=True, headers=None):
+        '''Выполняет запрос и записывает задержку, возвращает (статус, тело)'''
+        url = f'{self.base_url}{path}'
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(url, data=body, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if auth and self.access:
+            request.add_header('Authorization', f'Bearer {self.access}')
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, payload = 0, b''
+        self.stats.add(endpoint, time.perf_counter() - start, status)
+        return status, payload
+
+    def login(self, register=False):
+        '''Получение пары токенов через TokenObtainPairView'''
+        status, payload = self.request(
+            'login', 'POST', '/api/auth/token/',
+            data={'username': self.username, 'password': self.password}, auth=False
+        )
+        if status != 200 and register:
+            status, payload = self.request(
+                'register', 'POST', '/api/auth/registration/',
+                data={
+                    'username': self.username,
+                    'email': f'{self.username}@example.com',
+                    'password': self.password,
+                    'password2': self.password,
+                },
+                auth=False
+            )
+        if status != 200:
+            raise CommandError(f'Не удалось войти под {self.username}: HTTP {status} {payload[:200]!r}')
+        tokens = json.loads(payload)
+        with self.lock:
+            self.access, self.refresh_token = tokens['access'], tokens['refresh']
+
+    def login_burst(self):
+        '''Вход с проверкой пароля через BasicAuthentication: тот же PBKDF2, что и в /api/auth/token/,
+        но верный пароль не расходует попытки LoginThrottle, поэтому поток входов не упирается в 429
+        '''
+        credentials = base64.b64encode(f'{self.username}:{self.password}'.encode()).decode()
+        status, _ = self.request(
+            'login burst (basic)', 'GET', '/api/points/', params={'fields': 'id'}, auth=False,
+            headers={'Authorization': f'Basic {credentials}'}
+        )
+        return status
+
+    def random_center(self):
+        lat = max(-90.0, min(90.0, self.center[0] + random.uniform(-self.spread, self.spread)))
+        lon = max(-180.0, min(180.0, self.center[1] + random.uniform(-self.spread, self.spread)))
+        return round(lat, 6), round(lon, 6)
+
+    def search_params(self):
+        lat, lon = self.random_center()
+        return {'latitude': lat, 'longitude': lon, 'radius': round(random.uniform(*self.radius), 2)}
+
+    def run(self, action):
+        status = getattr(self, f'do_{action}')()
+        if status in (401, 403):
+            self.login()
+
+    def do_search(self):
+        status, _ = self.request('points/search', 'GET', '/api/points/search/', params=self.search_params())
+        return status
+
+    def do_messages_search(self):
+        status, _ = self.request(
+            'points/messages/search', 'GET', '/api/points/messages/search/', params=self.search_params()
+        )
+        return status
+
+    def do_points(self):
+        status, _ = self.request('points', 'GET', '/api/points/')
+        return status
+
+    def do_messages(self):
+        status, _ = self.request('points/messages', 'GET', '/api/points/messages/')
+        return status
+
+    def do_create_point(self):
+        lat, lon = self.random_center()
+        status, payload = self.request('points [POST]', 'POST', '/api/points/', data={
+            'name': f'loadtest {random.randint(0, 10 ** 6)}',
+            'description': 'loadtest',
+            'latitude': lat,
+            'longitude': lon,
+        })
+        if status == 201:
+            with self.lock:
+                self.point_ids.append(json.loads(payload)['id'])
+        return status
+
+    def do_create_message(self):
+        with self.lock:
+            point_id = random.choice(self.point_ids) if self.point_ids else None
+        if point_id is None:
+            return self.do_create_point()
+        status, _ = self.request('points/messages [POST]', 'POST', '/api/points/messages/', data={
+            'point': point_id,
+            'content': f'loadtest {random.randint(0, 10 ** 6)}',
+        })
+        return status
+
+    def do_refresh(self):
+        with self.refresh_lock:
+            with self.lock:
+                refresh = self.refresh_token
+            status, payload = self.request(
+                'token/refresh', 'POST', '/api/auth/token/refresh/', data={'refresh': refresh}, auth=False
+            )
+            if status == 200:
+                tokens = json.loads(payload)
+                with self.lock:
+                    self.access, self.refresh_token = tokens['access'], tokens['refresh']
+        return status
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест API запущенного сервера: пропускная способность, перцентили задержек и ошибки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Адрес сервера')
+        parser.add_argument('--username', default='loadtest', help='Пользователь для входа')
+        parser.add_argument('--password', default='loadtest-password-12345', help='Пароль пользователя')
+        parser.add_argument('--register', action='store_true', help='Зарегистрировать пользователя, если вход не удался')
+        parser.add_argument('--concurrency', type=int, default=10, help='Количество параллельных клиентов')
+        parser.add_argument('--duration', type=float, default=30.0, help='Длительность теста в секундах')
+        parser.add_argument('--requests', type=int, default=0, help='Общее число запросов (0 - ограничение только по времени)')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Веса действий, по умолчанию "{DEFAULT_MIX}"')
+        parser.add_argument('--latitude', type=float, default=55.7558, help='Широта центра генерируемых координат')
+        parser.add_argument('--longitude', type=float, default=37.6173, help='Долгота центра генерируемых координат')
+        parser.add_argument('--spread', type=float, default=1.0, help='Разброс координат в градусах')
+        parser.add_argument('--min-radius', type=float, default=1.0, help='Минимальный радиус поиска в км')
+        parser.add_argument('--max-radius', type=float, default=50.0, help='Максимальный радиус поиска в км')
+        parser.add_argument('--timeout', type=float, default=10.0, help='Таймаут запроса в секундах')
+        parser.add_argument(
+            '--login-burst', type=int, default=0,
+            help='Дополнительные клиенты, непрерывно входящие по паролю: задержки остальных запросов '
+                 'во время всплеска входов (сравнить с PASSWORD_HASH_POOL=inline на сервере)'
+        )
+        parser.add_argument('--json', action='store_true', help='Вывести отчет в формате JSON')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должен быть больше 0')
+        mix = parse_mix(options['mix'])
+        actions = [name for name, _ in mix]
+        weights = [weight for _, weight in mix]
+
+        stats = Stats()
+        client = LoadClient(
+            options['url'], options['username'], options['password'], stats, options['timeout'],
+            center=(options['latitude'], options['longitude']),
+            spread=options['spread'],
+            radius=(options['min_radius'], options['max_radius']),
+        )
+        client.login(register=options['register'])
+
+        deadline = time.monotonic() + options['duration']
+        remaining = [options['requests']]
+        counter_lock = threading.Lock()
+
+        def take():
+            if time.monotonic() >= deadline:
+                return False
+            if options['requests']:
+                with counter_lock:
+                    if remaining[0] <= 0:
+                        return False
+                    remaining[0] -= 1
+            return True
+
+        def worker():
+            while take():
+                client.run(random.choices(actions, weights)[0])
+
+        def burst():
+            while time.monotonic() < deadline and (not options['requests'] or remaining[0] > 0):
+                client.login_burst()
+
+        start = time.perf_counter()
+        workers = options['concurrency'] + max(options['login_burst'], 0)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(worker) for _ in range(options['concurrency'])]
+            futures += [pool.submit(burst) for _ in range(max(options['login_burst'], 0))]
+            for future in futures:
+                future.result()
+        report = stats.report(time.perf_counter() - start)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self.print_report(report, options['concurrency'])
+
+    def print_report(self, report, concurrency):
+        header = f'{"endpoint":<26}{"count":>8}{"rps":>9}{"err%":>7}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in report['endpoints']:
+            self.stdout.write(
+                f'{row["endpoint"]:<26}{row["count"]:>8}{row["rps"]:>9.1f}{row["error_rate"]:>7.1f}'
+                f'{row["p50"]:>9.1f}{row["p90"]:>9.1f}{row["p99"]:>9.1f}{row["max"]:>9.1f}'
+            )
+        self.stdout.write('-' * len(header))
+        self.stdout.write(
+            f'Всего: {report["total"]} запросов за {report["elapsed"]:.1f} c, '
+            f'{report["rps"]:.1f} rps, ошибок {report["error_rate"]:.1f}%, клиентов {concurrency}'
+        )
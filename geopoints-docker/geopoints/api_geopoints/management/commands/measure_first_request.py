@@ -0,0 +1,100 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api_auth.services import TokenJWT
+
+DEFAULT_PATH = '/api/points/search/?latitude=55.7558&longitude=37.6173&radius=10'
+
+
+class Command(BaseCommand):
+    help = (
+        'Задержка первого запроса в новом процессе (как у воркера после перезапуска) '
+        'без прогрева и после geopoints.warmup.warm_worker'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Пользователь для JWT, по умолчанию первый в БД')
+        parser.add_argument('--path', default=DEFAULT_PATH, help='Запрос, который измеряется')
+        parser.add_argument('--runs', type=int, default=5, help='Число новых процессов на каждый режим')
+        parser.add_argument('--json', action='store_true', help='Вывести отчет в формате JSON')
+        parser.add_argument('--child', action='store_true', help='Служебный: измерение внутри нового процесса')
+        parser.add_argument('--warm', action='store_true', help='Служебный: прогреть процесс перед запросом')
+        parser.add_argument('--token', help='Служебный: access токен')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.measure(options)
+        if options['runs'] < 1:
+            raise CommandError('--runs должен быть больше 0')
+        users = get_user_model().objects.order_by('id')
+        user = users.filter(username=options['username']).first() if options['username'] else users.first()
+        if user is None:
+            raise CommandError('Нет пользователя для JWT токена')
+        token = TokenJWT().create_token(user=user, token_typ='access')
+
+        report = {}
+        for mode in ('cold', 'warm'):
+            runs = [self.spawn(options, token, warm=mode == 'warm') for _ in range(options['runs'])]
+            report[mode] = {
+                key: statistics.median(run[key] for run in runs)
+                for key in ('warmup', 'first', 'second')
+            }
+            report[mode]['status'] = runs[-1]['status']
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(f'{"режим":<8}{"прогрев мс":>12}{"1-й запрос мс":>15}{"2-й запрос мс":>15}{"HTTP":>6}')
+        for mode, row in report.items():
+            self.stdout.write(
+                f'{mode:<8}{row["warmup"]:>12.1f}{row["first"]:>15.1f}{row["second"]:>15.1f}{row["status"]:>6}'
+            )
+        self.stdout.write(f'Медиана по {options["runs"]} процессам на режим, запрос {options["path"]}')
+
+    def spawn(self, options, token, warm):
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'measure_first_request',
+            '--child', '--path', options['path'], '--token', token,
+        ]
+        if warm:
+            command.append('--warm')
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'Процесс измерения завершился с ошибкой:\n{result.stderr[-2000:]}')
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+    def measure(self, options):
+        '''Выполняется в новом процессе: django.setup() уже сделан manage.py, как у воркера после импорта WSGI'''
+        from django.test import Client
+
+        # адрес вне INTERNAL_IPS: без debug toolbar, как у запроса извне
+        client = Client(SERVER_NAME='localhost', REMOTE_ADDR='192.0.2.1', HTTP_AUTHORIZATION=f'Bearer {options["token"]}')
+        # middleware загружается при создании WSGI приложения, до первого запроса воркера
+        client.handler.load_middleware()
+        warmup_ms = 0.0
+        if options['warm']:
+            from geopoints import warmup
+
+            start = time.perf_counter()
+            warmup.warm_worker()
+            warmup_ms = (time.perf_counter() - start) * 1000
+        # как в post_worker_init: тестовый Client отключает close_old_connections, и соединение,
+        # открытое прогревом, иначе досталось бы запросу, чего под gevent не бывает
+        connections.close_all()
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            response = client.get(options['path'])
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(json.dumps({
+            'warmup': warmup_ms, 'first': timings[0], 'second': timings[1], 'status': response.status_code,
+        }))
@@ -0,0 +1,62 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api_geopoints import partitions
+
+
+class Command(BaseCommand):
+    help = '''Секционирование таблицы сообщений по месяцам (только Postgres).
+    convert - перевести таблицу в секционированную,
+    create - создать партиции на следующие месяцы (запускать по расписанию),
+    archive - выгрузить старые партиции в gzip NDJSON и удалить их,
+    status - список партиций'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['convert', 'create', 'archive', 'status'])
+        parser.add_argument('--months-ahead', type=int, default=3, help='Сколько месяцев вперед создавать партиции')
+        parser.add_argument('--keep-months', type=int, default=12, help='Сколько последних месяцев не архивировать')
+        parser.add_argument('--output-dir', default='.', help='Каталог для архивов')
+        parser.add_argument('--detach-only', action='store_true', help='Только отсоединить партиции, без выгрузки и удаления')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Секционирование поддерживается только в Postgres')
+        action = options['action']
+        if action != 'convert' and not partitions.is_partitioned():
+            raise CommandError('Таблица сообщений не секционирована, сначала выполните convert')
+        getattr(self, f'handle_{action}')(options)
+
+    def handle_convert(self, options):
+        if partitions.is_partitioned():
+            raise CommandError('Таблица сообщений уже секционирована')
+        partitions.convert(options['months_ahead'])
+        self.stdout.write(f'Таблица {partitions.TABLE} секционирована')
+        self.handle_status(options)
+
+    def handle_create(self, options):
+        created = partitions.create_partitions(options['months_ahead'])
+        for name in created:
+            self.stdout.write(f'Создана партиция {name}')
+        if not created:
+            self.stdout.write('Все партиции уже есть')
+
+    def handle_archive(self, options):
+        expired = partitions.expired_partitions(options['keep_months'])
+        if not options['detach_only']:
+            os.makedirs(options['output_dir'], exist_ok=True)
+        for name, start in expired:
+            if options['detach_only']:
+                partitions.remove_partition(name, start, drop=False)
+                self.stdout.write(f'Партиция {name} отсоединена')
+                continue
+            path, count = partitions.archive_partition(name, options['output_dir'])
+            partitions.remove_partition(name, start)
+            self.stdout.write(f'Партиция {name}: {count} сообщений выгружено в {path} и удалено')
+        if not expired:
+            self.stdout.write('Нет партиций для архивации')
+
+    def handle_status(self, options):
+        for name, start, rows in partitions.list_partitions():
+            self.stdout.write(f'{name:<40}{start.strftime("%Y-%m") if start else "default":>10}{rows:>12}')
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api_geopoints import heatmap
+
+
+class Command(BaseCommand):
+    help = 'Пересчет пирамиды счетчиков тепловой карты по таблице точек (заполнение и исправление после массовых операций)'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = heatmap.rebuild()
+        self.stdout.write(
+            f'Ячеек тепловой карты: {count} (zoom 0-{heatmap.get_config()["MAX_ZOOM"]}) '
+            f'за {time.perf_counter() - start:.1f} c'
+        )
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api_geopoints import readmodel
+
+
+class Command(BaseCommand):
+    help = 'Перестроение денормализованной таблицы MessageIndex для поиска сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=readmodel.BATCH_SIZE, help='Размер пачки вставки')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        if not readmodel.is_enabled():
+            self.stderr.write('MESSAGE_READ_MODEL выключен: индекс не будет обновляться при записи')
+        start = time.perf_counter()
+        with transaction.atomic():
+            count = readmodel.rebuild(options['batch_size'])
+        self.stdout.write(f'Проиндексировано сообщений: {count} за {time.perf_counter() - start:.1f} c')
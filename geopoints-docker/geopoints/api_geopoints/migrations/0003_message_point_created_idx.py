@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0002_alter_point_description'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['point', 'created_at'], name='message_point_created_idx'),
+        ),
+    ]
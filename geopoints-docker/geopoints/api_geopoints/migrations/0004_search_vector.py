@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:40
+
+from django.db import migrations
+
+FORWARD_SQL = [
+    '''
+    ALTER TABLE api_geopoints_point ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))
+    ) STORED
+    ''',
+    'CREATE INDEX point_search_vector_idx ON api_geopoints_point USING gin (search_vector)',
+    '''
+    ALTER TABLE api_geopoints_message ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+    ''',
+    'CREATE INDEX message_search_vector_idx ON api_geopoints_message USING gin (search_vector)',
+]
+
+BACKWARD_SQL = [
+    'ALTER TABLE api_geopoints_point DROP COLUMN search_vector',
+    'ALTER TABLE api_geopoints_message DROP COLUMN search_vector',
+]
+
+
+def run_postgres(statements):
+    '''Колонки tsvector есть только в Postgres, в остальных БД поиск идет без индекса'''
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0003_message_point_created_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres(FORWARD_SQL), run_postgres(BACKWARD_SQL)),
+    ]
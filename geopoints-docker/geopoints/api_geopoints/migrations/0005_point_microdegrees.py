@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:40
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def to_microdegrees(value):
+    return int(Decimal(str(value)).quantize(Decimal('0.000001')).scaleb(6))
+
+
+def backfill_microdegrees(apps, schema_editor):
+    '''Заполнение координат в микроградусах для существующих точек пачками'''
+    Point = apps.get_model('api_geopoints', 'Point')
+    batch = []
+    points = Point.objects.filter(latitude_e6__isnull=True).only('id', 'latitude', 'longitude')
+    for point in points.iterator(chunk_size=BATCH_SIZE):
+        point.latitude_e6 = to_microdegrees(point.latitude)
+        point.longitude_e6 = to_microdegrees(point.longitude)
+        batch.append(point)
+        if len(batch) >= BATCH_SIZE:
+            Point.objects.bulk_update(batch, ['latitude_e6', 'longitude_e6'])
+            batch = []
+    if batch:
+        Point.objects.bulk_update(batch, ['latitude_e6', 'longitude_e6'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0004_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='point',
+            name='latitude_e6',
+            field=models.IntegerField(editable=False, null=True, verbose_name='Широта в микроградусах'),
+        ),
+        migrations.AddField(
+            model_name='point',
+            name='longitude_e6',
+            field=models.IntegerField(editable=False, null=True, verbose_name='Долгота в микроградусах'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['latitude_e6', 'longitude_e6'], name='point_coordinates_e6_idx'),
+        ),
+        migrations.RunPython(backfill_microdegrees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:10
+
+import math
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+
+
+def backfill_unit_vector(apps, schema_editor):
+    '''Заполнение векторов на единичной сфере для существующих точек пачками'''
+    Point = apps.get_model('api_geopoints', 'Point')
+    fields = ['unit_x', 'unit_y', 'unit_z']
+    batch = []
+    points = Point.objects.filter(unit_x__isnull=True).only('id', 'latitude_e6', 'longitude_e6')
+    for point in points.iterator(chunk_size=BATCH_SIZE):
+        rad_lat = math.radians(point.latitude_e6 / 10 ** 6)
+        rad_lon = math.radians(point.longitude_e6 / 10 ** 6)
+        point.unit_x = math.cos(rad_lat) * math.cos(rad_lon)
+        point.unit_y = math.cos(rad_lat) * math.sin(rad_lon)
+        point.unit_z = math.sin(rad_lat)
+        batch.append(point)
+        if len(batch) >= BATCH_SIZE:
+            Point.objects.bulk_update(batch, fields)
+            batch = []
+    if batch:
+        Point.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0005_point_microdegrees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='point',
+            name='unit_x',
+            field=models.FloatField(editable=False, null=True, verbose_name='X на единичной сфере'),
+        ),
+        migrations.AddField(
+            model_name='point',
+            name='unit_y',
+            field=models.FloatField(editable=False, null=True, verbose_name='Y на единичной сфере'),
+        ),
+        migrations.AddField(
+            model_name='point',
+            name='unit_z',
+            field=models.FloatField(editable=False, null=True, verbose_name='Z на единичной сфере'),
+        ),
+        migrations.RunPython(backfill_unit_vector, migrations.RunPython.noop),
+    ]
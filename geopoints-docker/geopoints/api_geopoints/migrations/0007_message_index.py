@@ -0,0 +1,67 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+FORWARD_SQL = [
+    '''
+    ALTER TABLE api_geopoints_messageindex ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED
+    ''',
+    'CREATE INDEX message_index_search_vector_idx ON api_geopoints_messageindex USING gin (search_vector)',
+]
+
+BACKWARD_SQL = [
+    'ALTER TABLE api_geopoints_messageindex DROP COLUMN search_vector',
+]
+
+
+def run_postgres(statements):
+    '''Колонка tsvector как в миграции 0004, только для Postgres'''
+
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0006_point_unit_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageIndex',
+            fields=[
+                ('message_id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Id сообщения')),
+                ('author_id', models.BigIntegerField(verbose_name='Id автора сообщения')),
+                ('content', models.TextField(verbose_name='Текст сообщения')),
+                ('created_at', models.DateTimeField(verbose_name='Дата создания сообщения')),
+                ('point_id', models.BigIntegerField(verbose_name='Id точки')),
+                ('point_name', models.CharField(max_length=255, verbose_name='Название точки')),
+                ('point_description', models.TextField(verbose_name='Описание точки')),
+                ('point_latitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Широта')),
+                ('point_longitude', models.DecimalField(decimal_places=6, max_digits=9, verbose_name='Долгота')),
+                ('latitude_e6', models.IntegerField(verbose_name='Широта в микроградусах')),
+                ('longitude_e6', models.IntegerField(verbose_name='Долгота в микроградусах')),
+                ('unit_x', models.FloatField(verbose_name='X на единичной сфере')),
+                ('unit_y', models.FloatField(verbose_name='Y на единичной сфере')),
+                ('unit_z', models.FloatField(verbose_name='Z на единичной сфере')),
+                ('point_created_at', models.DateTimeField(verbose_name='Дата создания точки')),
+                ('point_update_at', models.DateTimeField(verbose_name='Дата обновления точки')),
+                ('owner_id', models.BigIntegerField(verbose_name='Id владельца точки')),
+                ('owner_username', models.CharField(max_length=150, verbose_name='Имя владельца точки')),
+                ('owner_email', models.CharField(blank=True, max_length=254, verbose_name='Email владельца точки')),
+            ],
+            options={
+                'verbose_name': 'Сообщение (индекс поиска)',
+                'verbose_name_plural': 'Сообщения (индекс поиска)',
+                'indexes': [models.Index(fields=['latitude_e6', 'longitude_e6', 'created_at'], name='message_index_coords_idx'), models.Index(fields=['created_at', 'message_id'], name='message_index_created_idx'), models.Index(fields=['point_id'], name='message_index_point_idx'), models.Index(fields=['owner_id'], name='message_index_owner_idx')],
+            },
+        ),
+        migrations.RunPython(run_postgres(FORWARD_SQL), run_postgres(BACKWARD_SQL)),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0007_message_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['name'], name='point_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
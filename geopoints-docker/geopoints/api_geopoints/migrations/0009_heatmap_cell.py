@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0008_point_name_prefix_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeatmapCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.SmallIntegerField(verbose_name='Уровень масштаба')),
+                ('x', models.IntegerField(verbose_name='Номер тайла по x')),
+                ('y', models.IntegerField(verbose_name='Номер тайла по y')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Число точек')),
+            ],
+            options={
+                'verbose_name': 'Ячейка тепловой карты',
+                'verbose_name_plural': 'Ячейки тепловой карты',
+                'constraints': [models.UniqueConstraint(fields=('zoom', 'x', 'y'), name='heatmap_cell_tile_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 6.0.1 on 2026-10-19 20:30
+
+import math
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Q
+
+BATCH_SIZE = 2000
+FIELDS = ['latitude_e6', 'longitude_e6', 'unit_x', 'unit_y', 'unit_z']
+
+
+def to_microdegrees(value):
+    return int(Decimal(str(value)).quantize(Decimal('0.000001')).scaleb(6))
+
+
+def backfill_search_columns(apps, schema_editor):
+    '''Точки, созданные после 0005/0006 в обход pre_save (bulk_create, update), без колонок поиска'''
+    Point = apps.get_model('api_geopoints', 'Point')
+    missing = Q()
+    for field in FIELDS:
+        missing |= Q(**{f'{field}__isnull': True})
+    batch = []
+    points = Point.objects.filter(missing).only('id', 'latitude', 'longitude')
+    for point in points.iterator(chunk_size=BATCH_SIZE):
+        point.latitude_e6 = to_microdegrees(point.latitude)
+        point.longitude_e6 = to_microdegrees(point.longitude)
+        rad_lat = math.radians(point.latitude_e6 / 10 ** 6)
+        rad_lon = math.radians(point.longitude_e6 / 10 ** 6)
+        point.unit_x = math.cos(rad_lat) * math.cos(rad_lon)
+        point.unit_y = math.cos(rad_lat) * math.sin(rad_lon)
+        point.unit_z = math.sin(rad_lat)
+        batch.append(point)
+        if len(batch) >= BATCH_SIZE:
+            Point.objects.bulk_update(batch, FIELDS)
+            batch = []
+    if batch:
+        Point.objects.bulk_update(batch, FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_geopoints', '0009_heatmap_cell'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_columns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='point',
+            name='latitude_e6',
+            field=models.IntegerField(editable=False, verbose_name='Широта в микроградусах'),
+        ),
+        migrations.AlterField(
+            model_name='point',
+            name='longitude_e6',
+            field=models.IntegerField(editable=False, verbose_name='Долгота в микроградусах'),
+        ),
+        migrations.AlterField(
+            model_name='point',
+            name='unit_x',
+            field=models.FloatField(editable=False, verbose_name='X на единичной сфере'),
+        ),
+        migrations.AlterField(
+            model_name='point',
+            name='unit_y',
+            field=models.FloatField(editable=False, verbose_name='Y на единичной сфере'),
+        ),
+        migrations.AlterField(
+            model_name='point',
+            name='unit_z',
+            field=models.FloatField(editable=False, verbose_name='Z на единичной сфере'),
+        ),
+    ]
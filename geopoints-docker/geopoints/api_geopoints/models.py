@@ -1,6 +1,70 @@
+import math
 from django.contrib.auth.models import User
 from django.contrib.auth import get_user_model
+from decimal import Decimal
 from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Cos, Radians, Round, Sin
+
+MICRODEGREES = 10 ** 6
+
+
+def to_microdegrees(value):
+    '''Координата в целых микроградусах с тем же округлением, что и DecimalField(decimal_places=6)'''
+    return int(Decimal(str(value)).quantize(Decimal('0.000001')).scaleb(6))
+
+
+def unit_vector(latitude, longitude):
+    '''Точка на единичной сфере (x, y, z) по широте и долготе в градусах'''
+    rad_lat = math.radians(latitude)
+    rad_lon = math.radians(longitude)
+    cos_lat = math.cos(rad_lat)
+    return cos_lat * math.cos(rad_lon), cos_lat * math.sin(rad_lon), math.sin(rad_lat)
+
+
+SEARCH_COLUMNS = ['latitude_e6', 'longitude_e6', 'unit_x', 'unit_y', 'unit_z']
+
+
+def search_column_expressions(latitude, longitude):
+    '''Колонки поиска как выражения SQL от новых значений широты и долготы (для QuerySet.update)'''
+    latitude_e6 = Cast(Round(latitude * Value(MICRODEGREES)), models.IntegerField())
+    longitude_e6 = Cast(Round(longitude * Value(MICRODEGREES)), models.IntegerField())
+    rad_lat = Radians(Cast(latitude, models.FloatField()))
+    rad_lon = Radians(Cast(longitude, models.FloatField()))
+    return {
+        'latitude_e6': latitude_e6,
+        'longitude_e6': longitude_e6,
+        'unit_x': Cos(rad_lat) * Cos(rad_lon),
+        'unit_y': Cos(rad_lat) * Sin(rad_lon),
+        'unit_z': Sin(rad_lat),
+    }
+
+
+class PointQuerySet(models.QuerySet):
+    '''Колонки поиска заполняются и при массовых операциях, которые не вызывают pre_save'''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.fill_search_columns()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs, fields = list(objs), list(fields)
+        if {'latitude', 'longitude'} & set(fields):
+            for obj in objs:
+                obj.fill_search_columns()
+            fields += [name for name in SEARCH_COLUMNS if name not in fields]
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if {'latitude', 'longitude'} & set(kwargs):
+            latitude, longitude = (
+                value if hasattr(value, 'resolve_expression') else Value(Decimal(str(value)))
+                for value in (kwargs.get('latitude', F('latitude')), kwargs.get('longitude', F('longitude')))
+            )
+            kwargs.update(search_column_expressions(latitude, longitude))
+        return super().update(**kwargs)
 
 
 class Point(models.Model):
@@ -30,6 +94,26 @@ class Point(models.Model):
         decimal_places=6,
         verbose_name="Долгота"
     )
+    latitude_e6 = models.IntegerField(
+        editable=False,
+        verbose_name='Широта в микроградусах'
+    )
+    longitude_e6 = models.IntegerField(
+        editable=False,
+        verbose_name='Долгота в микроградусах'
+    )
+    unit_x = models.FloatField(
+        editable=False,
+        verbose_name='X на единичной сфере'
+    )
+    unit_y = models.FloatField(
+        editable=False,
+        verbose_name='Y на единичной сфере'
+    )
+    unit_z = models.FloatField(
+        editable=False,
+        verbose_name='Z на единичной сфере'
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата создания'
@@ -39,13 +123,38 @@ class Point(models.Model):
         verbose_name='Дата обновления'
     )
 
+    objects = PointQuerySet.as_manager()
+
     @property
     def coordinates(self):
+        if self.latitude_e6 is not None and self.longitude_e6 is not None:
+            return self.latitude_e6 / MICRODEGREES, self.longitude_e6 / MICRODEGREES
         return float(self.latitude), float(self.longitude)
 
+    def fill_microdegrees(self):
+        '''Копия координат в целых микроградусах для поиска, пишется вместе с Decimal полями'''
+        self.latitude_e6 = to_microdegrees(self.latitude)
+        self.longitude_e6 = to_microdegrees(self.longitude)
+
+    def fill_unit_vector(self):
+        '''Вектор на единичной сфере для проверки радиуса скалярным произведением'''
+        self.unit_x, self.unit_y, self.unit_z = unit_vector(
+            self.latitude_e6 / MICRODEGREES, self.longitude_e6 / MICRODEGREES
+        )
+
+    def fill_search_columns(self):
+        '''Все производные от координат колонки для поиска'''
+        self.fill_microdegrees()
+        self.fill_unit_vector()
+
     class Meta:
         verbose_name = 'Точка'
         verbose_name_plural = 'Точки'
+        indexes = [
+            models.Index(fields=['latitude_e6', 'longitude_e6'], name='point_coordinates_e6_idx'),
+            # поиск в админке по началу названия (LIKE 'x%') в Postgres
+            models.Index(fields=['name'], name='point_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.latitude}, {self.longitude})"
@@ -79,6 +188,145 @@ class Message(models.Model):
         verbose_name = 'Сообщение'
         verbose_name_plural = 'Сообщения'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['point', 'created_at'], name='message_point_created_idx'),
+        ]
 
     def __str__(self):
         return f"Сообщение от {self.user.username} к {self.point.name}"
+
+
+class HeatmapCell(models.Model):
+    '''
+    Число точек в тайле карты (zoom, x, y), уровни пирамиды тепловой карты.
+    Поддерживается сигналами точки, см. api_geopoints.heatmap
+    '''
+    zoom = models.SmallIntegerField(
+        verbose_name='Уровень масштаба'
+    )
+    x = models.IntegerField(
+        verbose_name='Номер тайла по x'
+    )
+    y = models.IntegerField(
+        verbose_name='Номер тайла по y'
+    )
+    count = models.BigIntegerField(
+        default=0,
+        verbose_name='Число точек'
+    )
+
+    class Meta:
+        verbose_name = 'Ячейка тепловой карты'
+        verbose_name_plural = 'Ячейки тепловой карты'
+        constraints = [
+            models.UniqueConstraint(fields=['zoom', 'x', 'y'], name='heatmap_cell_tile_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.zoom}/{self.x}/{self.y}: {self.count}"
+
+
+class MessageIndex(models.Model):
+    '''
+    Денормализованная копия сообщения вместе с точкой и ее владельцем для поиска без JOIN.
+    Заполняется сигналами при settings.MESSAGE_READ_MODEL, см. api_geopoints.readmodel
+    '''
+    message_id = models.BigIntegerField(
+        primary_key=True,
+        verbose_name='Id сообщения'
+    )
+    author_id = models.BigIntegerField(
+        verbose_name='Id автора сообщения'
+    )
+    content = models.TextField(
+        verbose_name='Текст сообщения'
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата создания сообщения'
+    )
+    point_id = models.BigIntegerField(
+        verbose_name='Id точки'
+    )
+    point_name = models.CharField(
+        max_length=255,
+        verbose_name='Название точки'
+    )
+    point_description = models.TextField(
+        verbose_name='Описание точки'
+    )
+    point_latitude = models.DecimalField(
+        max_digits=9,
+        decimal_places=6,
+        verbose_name='Широта'
+    )
+    point_longitude = models.DecimalField(
+        max_digits=9,
+        decimal_places=6,
+        verbose_name='Долгота'
+    )
+    latitude_e6 = models.IntegerField(
+        verbose_name='Широта в микроградусах'
+    )
+    longitude_e6 = models.IntegerField(
+        verbose_name='Долгота в микроградусах'
+    )
+    unit_x = models.FloatField(
+        verbose_name='X на единичной сфере'
+    )
+    unit_y = models.FloatField(
+        verbose_name='Y на единичной сфере'
+    )
+    unit_z = models.FloatField(
+        verbose_name='Z на единичной сфере'
+    )
+    point_created_at = models.DateTimeField(
+        verbose_name='Дата создания точки'
+    )
+    point_update_at = models.DateTimeField(
+        verbose_name='Дата обновления точки'
+    )
+    owner_id = models.BigIntegerField(
+        verbose_name='Id владельца точки'
+    )
+    owner_username = models.CharField(
+        max_length=150,
+        verbose_name='Имя владельца точки'
+    )
+    owner_email = models.CharField(
+        max_length=254,
+        blank=True,
+        verbose_name='Email владельца точки'
+    )
+
+    class Meta:
+        verbose_name = 'Сообщение (индекс поиска)'
+        verbose_name_plural = 'Сообщения (индекс поиска)'
+        indexes = [
+            models.Index(fields=['latitude_e6', 'longitude_e6', 'created_at'], name='message_index_coords_idx'),
+            models.Index(fields=['created_at', 'message_id'], name='message_index_created_idx'),
+            models.Index(fields=['point_id'], name='message_index_point_idx'),
+            models.Index(fields=['owner_id'], name='message_index_owner_idx'),
+        ]
+
+    def to_message(self):
+        '''Несохраняемые Message, Point и User для MessageSerializer, без обращений к БД'''
+        owner = get_user_model()(id=self.owner_id, username=self.owner_username, email=self.owner_email)
+        point = Point(
+            id=self.point_id,
+            user=owner,
+            name=self.point_name,
+            description=self.point_description,
+            latitude=self.point_latitude,
+            longitude=self.point_longitude,
+            latitude_e6=self.latitude_e6,
+            longitude_e6=self.longitude_e6,
+            created_at=self.point_created_at,
+            update_at=self.point_update_at,
+        )
+        return Message(
+            id=self.message_id,
+            point=point,
+            user_id=self.author_id,
+            content=self.content,
+            created_at=self.created_at,
+        )
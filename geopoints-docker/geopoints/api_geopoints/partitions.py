@@ -0,0 +1,191 @@
+import gzip
+import os
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+from .caching import bump_user_versions
+from .models import Message, MessageIndex
+
+TABLE = Message._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+CHUNK_SIZE = 2000
+
+
+def month_start(value, shift=0):
+    '''Начало месяца в UTC со сдвигом на shift месяцев'''
+    month = value.year * 12 + value.month - 1 + shift
+    return datetime(month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(start):
+    return f'{TABLE}_p{start:%Y_%m}'
+
+
+def columns():
+    '''Колонки модели без генерируемых (search_vector), их нельзя вставлять явно'''
+    return ', '.join(connection.ops.quote_name(field.column) for field in Message._meta.concrete_fields)
+
+
+def is_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def list_partitions():
+    '''Список (имя, начало месяца или None для default, оценка числа строк)'''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT c.relname, c.reltuples::bigint FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            ORDER BY c.relname
+            ''',
+            [TABLE]
+        )
+        rows = cursor.fetchall()
+    prefix = f'{TABLE}_p'
+    result = []
+    for name, rows_estimate in rows:
+        start = None
+        if name.startswith(prefix):
+            start = datetime.strptime(name[len(prefix):], '%Y_%m').replace(tzinfo=timezone.utc)
+        result.append((name, start, max(rows_estimate, 0)))
+    return result
+
+
+def create_partition(cursor, start):
+    '''Партиция на месяц с start. Строки этого месяца, попавшие в default, переносятся в нее'''
+    name = partition_name(start)
+    cursor.execute('SELECT to_regclass(%s)', [name])
+    if cursor.fetchone()[0] is not None:
+        return False
+    end = month_start(start, 1)
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s)',
+        [start, end]
+    )
+    moved = cursor.fetchone()[0]
+    if moved:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+    cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+    if moved:
+        cols = columns()
+        cursor.execute(
+            f'INSERT INTO {TABLE} ({cols}) SELECT {cols} FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s',
+            [start, end]
+        )
+        cursor.execute(f'DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s', [start, end])
+        cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return True
+
+
+def create_partitions(months_ahead, now=None):
+    '''Партиции с текущего месяца на months_ahead месяцев вперед, возвращает имена созданных'''
+    now = now or datetime.now(timezone.utc)
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for shift in range(months_ahead + 1):
+            start = month_start(now, shift)
+            if create_partition(cursor, start):
+                created.append(partition_name(start))
+    return created
+
+
+def convert(months_ahead, now=None):
+    '''Перестройка таблицы сообщений в секционированную по created_at (по месяцам).
+    Индексы и внешние ключи переносятся с прежними именами, первичный ключ становится (id, created_at),
+    т.к. уникальность в секционированной таблице должна включать ключ секционирования.
+    Выполняется одной транзакцией и блокирует таблицу на время копирования
+    '''
+    legacy = f'{TABLE}_legacy'
+    now = now or datetime.now(timezone.utc)
+    cols = columns()
+    with transaction.atomic(), connection.cursor() as cursor:
+        # отложенные проверки внешних ключей не дают удалить таблицу в той же транзакции
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            '''
+            SELECT indexdef FROM pg_indexes i
+            WHERE i.tablename = %s AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname AND c.contype = 'p'
+            )
+            ''',
+            [TABLE]
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [TABLE]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f'SELECT min(created_at) FROM {TABLE}')
+        oldest = cursor.fetchone()[0] or now
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {legacy}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+        start = month_start(oldest)
+        last = month_start(now, months_ahead)
+        while start <= last:
+            create_partition(cursor, start)
+            start = month_start(start, 1)
+
+        cursor.execute(f'INSERT INTO {TABLE} ({cols}) SELECT {cols} FROM {legacy}')
+        cursor.execute(f'DROP TABLE {legacy}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce((SELECT max(id) FROM {TABLE}), 0) + 1, false)",
+            [TABLE]
+        )
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, created_at)')
+        for sql in indexes:
+            cursor.execute(sql)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+
+
+def archive_partition(name, output_dir):
+    '''Выгрузка партиции в gzip NDJSON (по строке JSON на сообщение), возвращает путь и число строк'''
+    path = os.path.join(output_dir, f'{name}.ndjson.gz')
+    tmp_path = f'{path}.tmp'
+    count = 0
+    with transaction.atomic():
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(f'SELECT row_to_json(t)::text FROM (SELECT {columns()} FROM {name} ORDER BY created_at, id) t')
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as file:
+                while rows := cursor.fetchmany(CHUNK_SIZE):
+                    for row in rows:
+                        file.write(row[0])
+                        file.write('\n')
+                    count += len(rows)
+        finally:
+            cursor.close()
+    os.replace(tmp_path, path)
+    return path, count
+
+
+def remove_partition(name, start, drop=True):
+    '''Отсоединение (и удаление при drop) партиции вместо DELETE по всей таблице.
+    Строки денормализованного индекса этого месяца удаляются, кэши списков авторов сбрасываются
+    '''
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT user_id FROM {name}')
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        if drop:
+            cursor.execute(f'DROP TABLE {name}')
+        MessageIndex.objects.filter(created_at__gte=start, created_at__lt=month_start(start, 1)).delete()
+        bump_user_versions(user_ids)
+
+
+def expired_partitions(keep_months, now=None):
+    '''Партиции, целиком старше keep_months месяцев от текущего'''
+    cutoff = month_start(now or datetime.now(timezone.utc), -keep_months)
+    return [(name, start) for name, start, _ in list_partitions() if start is not None and month_start(start, 1) <= cutoff]
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Message, MessageIndex
+from .services import Location, TextSearch
+
+BATCH_SIZE = 2000
+
+
+def is_enabled():
+    return getattr(settings, 'MESSAGE_READ_MODEL', False)
+
+
+def point_fields(point):
+    '''Поля строки индекса, которые берутся из точки и ее владельца'''
+    return {
+        'point_id': point.id,
+        'point_name': point.name,
+        'point_description': point.description,
+        'point_latitude': point.latitude,
+        'point_longitude': point.longitude,
+        'latitude_e6': point.latitude_e6,
+        'longitude_e6': point.longitude_e6,
+        'unit_x': point.unit_x,
+        'unit_y': point.unit_y,
+        'unit_z': point.unit_z,
+        'point_created_at': point.created_at,
+        'point_update_at': point.update_at,
+        'owner_id': point.user.id,
+        'owner_username': point.user.username,
+        'owner_email': point.user.email,
+    }
+
+
+def build_row(message):
+    return MessageIndex(
+        message_id=message.id,
+        author_id=message.user_id,
+        content=message.content,
+        created_at=message.created_at,
+        **point_fields(message.point)
+    )
+
+
+def index_message(message):
+    '''Добавление или обновление строки индекса для сообщения'''
+    row = build_row(message)
+    MessageIndex.objects.update_or_create(
+        message_id=row.message_id,
+        defaults={field.name: getattr(row, field.name) for field in MessageIndex._meta.fields if not field.primary_key}
+    )
+
+
+def delete_message(message_id):
+    MessageIndex.objects.filter(message_id=message_id).delete()
+
+
+def update_point(point):
+    '''Новые данные точки во всех строках ее сообщений, одним UPDATE'''
+    MessageIndex.objects.filter(point_id=point.id).update(**point_fields(point))
+
+
+def update_owner(user):
+    MessageIndex.objects.filter(owner_id=user.id).update(owner_username=user.username, owner_email=user.email)
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    '''Полное перестроение индекса из Message, возвращает количество строк'''
+    MessageIndex.objects.all().delete()
+    messages = Message.objects.select_related('point', 'point__user').order_by('id')
+    batch = []
+    count = 0
+    for message in messages.iterator(chunk_size=batch_size):
+        batch.append(build_row(message))
+        if len(batch) >= batch_size:
+            MessageIndex.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        MessageIndex.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def search_messages(location, q=None, since=None):
+    '''Поиск сообщений в радиусе по одной таблице: индекс по координатам,
+    затем скалярное произведение единичных векторов как в Location.get_points.
+    Возвращает несохраняемые Message в порядке (created_at, id)
+    '''
+    boxes = Location.get_bounding_boxes(location.center_lat, location.center_lon, location.radius)
+    rows = location.filter_radius(MessageIndex.objects.filter(Location.bounding_boxes_q(boxes)))
+    if q:
+        rows = TextSearch.filter(rows, q)
+    if since is not None:
+        created_at, message_id = since
+        rows = rows.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, message_id__gt=message_id))
+    return [row.to_message() for row in rows.order_by('created_at', 'message_id')]
@@ -1,16 +1,58 @@
+import math
 from rest_framework import serializers
 from .models import Point, Message
+from .services import Location, Polygon, parse_since
+from . import heatmap
 from django.contrib.auth import get_user_model
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    '''Оставляет только поля из параметра запроса fields, например fields=id,latitude,longitude.
+    Поля вложенных сериализаторов задаются через точку: fields=id,user.username.
+    На входные данные не влияет
+    '''
+
+    def get_fields_path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        prefix = node.context.get('fields_path')
+        if prefix:
+            names.append(prefix)
+        return '.'.join(reversed(names))
+
+    def get_requested_fields(self):
+        request = self.context.get('request')
+        if request is None or not request.query_params.get('fields') or hasattr(self.root, 'initial_data'):
+            return None
+        path = self.get_fields_path()
+        requested = [name.strip() for name in request.query_params['fields'].split(',') if name.strip()]
+        if path:
+            prefix = path + '.'
+            requested = [name[len(prefix):] for name in requested if name.startswith(prefix)]
+            if not requested:
+                return None
+        return {name.split('.')[0] for name in requested}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.get_requested_fields()
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = get_user_model()
         fields = ['id', 'username', 'email']
         read_only_fields = ['id', 'username', 'email']
 
 
-class PointSerializer(serializers.ModelSerializer):
+class PointSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
     class Meta:
@@ -60,6 +102,14 @@ class SearchSerializer(serializers.Serializer):
         help_text='Радиус поиска в км (0.1-1000)'
     )
 
+    def to_internal_value(self, data):
+        '''Текстовый поиск есть только в TextSearchSerializer: q в остальных запросах
+        (пакетный поиск, поток сообщений) отклоняется, а не игнорируется молча
+        '''
+        if 'q' not in self.fields and hasattr(data, 'get') and data.get('q') is not None:
+            raise serializers.ValidationError({'q': ['Текстовый поиск в этом запросе не поддерживается']})
+        return super().to_internal_value(data)
+
     def validate_latitude(self, value):
         if value < -90 or value > 90:
             raise serializers.ValidationError("Диапозон широты от -90 до 90")
@@ -71,17 +121,155 @@ class SearchSerializer(serializers.Serializer):
         return value
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class TextSearchSerializer(SearchSerializer):
+    q = serializers.CharField(
+        required=False,
+        max_length=200,
+        help_text='Текст для полнотекстового поиска'
+    )
+
+
+class MessageSearchSerializer(TextSearchSerializer):
+    since = serializers.CharField(
+        required=False,
+        help_text='Курсор "<время создания в мкс>-<id>" из заголовка X-Next-Since прошлого ответа'
+    )
+
+    def validate_since(self, value):
+        try:
+            created_at, message_id = parse_since(value)
+        except ValueError:
+            raise serializers.ValidationError('Некорректный курсор since')
+        return created_at, message_id
+
+
+class BatchSearchSerializer(serializers.Serializer):
+    queries = SearchSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=100,
+        help_text='Список кругов поиска (не более 100)'
+    )
+    unique = serializers.BooleanField(
+        default=False,
+        help_text='Вернуть один список точек без повторов вместо списка на каждый запрос'
+    )
+
+
+class WithinSerializer(serializers.Serializer):
+    bbox = serializers.CharField(
+        required=False,
+        help_text='Прямоугольник: южная широта,западная долгота,северная широта,восточная долгота'
+    )
+    polygon = serializers.CharField(
+        required=False,
+        help_text='Многоугольник: вершины "широта,долгота" через ";" (от 3 до 500), без пересечения антимеридиана'
+    )
+
+    MAX_VERTICES = 500
+    # км², примерно круг радиуса 1000 км - наибольший поиск по радиусу
+    MAX_AREA = 3000000
+
+    @staticmethod
+    def parse_coordinates(value, count=None):
+        try:
+            numbers = [float(i) for i in value.split(',')]
+        except ValueError:
+            raise serializers.ValidationError('Координаты должны быть числами')
+        # nan проходит любые сравнения диапазона, inf ломает перевод в микроградусы
+        if not all(math.isfinite(number) for number in numbers):
+            raise serializers.ValidationError('Координаты должны быть конечными числами')
+        if count is not None and len(numbers) != count:
+            raise serializers.ValidationError(f'Ожидается {count} числа через запятую')
+        return numbers
+
+    @staticmethod
+    def validate_pair(lat, lon):
+        if lat < -90 or lat > 90:
+            raise serializers.ValidationError("Диапозон широты от -90 до 90")
+        if lon < -180 or lon > 180:
+            raise serializers.ValidationError("Диапозон долготы от -180 до 180")
+
+    def validate_bbox(self, value):
+        south, west, north, east = self.parse_coordinates(value, 4)
+        self.validate_pair(south, west)
+        self.validate_pair(north, east)
+        if south > north:
+            raise serializers.ValidationError('Южная широта больше северной')
+        return south, west, north, east
+
+    def validate_polygon(self, value):
+        vertices = [self.parse_coordinates(vertex, 2) for vertex in value.split(';') if vertex]
+        if not 3 <= len(vertices) <= self.MAX_VERTICES:
+            raise serializers.ValidationError(f'Многоугольник должен содержать от 3 до {self.MAX_VERTICES} вершин')
+        for lat, lon in vertices:
+            self.validate_pair(lat, lon)
+        if Polygon.crosses_antimeridian(vertices):
+            raise serializers.ValidationError(
+                'Многоугольник пересекает антимеридиан, разделите его на два по долготе 180'
+            )
+        return vertices
+
+    def validate(self, attrs):
+        '''Прямоугольники области в attrs['boxes'], площадь (для многоугольника - его
+        ограничивающего прямоугольника) не больше MAX_AREA
+        '''
+        if ('bbox' in attrs) == ('polygon' in attrs):
+            raise serializers.ValidationError('Нужно указать либо bbox, либо polygon')
+        if 'bbox' in attrs:
+            boxes = Location.get_bbox_boxes(*attrs['bbox'])
+        else:
+            boxes = [Polygon(attrs['polygon']).get_bounding_box()]
+        if Location.get_boxes_area(boxes) > self.MAX_AREA:
+            raise serializers.ValidationError(f'Площадь области больше {self.MAX_AREA} км², уменьшите область')
+        attrs['boxes'] = boxes
+        return attrs
+
+
+class HeatmapSerializer(serializers.Serializer):
+    zoom = serializers.IntegerField(
+        min_value=0,
+        help_text='Уровень масштаба тайлов карты (от 0 до HEATMAP MAX_ZOOM)'
+    )
+    bbox = serializers.CharField(
+        required=False,
+        help_text='Прямоугольник: южная широта,западная долгота,северная широта,восточная долгота (по умолчанию весь мир)'
+    )
+
+    def validate_zoom(self, value):
+        max_zoom = heatmap.get_config()['MAX_ZOOM']
+        if value > max_zoom:
+            raise serializers.ValidationError(f'Zoom не больше {max_zoom}')
+        return value
+
+    def validate_bbox(self, value):
+        south, west, north, east = WithinSerializer.parse_coordinates(value, 4)
+        WithinSerializer.validate_pair(south, west)
+        WithinSerializer.validate_pair(north, east)
+        if south > north:
+            raise serializers.ValidationError('Южная широта больше северной')
+        return south, west, north, east
+
+    def validate(self, attrs):
+        south, west, north, east = attrs.get('bbox', (-90.0, -180.0, 90.0, 180.0))
+        x_ranges, y_range = heatmap.tile_ranges(south, west, north, east, attrs['zoom'])
+        max_cells = heatmap.get_config()['MAX_CELLS']
+        if heatmap.count_cells(x_ranges, y_range) > max_cells:
+            raise serializers.ValidationError(
+                f'Область больше {max_cells} ячеек на этом zoom, уменьшите zoom или bbox'
+            )
+        attrs['x_ranges'], attrs['y_range'] = x_ranges, y_range
+        return attrs
+
+
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
 
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        if self.context.get('detail', True):
-            point_id = data.pop('point')
-            query = self.context.get('query', Message.objects.filter(point__id=point_id))
-            for mes in query:
-                if  mes.point.id == point_id:
-                    point_serializer = PointSerializer(mes.point)
-                    data['point'] = point_serializer.data
+        if self.context.get('detail', True) and 'point' in data:
+            data.pop('point')
+            point_serializer = PointSerializer(instance.point, context={**self.context, 'fields_path': 'point'})
+            data['point'] = point_serializer.data
         return data
 
     class Meta:
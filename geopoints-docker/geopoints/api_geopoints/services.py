@@ -1,30 +1,200 @@
 import math
-from decimal import Decimal
-from .models import Point
+from array import array
+from datetime import datetime, timedelta, timezone
+from django.db import connection
+from django.db.models import F, Q, BooleanField, Case, ExpressionWrapper, FloatField, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Mod
+from .models import Point, Message, MessageIndex, MICRODEGREES, unit_vector
+from . import spatial_index
+
+EARTH_RADIUS = 6371
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def format_since(message):
+    '''Курсор опроса сообщений: время создания в микросекундах и id'''
+    delta = message.created_at - EPOCH
+    microseconds = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return f'{microseconds}-{message.id}'
+
+
+def parse_since(value):
+    '''Разбор курсора в (created_at, id), ValueError при неверном формате или значениях вне диапазона'''
+    microseconds, message_id = value.split('-')
+    message_id = int(message_id)
+    if not 0 <= message_id < 2 ** 63:
+        raise ValueError('id вне диапазона')
+    try:
+        return EPOCH + timedelta(microseconds=int(microseconds)), message_id
+    except OverflowError:
+        raise ValueError('Время вне диапазона')
+
+
+class TextSearch:
+    '''Полнотекстовый поиск.
+    В Postgres по колонке search_vector (tsvector с GIN индексом, см. миграции 0004 и 0007),
+    в остальных БД - каждое слово запроса должно встречаться хотя бы в одном из полей
+    '''
+    CONFIG = 'simple'
+    FIELDS = {
+        Point: ['name', 'description'],
+        Message: ['content'],
+        MessageIndex: ['content'],
+    }
+
+    @classmethod
+    def filter(cls, queryset, q):
+        model = queryset.model
+        if connection.vendor == 'postgresql':
+            condition = RawSQL(
+                f'"{model._meta.db_table}"."search_vector" @@ plainto_tsquery(%s, %s)',
+                [cls.CONFIG, q],
+                output_field=BooleanField()
+            )
+            return queryset.filter(condition)
+        fields = cls.FIELDS[model]
+        for word in q.split():
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{f'{field}__icontains': word})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class PointColumns:
+    '''Колонки id и координат точек в микроградусах для колоночного ответа'''
+
+    def __init__(self):
+        self.ids = array('q')
+        self.latitudes = array('i')
+        self.longitudes = array('i')
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, point_id, latitude_e6, longitude_e6):
+        self.ids.append(point_id)
+        self.latitudes.append(latitude_e6)
+        self.longitudes.append(longitude_e6)
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        columns = cls()
+        for point_id, latitude_e6, longitude_e6 in queryset.values_list('id', 'latitude_e6', 'longitude_e6'):
+            columns.append(point_id, latitude_e6, longitude_e6)
+        return columns
 
 
 class Location:
 
-    def __init__(self, center_lat, center_lon, radius):
+    def __init__(self, center_lat, center_lon, radius, q=None):
         self.center_lat = center_lat
         self.center_lon = center_lon
         self.radius = radius
+        self.q = q
 
     def get_points(self):
         '''Возвращает точки в пределах радиуса.
-        Сначала считается ограничивающий прямоугольник.
-        Затем отбираются все точки в его пределах и впоследствии идет подробной расчет растояния и сравнения с радиусом
+        Сначала по индексу отбираются точки в ограничивающем прямоугольнике,
+        затем в той же выборке БД оставляет точки, чей вектор на единичной сфере
+        отстоит от центра не дальше радиуса: x*cx + y*cy + z*cz >= cos(d).
+        Тригонометрия считается один раз на запрос, а не на каждую точку.
+        С файлом индекса точки выбираются по id, но не больше SPATIAL_INDEX MAX_IDS:
+        для большого радиуса поиск по индексу прерывается, и радиус фильтрует сама БД
         '''
-        min_lat, max_lat, min_lon, max_lon = self.get_bounding_box(self.center_lat, self.center_lon, self.radius)
-        points_bounding_box = Location.get_points_bounding_box(min_lat, max_lat, min_lon, max_lon)
-        points_in_radius = Location.points_in_radius(points_bounding_box, self.center_lat, self.center_lon, self.radius)
-        points = filter(lambda x: x[0][0], zip(points_in_radius, points_bounding_box))
-        return points
+        columns = self.search_spatial_index()
+        if columns is not None:
+            return Point.objects.filter(id__in=columns.ids.tolist()).select_related('user')
+        return self.filter_radius(self.get_candidates()).select_related('user')
+
+    def get_spatial_index(self):
+        '''Общий для воркеров файл индекса (SPATIAL_INDEX), текстовый поиск идет через БД'''
+        return None if self.q else spatial_index.get_index()
+
+    def search_spatial_index(self):
+        '''PointColumns из файла индекса или None, если индекса нет или точек больше MAX_IDS'''
+        index = self.get_spatial_index()
+        if index is None:
+            return None
+        return index.search(self, limit=spatial_index.get_config()['MAX_IDS'])
+
+    def get_candidates(self):
+        boxes = self.get_bounding_boxes(self.center_lat, self.center_lon, self.radius)
+        candidates = Location.get_points_bounding_boxes(boxes)
+        if self.q:
+            candidates = TextSearch.filter(candidates, self.q)
+        return candidates
+
+    def get_center_vector(self):
+        return unit_vector(float(self.center_lat), float(self.center_lon))
+
+    def get_cos_radius(self):
+        return math.cos(float(self.radius) / EARTH_RADIUS)
+
+    def filter_radius(self, queryset):
+        '''Фильтр по радиусу через скалярное произведение единичных векторов'''
+        x, y, z = self.get_center_vector()
+        return queryset.alias(
+            dot=F('unit_x') * x + F('unit_y') * y + F('unit_z') * z
+        ).filter(dot__gte=self.get_cos_radius())
+
+    def get_point_columns(self):
+        '''То же, что get_points, но без создания объектов моделей: только id и координаты'''
+        columns = self.search_spatial_index()
+        if columns is not None:
+            return columns
+        rows = self.filter_radius(self.get_candidates()).values_list('id', 'latitude_e6', 'longitude_e6')
+        columns = PointColumns()
+        for point_id, latitude_e6, longitude_e6 in rows:
+            columns.append(point_id, latitude_e6, longitude_e6)
+        return columns
+
+    @staticmethod
+    def get_points_many(locations):
+        '''Поиск точек сразу для нескольких кругов.
+        Ограничивающие прямоугольники всех кругов объединяются в один запрос к БД,
+        затем кандидаты проверяются по каждому кругу скалярным произведением векторов.
+        Возвращает списки точек в порядке locations
+        '''
+        boxes = [
+            Location.get_bounding_boxes(loc.center_lat, loc.center_lon, loc.radius)
+            for loc in locations
+        ]
+        candidates = list(Location.get_points_bounding_boxes(
+            Location.merge_boxes([box for loc_boxes in boxes for box in loc_boxes])
+        ))
+
+        results = []
+        for loc in locations:
+            found = [point for point, _ in Location.points_in_radius(candidates, loc)]
+            results.append(found)
+        return results
+
+    @staticmethod
+    def merge_boxes(boxes):
+        '''Объединение пересекающихся прямоугольников, если общий прямоугольник
+        не больше суммы площадей исходных. Уменьшает число условий в запросе
+        '''
+        def area(box):
+            return (box[1] - box[0]) * (box[3] - box[2])
+
+        merged = []
+        for box in sorted(set(boxes)):
+            for i, other in enumerate(merged):
+                overlap = box[0] <= other[1] and other[0] <= box[1] and box[2] <= other[3] and other[2] <= box[3]
+                union = (min(box[0], other[0]), max(box[1], other[1]), min(box[2], other[2]), max(box[3], other[3]))
+                if overlap and area(union) <= area(box) + area(other):
+                    merged[i] = union
+                    break
+            else:
+                merged.append(box)
+        return merged
 
     @staticmethod
     def calculate_distance(lat1, lon1, lat2, lon2):
         '''Нахождение расстояния между двумя точками'''
-        R = 6371
+        R = EARTH_RADIUS
 
         lat1_rad = math.radians(float(lat1))
         lon1_rad = math.radians(float(lon1))
@@ -51,35 +221,151 @@ class Location:
 
     @staticmethod
     def get_bounding_box(latitude, longitude, radius) -> tuple:
-        '''Возвращение ограничивающего прямоугольника для предварительной фильотрации'''
-        KM_PER_DEGREE_LAT = 111.0
-
-        delta_lat = float(radius) / KM_PER_DEGREE_LAT
+        '''Возвращение ограничивающего прямоугольника для предварительной фильтрации.
+        Долгота считается по точной ширине круга на сфере: asin(sin(d) / cos(lat)).
+        Если круг накрывает полюс, широта обрезается, а долгота берется целиком.
+        Границы долготы могут выходить за пределы ±180, см. get_bounding_boxes
+        '''
+        angular_radius = float(radius) / EARTH_RADIUS
+        rad_lat = math.radians(float(latitude))
 
-        rad_lat = math.radians(latitude)
-        delta_lon = float(radius) / (KM_PER_DEGREE_LAT * math.cos(rad_lat))
+        min_lat = rad_lat - angular_radius
+        max_lat = rad_lat + angular_radius
+        if min_lat <= -math.pi / 2 or max_lat >= math.pi / 2:
+            min_lat = max(min_lat, -math.pi / 2)
+            max_lat = min(max_lat, math.pi / 2)
+            return math.degrees(min_lat), math.degrees(max_lat), -180.0, 180.0
 
-        max_lat = float(latitude) + delta_lat
-        min_lat = float(latitude) - delta_lat
-        max_lon = float(longitude) + delta_lon
+        delta_lon = math.degrees(math.asin(math.sin(angular_radius) / math.cos(rad_lat)))
         min_lon = float(longitude) - delta_lon
-        return min_lat, max_lat, min_lon, max_lon
+        max_lon = float(longitude) + delta_lon
+        return math.degrees(min_lat), math.degrees(max_lat), min_lon, max_lon
 
     @staticmethod
-    def points_in_radius(points, center_lat, center_lon, radius):
-        '''Вовращает генератор являются ли точки в пределах радиуса'''
+    def get_bounding_boxes(latitude, longitude, radius) -> list:
+        '''Список ограничивающих прямоугольников в допустимом диапазоне координат.
+        При пересечении антимеридиана прямоугольник делится на два
+        '''
+        min_lat, max_lat, min_lon, max_lon = Location.get_bounding_box(latitude, longitude, radius)
+        if max_lon - min_lon >= 360:
+            return [(min_lat, max_lat, -180.0, 180.0)]
+        if min_lon < -180:
+            return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+        if max_lon > 180:
+            return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+        return [(min_lat, max_lat, min_lon, max_lon)]
+
+    @staticmethod
+    def get_boxes_area(boxes):
+        '''Площадь прямоугольников (min_lat, max_lat, min_lon, max_lon) на сфере в км²'''
+        return sum(
+            EARTH_RADIUS ** 2 * math.radians(max_lon - min_lon)
+            * (math.sin(math.radians(max_lat)) - math.sin(math.radians(min_lat)))
+            for min_lat, max_lat, min_lon, max_lon in boxes
+        )
+
+    @staticmethod
+    def get_bbox_boxes(south, west, north, east):
+        '''Прямоугольники для bbox: если западная долгота больше восточной, два через антимеридиан'''
+        if west <= east:
+            return [(south, north, west, east)]
+        return [(south, north, west, 180.0), (south, north, -180.0, east)]
+
+    @staticmethod
+    def points_in_radius(points, location):
+        '''Генератор (точка, расстояние) для точек в пределах радиуса.
+        Проверка - скалярное произведение с вектором центра, расстояние считается только для попавших
+        '''
+        cx, cy, cz = location.get_center_vector()
+        cos_radius = location.get_cos_radius()
         for point in points:
-            lat2, lon2 = point.coordinates
-            flag, distance = Location.is_point_in_radius(center_lat, center_lon, lat2, lon2, radius)
-            yield flag, distance
+            dot = point.unit_x * cx + point.unit_y * cy + point.unit_z * cz
+            if dot >= cos_radius:
+                yield point, math.acos(min(dot, 1.0)) * EARTH_RADIUS
 
     @staticmethod
     def get_points_bounding_box(min_lat, max_lat, min_lon, max_lon):
         '''Филтрация точек по ограничивающему прямоугольнику'''
-        points = Point.objects.filter(
-            latitude__gte=Decimal(str(min_lat)),
-            latitude__lte=Decimal(str(max_lat)),
-            longitude__gte=Decimal(str(min_lon)),
-            longitude__lte=Decimal(str(max_lon))
-        ).select_related('user')
+        return Location.get_points_bounding_boxes([(min_lat, max_lat, min_lon, max_lon)])
+
+    @staticmethod
+    def bounding_boxes_q(boxes):
+        '''Условие на колонки latitude_e6 и longitude_e6 для объединения прямоугольников'''
+        condition = Q()
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            condition |= Q(
+                latitude_e6__gte=math.ceil(min_lat * MICRODEGREES),
+                latitude_e6__lte=math.floor(max_lat * MICRODEGREES),
+                longitude_e6__gte=math.ceil(min_lon * MICRODEGREES),
+                longitude_e6__lte=math.floor(max_lon * MICRODEGREES)
+            )
+        return condition
+
+    @staticmethod
+    def get_points_bounding_boxes(boxes):
+        '''Филтрация точек по объединению ограничивающих прямоугольников'''
+        points = Point.objects.filter(Location.bounding_boxes_q(boxes)).select_related('user')
         return points
+
+
+class Polygon:
+    '''Многоугольник на карте, вершины задаются парами (широта, долгота).
+    Ребра идут по кратчайшей долготе без перехода через антимеридиан:
+    многоугольник, пересекающий ±180, нужно разделить на два (см. crosses_antimeridian)
+    '''
+
+    def __init__(self, vertices):
+        self.vertices = [(float(lat), float(lon)) for lat, lon in vertices]
+        self.edges = self.build_edges(self.vertices)
+
+    @staticmethod
+    def build_edges(vertices):
+        '''Ребра с заранее посчитанным наклоном, чтобы проверка точки была без деления'''
+        edges = []
+        for (lat1, lon1), (lat2, lon2) in zip(vertices, vertices[1:] + vertices[:1]):
+            if lat1 == lat2:
+                continue
+            edges.append((min(lat1, lat2), max(lat1, lat2), lat1, lon1, (lon2 - lon1) / (lat2 - lat1)))
+        return edges
+
+    @staticmethod
+    def crosses_antimeridian(vertices):
+        '''Есть ребро длиннее 180 градусов по долготе: такое ребро на карте идет через ±180'''
+        return any(abs(lon2 - lon1) > 180 for (_, lon1), (_, lon2) in zip(vertices, vertices[1:] + vertices[:1]))
+
+    def get_bounding_box(self) -> tuple:
+        '''Ограничивающий прямоугольник многоугольника (min_lat, max_lat, min_lon, max_lon)'''
+        lats = [lat for lat, _ in self.vertices]
+        lons = [lon for _, lon in self.vertices]
+        return min(lats), max(lats), min(lons), max(lons)
+
+    def contains(self, lat, lon) -> bool:
+        '''Проверка точки методом трассировки луча'''
+        inside = False
+        for min_lat, max_lat, lat1, lon1, slope in self.edges:
+            if min_lat <= lat < max_lat and lon < lon1 + (lat - lat1) * slope:
+                inside = not inside
+        return inside
+
+    def crossings(self):
+        '''Число ребер справа от точки (как в contains) выражением SQL по колонкам в микроградусах'''
+        total = Value(0)
+        for min_lat, max_lat, lat1, lon1, slope in self.edges:
+            crossed = Q(
+                latitude_e6__gte=round(min_lat * MICRODEGREES),
+                latitude_e6__lt=round(max_lat * MICRODEGREES),
+                longitude_e6__lt=ExpressionWrapper(
+                    round(lon1 * MICRODEGREES) + (F('latitude_e6') - round(lat1 * MICRODEGREES)) * slope,
+                    output_field=FloatField()
+                )
+            )
+            total = total + Case(When(crossed, then=Value(1)), default=Value(0))
+        return ExpressionWrapper(total, output_field=IntegerField())
+
+    def get_points(self):
+        '''Возвращает точки внутри многоугольника.
+        Кандидаты отбираются по ограничивающему прямоугольнику, трассировка луча идет в той же
+        выборке БД: точка внутри, если число пересеченных ребер нечетное
+        '''
+        candidates = Location.get_points_bounding_box(*self.get_bounding_box())
+        return candidates.alias(crossings=Mod(self.crossings(), 2)).filter(crossings=1)
@@ -0,0 +1,141 @@
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Point, Message
+from .caching import bump_points_version, bump_user_versions
+from .broadcast import publish_message
+from .fragments import forget_user
+from . import readmodel
+from . import spatial_index
+from . import heatmap
+
+
+@receiver(pre_save, sender=Point)
+def point_fill_search_columns(sender, instance, **kwargs):
+    '''Двойная запись координат, срабатывает и при загрузке фикстур'''
+    instance.fill_search_columns()
+
+
+@receiver(pre_save, sender=Point)
+def point_heatmap_previous(sender, instance, raw=False, **kwargs):
+    '''Прежние координаты изменяемой точки для переноса счетчиков тепловой карты'''
+    instance._heatmap_previous = None
+    if instance.pk is not None and not instance._state.adding and not raw:
+        instance._heatmap_previous = (
+            Point.objects.filter(pk=instance.pk).values_list('latitude_e6', 'longitude_e6').first()
+        )
+
+
+@receiver(post_save, sender=Point)
+@receiver(post_delete, sender=Point)
+def point_changed(sender, instance, **kwargs):
+    '''Сброс закэшированных выборок точек сразу и после коммита,
+    чтобы выборка без еще не закоммиченной точки не осталась под новой версией
+    '''
+    bump_points_version()
+    transaction.on_commit(bump_points_version)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    '''Рассылка нового сообщения подписчикам после коммита'''
+    if created:
+        transaction.on_commit(partial(publish_message, instance))
+
+
+@receiver(post_save, sender=Message)
+def message_index_save(sender, instance, **kwargs):
+    '''Строка индекса пишется в той же транзакции, что и сообщение'''
+    if readmodel.is_enabled():
+        readmodel.index_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def message_index_delete(sender, instance, **kwargs):
+    if readmodel.is_enabled():
+        readmodel.delete_message(instance.id)
+
+
+@receiver(post_save, sender=Point)
+def point_index_update(sender, instance, created, **kwargs):
+    if readmodel.is_enabled() and not created:
+        readmodel.update_point(instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def owner_index_update(sender, instance, created, update_fields=None, **kwargs):
+    '''Обновление имени и email владельца, вход пользователя (только last_login) пропускается'''
+    if not readmodel.is_enabled() or created:
+        return
+    if update_fields is not None and not {'username', 'email'} & set(update_fields):
+        return
+    readmodel.update_owner(instance)
+
+
+def invalidate_users(user_ids):
+    '''Сброс кэша списков сразу и еще раз после коммита,
+    чтобы ответ, собранный до коммита, не остался под новой версией
+    '''
+    user_ids = set(user_ids)
+    bump_user_versions(user_ids)
+    transaction.on_commit(partial(bump_user_versions, user_ids))
+
+
+@receiver(post_save, sender=Point)
+@receiver(post_delete, sender=Point)
+def point_invalidate_users(sender, instance, created=False, **kwargs):
+    '''Точка входит в список владельца и в сообщения всех, кто к ней писал'''
+    user_ids = {instance.user_id}
+    if not created:
+        user_ids.update(Message.objects.filter(point_id=instance.id).values_list('user_id', flat=True).distinct())
+    invalidate_users(user_ids)
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def message_invalidate_users(sender, instance, **kwargs):
+    invalidate_users([instance.user_id])
+
+
+@receiver(post_save, sender=get_user_model())
+def user_invalidate_users(sender, instance, created, update_fields=None, **kwargs):
+    '''Новый пользователь получает новую версию, смена имени или email сбрасывает
+    его списки и сообщения других пользователей к его точкам
+    '''
+    if created:
+        invalidate_users([instance.id])
+        return
+    if update_fields is not None and not {'username', 'email'} & set(update_fields):
+        return
+    forget_user(instance.id)
+    user_ids = {instance.id}
+    user_ids.update(Message.objects.filter(point__user_id=instance.id).values_list('user_id', flat=True).distinct())
+    invalidate_users(user_ids)
+
+
+@receiver(post_save, sender=Point)
+def point_spatial_index_save(sender, instance, **kwargs):
+    '''Запись в журнал файла индекса после коммита, воркеры наложат ее при следующем поиске'''
+    transaction.on_commit(partial(spatial_index.record_point, instance))
+
+
+@receiver(post_delete, sender=Point)
+def point_spatial_index_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(spatial_index.record_delete, instance.id))
+
+
+@receiver(post_save, sender=Point)
+def point_heatmap_save(sender, instance, created, **kwargs):
+    '''Счетчики тепловой карты меняются после коммита, см. api_geopoints.heatmap'''
+    previous = getattr(instance, '_heatmap_previous', None)
+    if created:
+        heatmap.add_point(instance)
+    elif previous is not None:
+        heatmap.move_point(previous, instance)
+
+
+@receiver(post_delete, sender=Point)
+def point_heatmap_delete(sender, instance, **kwargs):
+    heatmap.remove_point(instance)
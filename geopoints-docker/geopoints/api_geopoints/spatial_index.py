@@ -0,0 +1,314 @@
+import bisect
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from array import array
+
+from django.conf import settings
+from django.db.models import BigIntegerField, ExpressionWrapper, F
+
+from .models import MICRODEGREES, Point, unit_vector
+
+logger = logging.getLogger('geopoints.spatial_index')
+
+# Файл пространственного индекса точек, общий для всех воркеров gunicorn через mmap.
+#
+# Формат: заголовок HEADER, затем массивы длиной count, отсортированные по (ячейка, id):
+# ячейки int64, id int64, широты int32 и долготы int32 в микроградусах.
+# Файл только читается, воркеры отображают его в память без копирования, страницы общие в page cache.
+#
+# Изменения после сборки пишутся в журнал: сегменты {path}.log.{n} с записями LOG_RECORD,
+# номер текущего сегмента - в {path}.head. Сборка переключает head на новый сегмент,
+# читает точки из БД и атомарно подменяет файл (os.replace). Индекс помнит сегмент,
+# с которого начинается его журнал, и накладывает записи всех сегментов от него до head.
+#
+# Наложение хранится в памяти каждого воркера. Если изменений после сборки больше MAX_OVERLAY точек,
+# индекс перестает читать журнал и не используется (поиск идет через БД) до следующей сборки
+
+MAGIC = b'GPSI'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIqq')
+LOG_RECORD = struct.Struct('<Bqii')
+UPSERT = 1
+DELETE = 2
+
+DEFAULTS = {
+    'PATH': '',
+    'CELL_SIZE': 0.1,
+    'MAX_OVERLAY': 100000,
+    'MAX_IDS': 5000,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'SPATIAL_INDEX', {}))
+    return config
+
+
+def head_path(path):
+    return f'{path}.head'
+
+
+def log_path(path, segment):
+    return f'{path}.log.{segment}'
+
+
+def read_head(path):
+    try:
+        with open(head_path(path), 'rb') as file:
+            return int(file.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_head(path, segment):
+    tmp_path = f'{head_path(path)}.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(str(segment))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, head_path(path))
+
+
+class CellGrid:
+    '''Номер ячейки сетки cell_e6 микроградусов: ячейки одной широтной полосы идут подряд'''
+
+    def __init__(self, cell_e6):
+        self.cell_e6 = cell_e6
+        self.lon_cells = math.ceil(360 * MICRODEGREES / cell_e6) + 1
+
+    def lat_cell(self, latitude_e6):
+        return (latitude_e6 + 90 * MICRODEGREES) // self.cell_e6
+
+    def lon_cell(self, longitude_e6):
+        return (longitude_e6 + 180 * MICRODEGREES) // self.cell_e6
+
+    def cell(self, latitude_e6, longitude_e6):
+        return self.lat_cell(latitude_e6) * self.lon_cells + self.lon_cell(longitude_e6)
+
+    def expression(self):
+        '''То же вычисление в SQL для сортировки при сборке (целочисленное деление)'''
+        return ExpressionWrapper(
+            (F('latitude_e6') + 90 * MICRODEGREES) / self.cell_e6 * self.lon_cells
+            + (F('longitude_e6') + 180 * MICRODEGREES) / self.cell_e6,
+            output_field=BigIntegerField()
+        )
+
+
+def build(path=None, cell_size=None):
+    '''Сборка файла индекса из таблицы точек, возвращает число точек'''
+    config = get_config()
+    path = path or config['PATH']
+    grid = CellGrid(round((cell_size or config['CELL_SIZE']) * MICRODEGREES))
+    segment = read_head(path) + 1
+    # новые изменения с этого момента пишутся в новый сегмент, старые уже есть в БД
+    write_head(path, segment)
+
+    cells, ids, latitudes, longitudes = array('q'), array('q'), array('i'), array('i')
+    rows = (
+        Point.objects.alias(cell=grid.expression())
+        .order_by('cell', 'id')
+        .values_list('id', 'latitude_e6', 'longitude_e6')
+        .iterator(chunk_size=10000)
+    )
+    for point_id, latitude_e6, longitude_e6 in rows:
+        cells.append(grid.cell(latitude_e6, longitude_e6))
+        ids.append(point_id)
+        latitudes.append(latitude_e6)
+        longitudes.append(longitude_e6)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0, segment, len(ids), grid.cell_e6))
+        for column in (cells, ids, latitudes, longitudes):
+            column.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+    # сегмент прошлого индекса (segment - 1) еще читают воркеры до переоткрытия файла
+    directory, name = os.path.split(os.path.abspath(path))
+    prefix = f'{name}.log.'
+    for file_name in os.listdir(directory):
+        number = file_name[len(prefix):]
+        if file_name.startswith(prefix) and number.isdigit() and int(number) < segment - 1:
+            os.remove(os.path.join(directory, file_name))
+    return len(ids)
+
+
+def append_log(op, point_id, latitude_e6=0, longitude_e6=0, path=None):
+    '''Запись изменения точки в текущий сегмент журнала (O_APPEND, одна запись за write)'''
+    path = path or get_config()['PATH']
+    if not path or not os.path.exists(path):
+        return
+    fd = os.open(log_path(path, read_head(path)), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, LOG_RECORD.pack(op, point_id, latitude_e6, longitude_e6))
+    finally:
+        os.close(fd)
+
+
+def record_point(point):
+    append_log(UPSERT, point.id, point.latitude_e6, point.longitude_e6)
+
+
+def record_delete(point_id):
+    append_log(DELETE, point_id)
+
+
+class IndexFile:
+    '''Отображенный в память файл индекса: колонки - memoryview без копирования данных'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, segment, count, cell_e6 = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            self.mmap.close()
+            raise ValueError(f'{path}: не файл пространственного индекса версии {VERSION}')
+        view = memoryview(self.mmap)
+        offset = HEADER.size
+        columns = []
+        for size, code in ((8, 'q'), (8, 'q'), (4, 'i'), (4, 'i')):
+            columns.append(view[offset:offset + count * size].cast(code))
+            offset += count * size
+        self.cells, self.ids, self.latitudes, self.longitudes = columns
+        self.count = count
+        self.segment = segment
+        self.grid = CellGrid(cell_e6)
+
+
+class SpatialIndex:
+    '''Файл индекса текущего процесса и наложенные на него изменения из журнала.
+    Прежний IndexFile после пересборки освобождается, когда его перестают читать идущие запросы
+    '''
+
+    def __init__(self, path, max_overlay=None):
+        self.path = path
+        self.max_overlay = get_config()['MAX_OVERLAY'] if max_overlay is None else max_overlay
+        self.lock = threading.Lock()
+        self.file_id = None
+        self.file = None
+        self.offsets = {}
+        self.overlay = {}
+        self.stale = False
+
+    def refresh(self):
+        '''Переоткрытие файла после сборки и чтение новых записей журнала.
+        Несколько системных вызовов stat/read на запрос, без обращения к БД.
+        Возвращает файл и копию наложенных изменений для одного поиска
+        или None, если журнал вырос больше max_overlay и индекс ждет пересборки
+        '''
+        with self.lock:
+            stat = os.stat(self.path)
+            file_id = (stat.st_ino, stat.st_mtime_ns)
+            if file_id != self.file_id:
+                self.file = IndexFile(self.path)
+                self.file_id = file_id
+                self.offsets = {}
+                self.overlay = {}
+                self.stale = False
+            if self.stale:
+                return None
+            for segment in range(self.file.segment, read_head(self.path) + 1):
+                self.read_log(segment)
+                if len(self.overlay) > self.max_overlay:
+                    logger.warning(
+                        '%s: изменений после сборки больше %s, поиск идет через БД до пересборки '
+                        '(manage.py build_spatial_index)', self.path, self.max_overlay
+                    )
+                    self.overlay = {}
+                    self.stale = True
+                    return None
+            return self.file, dict(self.overlay)
+
+    def read_log(self, segment):
+        offset = self.offsets.get(segment, 0)
+        try:
+            with open(log_path(self.path, segment), 'rb') as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return
+        size = len(data) - len(data) % LOG_RECORD.size
+        for op, point_id, latitude_e6, longitude_e6 in LOG_RECORD.iter_unpack(data[:size]):
+            self.overlay[point_id] = (latitude_e6, longitude_e6) if op == UPSERT else None
+        self.offsets[segment] = offset + size
+
+    def search(self, location, limit=None):
+        '''PointColumns точек в радиусе location, та же проверка скалярным произведением, что и в БД.
+        None, если индекс ждет пересборки или точек больше limit: проверка идет в Python по каждой
+        точке, и большой радиус дешевле отдать БД. Если уже точек в ячейках прямоугольника
+        (по bisect, без проверки) больше limit, перебор не начинается
+        '''
+        from .services import Location, PointColumns
+
+        refreshed = self.refresh()
+        if refreshed is None:
+            return None
+        index, overlay = refreshed
+        cx, cy, cz = location.get_center_vector()
+        cos_radius = location.get_cos_radius()
+
+        def matches(latitude_e6, longitude_e6):
+            x, y, z = unit_vector(latitude_e6 / MICRODEGREES, longitude_e6 / MICRODEGREES)
+            return x * cx + y * cy + z * cz >= cos_radius
+
+        grid, cells = index.grid, index.cells
+        ranges = []
+        boxes = Location.get_bounding_boxes(location.center_lat, location.center_lon, location.radius)
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            box = (
+                math.ceil(min_lat * MICRODEGREES), math.floor(max_lat * MICRODEGREES),
+                math.ceil(min_lon * MICRODEGREES), math.floor(max_lon * MICRODEGREES)
+            )
+            lon_from, lon_to = grid.lon_cell(box[2]), grid.lon_cell(box[3])
+            for lat_cell in range(grid.lat_cell(box[0]), grid.lat_cell(box[1]) + 1):
+                row = lat_cell * grid.lon_cells
+                start = bisect.bisect_left(cells, row + lon_from)
+                end = bisect.bisect_right(cells, row + lon_to, start)
+                if start < end:
+                    ranges.append((box, start, end))
+        if limit is not None and sum(end - start for _, start, end in ranges) > limit:
+            return None
+
+        columns = PointColumns()
+        for (min_lat, max_lat, min_lon, max_lon), start, end in ranges:
+            for i in range(start, end):
+                point_id = index.ids[i]
+                if point_id in overlay:
+                    continue
+                latitude_e6, longitude_e6 = index.latitudes[i], index.longitudes[i]
+                if (min_lat <= latitude_e6 <= max_lat and min_lon <= longitude_e6 <= max_lon
+                        and matches(latitude_e6, longitude_e6)):
+                    columns.append(point_id, latitude_e6, longitude_e6)
+                    if limit is not None and len(columns) > limit:
+                        return None
+        for point_id, coordinates in overlay.items():
+            if coordinates is not None and matches(*coordinates):
+                columns.append(point_id, *coordinates)
+                if limit is not None and len(columns) > limit:
+                    return None
+        return columns
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    '''Индекс текущего процесса или None, если SPATIAL_INDEX PATH не задан или файл еще не собран'''
+    global _index
+    path = get_config()['PATH']
+    if not path:
+        return None
+    with _index_lock:
+        if _index is None or _index.path != path:
+            if not os.path.exists(path):
+                return None
+            _index = SpatialIndex(path)
+        return _index
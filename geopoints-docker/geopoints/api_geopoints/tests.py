@@ -1,13 +1,40 @@
-from django.test import TestCase
+import asyncio
+from asgiref.sync import async_to_sync
+from django.test import TestCase, SimpleTestCase, AsyncClient, override_settings
+from django.core.management import call_command
+from django.core.cache import cache
 from .factories import UserFactory, PointFactory, MessageFactory
 from .serializers import PointSerializer, MessageSerializer
 from django.urls import reverse
 from rest_framework import status
 from api_auth.services import TokenJWT
+import gzip
+import io
 import json
-from .models import Point, Message
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import Point, Message, MessageIndex, HeatmapCell, unit_vector
+from .services import Location, Polygon
+from .views import PointWithinView
+from .broadcast import hub, SubscriptionIndex
+from .caching import ByteLRU, is_cache_shared
+from .fragments import USER_FRAGMENT_KEY
+from .renderers import FastJSONRenderer
+from . import partitions
+from . import spatial_index
+from . import heatmap
+from .renderers import ColumnarRenderer
 from rest_framework.test import APIClient
+from geopoints.throttling import SearchThrottle
+from geopoints.querycheck import detect_repeated_queries, RepeatedQueriesError
+from geopoints.db_router import PIN_KEY, ReplicaRouter, health, use_primary, use_primary_if_pinned
+from geopoints import warmup
 import math
+from unittest import mock
+from .admin import EstimatedCountPaginator
 
 
 class ModelUnittestTest(TestCase):
@@ -331,3 +358,1112 @@ class MessageViewTest(TestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 3)
+
+
+class RepeatedQueriesTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.points = [PointFactory(user=self.user, latitude=34.2, longitude=40.12) for _ in range(3)]
+        for point in self.points:
+            MessageFactory(user=self.user, point=point)
+            MessageFactory(user=self.user, point=point)
+
+    def test_detector_flags_per_row_queries(self):
+        """Повторяющиеся запросы на каждую строку обнаруживаются"""
+
+        with self.assertRaises(RepeatedQueriesError):
+            with detect_repeated_queries(threshold=2):
+                for message in Message.objects.all():
+                    message.point.name
+
+    def test_message_endpoints_without_per_row_queries(self):
+        """Сообщения сериализуются без запросов на каждую строку"""
+
+        with detect_repeated_queries(threshold=2):
+            response_list = self.client.get(reverse('messages'))
+            response_search = self.client.get(
+                reverse('messages-search_in_radius'),
+                data={'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+            )
+        self.assertEqual(response_list.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response_list.json()), 6)
+        self.assertEqual(len(response_search.json()), 6)
+
+
+class BoundingBoxTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.search_point_url = reverse('points-search_in_radius')
+
+    def test_bounding_box_touches_circle(self):
+        """Границы прямоугольника касаются круга: ширина по долготе точная"""
+
+        radius = 100
+        for latitude in (0, 45, 70, 85):
+            min_lat, max_lat, min_lon, max_lon = Location.get_bounding_box(latitude, 10, radius)
+            self.assertAlmostEqual(Location.calculate_distance(latitude, 10, max_lat, 10), radius, places=6)
+            tangent_lat = math.degrees(math.asin(math.sin(math.radians(latitude)) / math.cos(radius / 6371)))
+            self.assertAlmostEqual(Location.calculate_distance(latitude, 10, tangent_lat, max_lon), radius, places=6)
+
+    def test_bounding_box_near_pole(self):
+        """Около полюса широта обрезается, долгота берется полностью"""
+
+        boxes = Location.get_bounding_boxes(89.5, 20, 100)
+        self.assertEqual(len(boxes), 1)
+        min_lat, max_lat, min_lon, max_lon = boxes[0]
+        self.assertAlmostEqual(min_lat, 89.5 - math.degrees(100 / 6371))
+        self.assertEqual((max_lat, min_lon, max_lon), (90.0, -180.0, 180.0))
+
+    def test_bounding_box_antimeridian(self):
+        """Прямоугольник через антимеридиан делится на два"""
+
+        boxes = Location.get_bounding_boxes(10, 179.9, 50)
+        self.assertEqual(len(boxes), 2)
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            self.assertTrue(-180 <= min_lon <= max_lon <= 180)
+        self.assertEqual(boxes[0][3], 180.0)
+        self.assertEqual(boxes[1][2], -180.0)
+
+    def test_search_across_antimeridian(self):
+        """Поиск находит точки по обе стороны антимеридиана"""
+
+        PointFactory(user=self.user, latitude=10, longitude=179.95)
+        PointFactory(user=self.user, latitude=10, longitude=-179.95)
+        PointFactory(user=self.user, latitude=10, longitude=-178)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        response = self.client.get(
+            self.search_point_url,
+            data={'latitude': 10, 'longitude': 179.99, 'radius': 20}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 2)
+
+
+class BatchSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.batch_url = reverse('points-search_batch')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+        self.p1 = PointFactory(user=self.user, latitude=55.75, longitude=37.61)
+        self.p2 = PointFactory(user=self.user, latitude=55.80, longitude=37.61)
+        self.p3 = PointFactory(user=self.user, latitude=59.93, longitude=30.31)
+        PointFactory(user=self.user, latitude=10, longitude=10)
+        self.queries = [
+            {'latitude': 55.75, 'longitude': 37.61, 'radius': 2},
+            {'latitude': 55.78, 'longitude': 37.61, 'radius': 10},
+            {'latitude': 59.93, 'longitude': 30.31, 'radius': 1},
+        ]
+
+    def test_batch_search_per_query(self):
+        """Пакетный поиск возвращает результат на каждый круг одним запросом к точкам"""
+
+        with self.assertNumQueries(2):
+            response = self.client.post(self.batch_url, data={'queries': self.queries}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [sorted(point['id'] for point in points) for points in response.json()]
+        self.assertEqual(ids, [[self.p1.id], sorted([self.p1.id, self.p2.id]), [self.p3.id]])
+
+    def test_batch_search_unique(self):
+        """Пакетный поиск без повторов"""
+
+        response = self.client.post(self.batch_url, data={'queries': self.queries, 'unique': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(point['id'] for point in response.json()), sorted([self.p1.id, self.p2.id, self.p3.id]))
+
+    def test_batch_search_invalid_query(self):
+        """Ошибка валидации одного из кругов"""
+
+        response = self.client.post(
+            self.batch_url, data={'queries': [{'latitude': 100, 'longitude': 0, 'radius': 1}]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WithinSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.within_url = reverse('points-within')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+        self.inside = PointFactory(user=self.user, latitude=1, longitude=1)
+        self.corner = PointFactory(user=self.user, latitude=3.5, longitude=3.5)
+        self.outside = PointFactory(user=self.user, latitude=10, longitude=10)
+        self.east = PointFactory(user=self.user, latitude=0, longitude=179.5)
+        self.west = PointFactory(user=self.user, latitude=0, longitude=-179.5)
+
+    def get_ids(self, params):
+        response = self.client.get(self.within_url, data=params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(point['id'] for point in response.json())
+
+    def test_within_bbox(self):
+        """Точки внутри прямоугольника"""
+
+        self.assertEqual(self.get_ids({'bbox': '0,0,4,4'}), sorted([self.inside.id, self.corner.id]))
+
+    def test_within_bbox_antimeridian(self):
+        """Прямоугольник через антимеридиан"""
+
+        self.assertEqual(self.get_ids({'bbox': '-1,179,1,-179'}), sorted([self.east.id, self.west.id]))
+
+    def test_within_polygon(self):
+        """Точки внутри треугольника, угол ограничивающего прямоугольника отсекается"""
+
+        self.assertEqual(self.get_ids({'polygon': '0,0;0,4;4,0'}), [self.inside.id])
+
+    def test_within_requires_one_area(self):
+        """Нужно указать ровно одну область"""
+
+        response = self.client.get(self.within_url, data={'bbox': '0,0,4,4', 'polygon': '0,0;0,4;4,0'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.within_url, data={'polygon': '0,0;0,4'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for bbox in ('nan,0,4,4', '0,0,inf,4'):
+            response = self.client.get(self.within_url, data={'bbox': bbox})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.within_url, data={'polygon': '0,0;0,4;nan,nan'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('points-heatmap'), data={'zoom': 2, 'bbox': 'nan,0,4,4'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_within_limits(self):
+        """Слишком большая область, слишком много точек и многоугольник через антимеридиан - 400"""
+
+        response = self.client.get(self.within_url, data={'bbox': '-90,-180,90,180'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.within_url, data={'polygon': '-60,-100;60,-100;60,100'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.within_url, data={'polygon': '-1,170;1,170;0,-170'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with mock.patch.object(PointWithinView, 'MAX_POINTS', 1):
+            response = self.client.get(self.within_url, data={'bbox': '0,0,4,4'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_polygon_filtered_in_database(self):
+        """Проверка многоугольника в БД совпадает с contains"""
+
+        polygon = Polygon([(0, 0), (0, 4), (4, 4), (2, 2), (4, 0)])
+        points = [PointFactory(user=self.user, latitude=lat, longitude=lon) for lat, lon in [(3, 2), (1, 2), (2, 3.5)]]
+        expected = {point.id for point in points + [self.inside, self.corner] if polygon.contains(*point.coordinates)}
+        self.assertEqual({point.id for point in polygon.get_points()}, expected)
+        self.assertTrue(expected)
+
+
+class MessageSincePollingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.search_message_url = reverse('messages-search_in_radius')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.point = PointFactory(user=self.user, latitude=34.2, longitude=40.12)
+        self.far_point = PointFactory(user=self.user, latitude=-34.2, longitude=-40.12)
+        self.params = {'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+
+    def test_since_returns_only_new_messages(self):
+        """Опрос с курсором возвращает только новые сообщения"""
+
+        MessageFactory(user=self.user, point=self.point)
+        MessageFactory(user=self.user, point=self.point)
+        response = self.client.get(self.search_message_url, data=self.params)
+        self.assertEqual(len(response.json()), 2)
+        since = response['X-Next-Since']
+
+        response = self.client.get(self.search_message_url, data={**self.params, 'since': since})
+        self.assertEqual(response.json(), [])
+        self.assertEqual(response['X-Next-Since'], since)
+
+        new_message = MessageFactory(user=self.user, point=self.point)
+        MessageFactory(user=self.user, point=self.far_point)
+        response = self.client.get(self.search_message_url, data={**self.params, 'since': since})
+        self.assertEqual([message['id'] for message in response.json()], [new_message.id])
+
+    def test_steady_state_poll_skips_radius_search(self):
+        """Повторный опрос берет id точек из кэша"""
+
+        MessageFactory(user=self.user, point=self.point)
+        self.client.get(self.search_message_url, data=self.params)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.search_message_url, data=self.params)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_new_point_invalidates_cached_ids(self):
+        """Новая точка в радиусе попадает в следующий опрос"""
+
+        self.client.get(self.search_message_url, data=self.params)
+        point = PointFactory(user=self.user, latitude=34.21, longitude=40.12)
+        MessageFactory(user=self.user, point=point)
+        response = self.client.get(self.search_message_url, data=self.params)
+        self.assertEqual(len(response.json()), 1)
+
+    def test_invalid_since(self):
+        """Некорректный курсор"""
+
+        response = self.client.get(self.search_message_url, data={**self.params, 'since': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.search_message_url, data={**self.params, 'since': '99999999999999999999-1'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.search_message_url, data={**self.params, 'since': '1-99999999999999999999'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MessageBroadcastTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.point = PointFactory(user=self.user, latitude=34.2, longitude=40.12)
+        self.far_point = PointFactory(user=self.user, latitude=-34.2, longitude=-40.12)
+
+    def test_subscription_index_matches_radius(self):
+        """Индекс подписок находит только подписчиков, в чей радиус попала точка"""
+
+        async def subscribe(*args):
+            return hub.subscribe(*args)
+
+        loop = asyncio.new_event_loop()
+        near = loop.run_until_complete(subscribe(34.2, 40.13, 5))
+        far = loop.run_until_complete(subscribe(-34.2, -40.12, 5))
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                message = MessageFactory(user=self.user, point=self.point)
+            message_id, payload = loop.run_until_complete(asyncio.wait_for(near.queue.get(), 1))
+            self.assertEqual(message_id, message.id)
+            self.assertEqual(json.loads(payload)['point']['id'], self.point.id)
+            self.assertTrue(far.queue.empty())
+        finally:
+            hub.unsubscribe(near)
+            hub.unsubscribe(far)
+            loop.close()
+
+    def test_antimeridian_subscription(self):
+        """Подписка у антимеридиана попадает в ячейки по обе стороны"""
+
+        index = SubscriptionIndex()
+
+        class Stub:
+            latitude, longitude, radius = 0.0, 179.95, 20.0
+
+            def matches(self, latitude, longitude):
+                return Location.is_point_in_radius(0.0, 179.95, latitude, longitude, 20.0)[0]
+
+        subscription = Stub()
+        index.add(subscription)
+        self.assertEqual(index.match(0.0, -179.95), [subscription])
+        index.remove(subscription)
+        self.assertEqual(index.cells, {})
+
+    def test_stream_unauthenticated(self):
+        """Поток без токена недоступен"""
+
+        response = async_to_sync(AsyncClient().get)(
+            reverse('messages-stream'), {'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stream_requires_asgi(self):
+        """Под WSGI поток не открывается и подписка не создается"""
+
+        access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        count = hub.count
+        response = self.client.get(
+            reverse('messages-stream'), {'latitude': 34.2, 'longitude': 40.12, 'radius': 5},
+            HTTP_AUTHORIZATION=f'Bearer {access_token}'
+        )
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertEqual(hub.count, count)
+
+
+class TextSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.cafe = PointFactory(user=self.user, name='Уютное кафе', description='Кофе и выпечка', latitude=34.2, longitude=40.12)
+        self.park = PointFactory(user=self.user, name='Парк', description='Большой парк', latitude=34.21, longitude=40.12)
+        self.far_cafe = PointFactory(user=self.user, name='Кафе', description='Далеко', latitude=-34.2, longitude=40.12)
+        MessageFactory(user=self.user, point=self.cafe, content='Отличный кофе')
+        MessageFactory(user=self.user, point=self.park, content='Гуляли весь день')
+        self.params = {'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+
+    def test_search_points_by_text(self):
+        """Текстовый поиск точек объединяется с радиусом"""
+
+        response = self.client.get(reverse('points-search_in_radius'), data={**self.params, 'q': 'кафе'})
+        self.assertEqual([point['id'] for point in response.json()], [self.cafe.id])
+
+    def test_search_points_all_words(self):
+        """Все слова запроса должны встречаться в точке"""
+
+        response = self.client.get(reverse('points-search_in_radius'), data={**self.params, 'q': 'кафе парк'})
+        self.assertEqual(response.json(), [])
+
+    def test_search_messages_by_text(self):
+        """Текстовый поиск сообщений"""
+
+        response = self.client.get(reverse('messages-search_in_radius'), data={**self.params, 'q': 'кофе'})
+        self.assertEqual([message['content'] for message in response.json()], ['Отличный кофе'])
+
+    def test_text_search_rejected_where_unsupported(self):
+        """Пакетный поиск и поток сообщений отклоняют q, а не возвращают результат без фильтра"""
+
+        response = self.client.post(
+            reverse('points-search_batch'), data={'queries': [{**self.params, 'q': 'кафе'}]}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('q', response.json()['queries'][0])
+
+        access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        response = async_to_sync(AsyncClient().get)(
+            reverse('messages-stream'), {**self.params, 'q': 'кофе'}, headers={'Authorization': f'Bearer {access_token}'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('q', json.loads(response.content))
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.point = PointFactory(user=self.user, latitude=34.2, longitude=40.12)
+        MessageFactory(user=self.user, point=self.point)
+
+    def test_point_fields(self):
+        """Только запрошенные поля точки"""
+
+        response = self.client.get(
+            reverse('points-search_in_radius'),
+            data={'latitude': 34.2, 'longitude': 40.12, 'radius': 5, 'fields': 'id,latitude,longitude'}
+        )
+        self.assertEqual(response.json(), [{'id': self.point.id, 'latitude': '34.200000', 'longitude': '40.120000'}])
+
+    def test_nested_fields(self):
+        """Поля вложенных сериализаторов через точку"""
+
+        response = self.client.get(reverse('messages'), data={'fields': 'id,point.name,point.user.username'})
+        message = response.json()[0]
+        self.assertEqual(set(message), {'id', 'point'})
+        self.assertEqual(message['point'], {'user': {'username': self.user.username}, 'name': self.point.name})
+
+    def test_fields_do_not_affect_input(self):
+        """Параметр fields не мешает созданию точки"""
+
+        response = self.client.post(
+            reverse('points') + '?fields=id',
+            data={'name': 'New Point', 'description': 'New', 'latitude': 55.7558, 'longitude': 37.6173},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Point.objects.filter(name='New Point').count(), 1)
+
+    def test_fast_renderer_matches_json_renderer(self):
+        """Быстрый рендерер дает тот же JSON, что и стандартный"""
+
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+
+        data = PointSerializer([self.point], many=True).data
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_fast_renderer_known_differences(self):
+        """Совпадения и известные отличия быстрого рендерера от JSONRenderer"""
+
+        from rest_framework.renderers import JSONRenderer
+        from . import renderers
+
+        if renderers.orjson is None:
+            self.skipTest('orjson не установлен')
+        fast, standard = FastJSONRenderer(), JSONRenderer()
+        same = [
+            {'text': 'строка\u2028абзац\u2029'},
+            {'created_at': datetime(2024, 1, 1, 1, 2, 3, 456789, tzinfo=timezone.utc)},
+            {'date': datetime(2024, 1, 1).date()},
+            {'float': 123.456, 'small': 0.0001, 'large': 1e15},
+        ]
+        for data in same:
+            self.assertEqual(fast.render(data), standard.render(data))
+        # целое больше 64 бит orjson не кодирует, ответ собирает JSONRenderer
+        self.assertEqual(fast.render({'big': 2 ** 70}), standard.render({'big': 2 ** 70}))
+        different = [
+            (1e16, b'[1e16]', b'[1e+16]'),
+            (1e-5, b'[0.00001]', b'[1e-05]'),
+            (1e-7, b'[1e-7]', b'[1e-07]'),
+        ]
+        for value, fast_output, standard_output in different:
+            self.assertEqual(fast.render([value]), fast_output)
+            self.assertEqual(standard.render([value]), standard_output)
+            self.assertEqual(json.loads(fast_output), json.loads(standard_output))
+        self.assertEqual(fast.render([math.nan]), b'[null]')
+        with self.assertRaises(ValueError):
+            standard.render([math.nan])
+
+
+class ColumnarFormatTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.point = PointFactory(user=self.user, latitude='34.200001', longitude='-40.123456')
+        PointFactory(user=self.user, latitude=-34.2, longitude=40.12)
+
+    def test_search_columnar(self):
+        """Поиск в колоночном формате"""
+
+        response = self.client.get(
+            reverse('points-search_in_radius'),
+            data={'latitude': 34.2, 'longitude': -40.12, 'radius': 5},
+            HTTP_ACCEPT=ColumnarRenderer.media_type
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], ColumnarRenderer.media_type)
+        columns = ColumnarRenderer.decode(response.content)
+        self.assertEqual(list(columns.ids), [self.point.id])
+        self.assertEqual(list(columns.latitudes), [34200001])
+        self.assertEqual(list(columns.longitudes), [-40123456])
+
+    def test_points_columnar(self):
+        """Точки пользователя в колоночном формате"""
+
+        response = self.client.get(reverse('points'), data={'format': 'columnar'})
+        self.assertEqual(len(ColumnarRenderer.decode(response.content)), 2)
+        self.assertEqual(len(response.content), 8 + 2 * 16)
+
+    def test_columnar_errors_as_json(self):
+        """Ошибки валидации отдаются в JSON"""
+
+        response = self.client.get(reverse('points-search_in_radius'), data={'format': 'columnar'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('latitude', response.json())
+
+
+class MicrodegreesTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+
+    def test_microdegrees_written_with_coordinates(self):
+        """Координаты в микроградусах пишутся вместе с Decimal полями"""
+
+        point = PointFactory(user=self.user, latitude=55.7558004, longitude=-37.6173)
+        point.refresh_from_db()
+        self.assertEqual((point.latitude_e6, point.longitude_e6), (55755800, -37617300))
+        self.assertEqual(point.coordinates, (55.7558, -37.6173))
+
+        point.latitude = '-10.000001'
+        point.save()
+        point.refresh_from_db()
+        self.assertEqual(point.latitude_e6, -10000001)
+
+    def test_bounding_box_on_microdegrees(self):
+        """Границы прямоугольника включают точки на краю"""
+
+        point = PointFactory(user=self.user, latitude='10.000001', longitude='20.000000')
+        self.assertEqual(list(Location.get_points_bounding_box(10.000001, 11, 19, 20)), [point])
+        self.assertEqual(list(Location.get_points_bounding_box(10.0000011, 11, 19, 20)), [])
+
+    def test_bulk_operations_fill_search_columns(self):
+        """bulk_create, bulk_update и update заполняют колонки поиска без pre_save"""
+
+        point, = Point.objects.bulk_create([
+            Point(user=self.user, name='Точка', description='', latitude='55.755800', longitude='37.617300')
+        ])
+        point = Point.objects.get(name='Точка')
+        self.assertEqual((point.latitude_e6, point.longitude_e6), (55755800, 37617300))
+
+        Point.objects.filter(id=point.id).update(latitude='-10.000001')
+        point.refresh_from_db()
+        self.assertEqual((point.latitude_e6, point.longitude_e6), (-10000001, 37617300))
+        for actual, expected in zip((point.unit_x, point.unit_y, point.unit_z), unit_vector(-10.000001, 37.6173)):
+            self.assertAlmostEqual(actual, expected, places=12)
+
+        point.longitude = '-20.5'
+        Point.objects.bulk_update([point], ['longitude'])
+        point.refresh_from_db()
+        self.assertEqual(point.longitude_e6, -20500000)
+
+
+class UnitVectorTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+
+    def test_unit_vector_written_with_coordinates(self):
+        """Вектор на единичной сфере пишется вместе с координатами"""
+
+        point = PointFactory(user=self.user, latitude=90, longitude=0)
+        point.refresh_from_db()
+        self.assertAlmostEqual(point.unit_z, 1.0)
+        self.assertAlmostEqual(point.unit_x ** 2 + point.unit_y ** 2 + point.unit_z ** 2, 1.0)
+
+    def test_radius_filter_matches_haversine(self):
+        """Фильтр скалярным произведением совпадает с расчетом по гаверсинусу"""
+
+        points = [
+            PointFactory(user=self.user, latitude=55.75 + i * 0.01, longitude=37.6 + i * 0.013)
+            for i in range(-30, 30)
+        ]
+        loc = Location(55.75, 37.6, 20)
+        expected = {
+            point.id for point in points
+            if Location.is_point_in_radius(55.75, 37.6, *point.coordinates, 20)[0]
+        }
+        self.assertTrue(0 < len(expected) < len(points))
+        self.assertEqual(set(loc.get_points().values_list('id', flat=True)), expected)
+        self.assertEqual({point.id for point in Location.get_points_many([loc])[0]}, expected)
+        self.assertEqual(set(loc.get_point_columns().ids), expected)
+
+
+@override_settings(MESSAGE_READ_MODEL=True)
+class MessageReadModelTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.search_message_url = reverse('messages-search_in_radius')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.point = PointFactory(user=self.user, latitude=34.2, longitude=40.12)
+        self.far_point = PointFactory(user=self.user, latitude=-34.2, longitude=-40.12)
+        self.params = {'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+
+    def test_same_response_as_join_search(self):
+        """Поиск по индексу возвращает то же, что и поиск с JOIN, одним запросом к таблице"""
+
+        MessageFactory(user=self.user, point=self.point)
+        MessageFactory(user=self.user, point=self.point)
+        MessageFactory(user=self.user, point=self.far_point)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.search_message_url, data=self.params)
+        with self.settings(MESSAGE_READ_MODEL=False):
+            expected = self.client.get(self.search_message_url, data=self.params)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['X-Next-Since'], expected['X-Next-Since'])
+
+        message = MessageFactory(user=self.user, point=self.point, content='Встреча у фонтана')
+        response = self.client.get(self.search_message_url, data={**self.params, 'q': 'фонтана'})
+        self.assertEqual([item['id'] for item in response.json()], [message.id])
+
+    def test_index_follows_writes(self):
+        """Изменение точки, владельца и удаление сообщения отражаются в индексе"""
+
+        message = MessageFactory(user=self.user, point=self.point)
+        self.point.name = 'Новое название'
+        self.point.save()
+        self.user.username = 'renamed'
+        self.user.save()
+        row = MessageIndex.objects.get(message_id=message.id)
+        self.assertEqual((row.point_name, row.owner_username), ('Новое название', 'renamed'))
+
+        self.point.latitude = -34.2
+        self.point.longitude = -40.12
+        self.point.save()
+        self.assertEqual(self.client.get(self.search_message_url, data=self.params).json(), [])
+
+        message.delete()
+        self.assertFalse(MessageIndex.objects.exists())
+
+    def test_rebuild_command(self):
+        """Команда перестраивает индекс из сообщений"""
+
+        MessageFactory(user=self.user, point=self.point)
+        MessageFactory(user=self.user, point=self.far_point)
+        MessageIndex.objects.all().delete()
+        call_command('rebuild_message_index', stdout=io.StringIO())
+        self.assertEqual(MessageIndex.objects.count(), 2)
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': True})
+class UserListCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.points_url = reverse('points')
+        self.messages_url = reverse('messages')
+        self.point = PointFactory(user=self.user)
+
+    def test_repeat_read_from_cache(self):
+        """Повторное чтение списка не обращается к таблицам точек"""
+
+        first = self.client.get(self.points_url)
+        with self.assertNumQueries(1):
+            second = self.client.get(self.points_url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+
+        self.assertEqual(self.client.get(self.points_url, data={'fields': 'id'}).json(), [{'id': self.point.id}])
+
+    def test_writes_invalidate_cache(self):
+        """Новая точка и изменение чужой точки, к которой есть сообщение, сбрасывают кэш"""
+
+        self.assertEqual(len(self.client.get(self.points_url).json()), 1)
+        PointFactory(user=self.user)
+        self.assertEqual(len(self.client.get(self.points_url).json()), 2)
+
+        other_point = PointFactory(user=UserFactory())
+        MessageFactory(user=self.user, point=other_point)
+        self.assertEqual(len(self.client.get(self.messages_url).json()), 1)
+        other_point.name = 'Новое название'
+        other_point.save()
+        self.assertEqual(self.client.get(self.messages_url).json()[0]['point']['name'], 'Новое название')
+
+    def test_byte_budget_eviction(self):
+        """Вытеснение по суммарному размеру, большие значения не кэшируются"""
+
+        lru = ByteLRU(max_bytes=10, max_entry_bytes=6)
+        self.assertFalse(lru.set('big', b'1234567'))
+        lru.set('a', b'1234')
+        lru.set('b', b'1234')
+        lru.get('a')
+        lru.set('c', b'1234')
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), b'1234')
+        self.assertEqual(lru.size, 8)
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': None})
+    def test_disabled_without_shared_cache(self):
+        """С локальным кэшем каждого воркера ответы не кэшируются: список читается из БД каждый раз"""
+
+        self.assertFalse(is_cache_shared())
+        self.client.get(self.points_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.points_url)
+        self.assertTrue(any('api_geopoints_point' in query['sql'] for query in queries))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.addCleanup(health.clear)
+
+    def test_routing(self):
+        """Чтение идет на доступную реплику, запись и закрепленные запросы - на default"""
+
+        health.set('replica_1', True)
+        self.assertEqual(self.router.db_for_read(Point), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Point), 'default')
+        token = use_primary.set(True)
+        self.assertEqual(self.router.db_for_read(Point), 'default')
+        use_primary.reset(token)
+        self.assertFalse(self.router.allow_migrate('replica_1', 'api_geopoints'))
+
+    def test_unavailable_replica_falls_back(self):
+        """Недоступная реплика пропускается"""
+
+        self.assertEqual(self.router.db_for_read(Point), 'default')
+        self.assertFalse(health.checked['replica_1'][0])
+
+
+class PrimaryPinTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+    def test_write_pins_next_reads(self):
+        """POST ставит cookie закрепления за основной БД"""
+
+        response = self.client.post(reverse('points'), data={
+            'name': 'Точка', 'description': 'Описание', 'latitude': 10, 'longitude': 20
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.cookies['geopoints_primary']['max-age'], 5)
+
+    @override_settings(DATABASE_REPLICAS=['replica_1'])
+    def test_write_pins_user_without_cookie(self):
+        """Запись закрепляет пользователя по id в кэше: JWT клиенту без cookie чтение идет с основной БД"""
+
+        self.client.post(reverse('points'), data={
+            'name': 'Точка', 'description': 'Описание', 'latitude': 10, 'longitude': 20
+        }, format='json')
+        self.assertEqual(cache.get(PIN_KEY.format(self.user.id)), 1)
+
+        for user_id, pinned in ((self.user.id, True), (UserFactory().id, False)):
+            token = use_primary.set(False)
+            use_primary_if_pinned(user_id)
+            self.assertEqual(use_primary.get(), pinned)
+            use_primary.reset(token)
+
+
+class MessagePartitionsTest(TestCase):
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Секционирование только в Postgres')
+        self.user = UserFactory()
+        self.point = PointFactory(user=self.user)
+        self.now = datetime.now(timezone.utc)
+        self.old_message = MessageFactory(user=self.user, point=self.point)
+        Message.objects.filter(id=self.old_message.id).update(created_at=self.now - timedelta(days=500))
+        self.old_message.refresh_from_db()
+        self.new_message = MessageFactory(user=self.user, point=self.point)
+
+    def test_convert_create_archive(self):
+        """Перевод таблицы в секции, отсечение старых секций по since и архивация"""
+
+        call_command('message_partitions', 'convert', stdout=io.StringIO())
+        self.assertEqual(Message.objects.count(), 2)
+        message = MessageFactory(user=self.user, point=self.point)
+        self.assertGreater(message.id, self.new_message.id)
+
+        plan = Message.objects.filter(created_at__gt=self.now - timedelta(days=1)).explain()
+        self.assertNotIn(partitions.partition_name(partitions.month_start(self.now, -16)), plan)
+
+        call_command('message_partitions', 'create', '--months-ahead', '6', stdout=io.StringIO())
+        names = [name for name, _, _ in partitions.list_partitions()]
+        self.assertIn(partitions.partition_name(partitions.month_start(self.now, 6)), names)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('message_partitions', 'archive', '--output-dir', output_dir, stdout=io.StringIO())
+            name = partitions.partition_name(partitions.month_start(self.old_message.created_at))
+            with gzip.open(f'{output_dir}/{name}.ndjson.gz', 'rt') as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual([row['id'] for row in rows], [self.old_message.id])
+        self.assertEqual(set(Message.objects.values_list('id', flat=True)), {self.new_message.id, message.id})
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.points = [
+            PointFactory(user=self.user, latitude=34.2 + i * 0.01, longitude=40.12) for i in range(3)
+        ]
+        self.params = {'latitude': 34.2, 'longitude': 40.12, 'radius': 5}
+
+    def render(self, data):
+        return FastJSONRenderer().render(data)
+
+    def test_same_bytes_as_serializer(self):
+        """Ответ из фрагментов совпадает с выводом сериализаторов"""
+
+        MessageFactory(user=self.user, point=self.points[0], content='Сообщение "в кавычках"')
+        response = self.client.get(reverse('points-search_in_radius'), data=self.params)
+        self.assertEqual(response.content, self.render(PointSerializer(self.points, many=True).data))
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        response = self.client.get(reverse('messages-search_in_radius'), data=self.params)
+        messages = Message.objects.select_related('point', 'point__user')
+        self.assertEqual(response.content, self.render(MessageSerializer(messages, many=True).data))
+
+        response = self.client.post(reverse('points-search_batch'), data={
+            'queries': [self.params, self.params]
+        }, format='json')
+        expected = PointSerializer(self.points, many=True).data
+        self.assertEqual(response.content, self.render([expected, expected]))
+
+    def test_changes_are_visible(self):
+        """Измененная точка и переименованный владелец попадают в ответ"""
+
+        url = reverse('points-search_in_radius')
+        self.client.get(url, data=self.params)
+        self.points[0].name = 'Новое название'
+        self.points[0].save()
+        self.user.username = 'renamed'
+        self.user.save()
+        data = self.client.get(url, data=self.params).json()
+        self.assertEqual(data[0]['name'], 'Новое название')
+        self.assertEqual({item['user']['username'] for item in data}, {'renamed'})
+
+    def test_user_fragments_only_in_shared_cache(self):
+        """Без общего кэша JSON пользователя не сохраняется в кэш процесса"""
+
+        cache.clear()
+        self.client.get(reverse('points-search_in_radius'), data=self.params)
+        self.assertIsNone(cache.get(USER_FRAGMENT_KEY.format(self.user.id)))
+
+
+@override_settings(THROTTLE_BUCKETS={'search': {'CAPACITY': 30, 'REFILL': 0.01}})
+class SearchThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.url = reverse('points-search_in_radius')
+
+    def test_cost_depends_on_radius(self):
+        """Большой радиус исчерпывает бакет быстрее маленького"""
+
+        params = {'latitude': 34.2, 'longitude': 40.12}
+        self.assertEqual(self.client.get(self.url, data={**params, 'radius': 50}).status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url, data={**params, 'radius': 1000})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+        for _ in range(5):
+            self.assertEqual(self.client.get(self.url, data={**params, 'radius': 5}).status_code, status.HTTP_200_OK)
+
+    def test_huge_radius_is_validation_error(self):
+        """Радиус, переполняющий float при подсчете стоимости, отклоняется валидацией, а не 500"""
+
+        response = self.client.get(self.url, data={'latitude': 34.2, 'longitude': 40.12, 'radius': '1e200'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cost_grows_up_to_capacity(self):
+        """Круг 1000 км дороже круга 100 км и стоит весь бакет"""
+
+        self.assertLess(SearchThrottle.radius_cost(100), SearchThrottle.radius_cost(1000))
+        self.assertEqual(SearchThrottle.radius_cost(1000), 30)
+        self.assertEqual(SearchThrottle.radius_cost(1), 1)
+
+    def test_batch_over_capacity_rejected(self):
+        """Пакет дороже бакета отклоняется, а не списывается по цене одного круга"""
+
+        queries = [{'latitude': 34.2, 'longitude': 40.12, 'radius': 1000}] * 2
+        response = self.client.post(reverse('points-search_batch'), data={'queries': queries}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('queries', response.json())
+        response = self.client.post(reverse('points-search_batch'), data={'queries': queries[:1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_within_cost_depends_on_area(self):
+        """Поиск в области расходует бакет по ее площади"""
+
+        url = reverse('points-within')
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, data={'bbox': '0,0,10,10'}).status_code, status.HTTP_200_OK)
+        response = self.client.get(url, data={'bbox': '0,0,10,10'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(url, data={'bbox': '0,0,0.1,0.1'}).status_code, status.HTTP_200_OK)
+
+
+class AdminChangelistTest(TestCase):
+    def setUp(self):
+        self.admin = UserFactory(is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+        self.user = UserFactory()
+        self.point = PointFactory(user=self.user)
+        self.url = reverse('admin:api_geopoints_message_changelist')
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_message_rows_without_extra_queries(self):
+        """Число запросов списка сообщений не зависит от числа строк"""
+
+        MessageFactory.create_batch(3, point=self.point, user=self.user)
+        queries = self.changelist_queries()
+        MessageFactory.create_batch(10, point=PointFactory(), user=UserFactory())
+        self.assertEqual(self.changelist_queries(), queries)
+
+    def test_input_filters(self):
+        """Фильтры по имени пользователя и id точки вместо списков всех значений"""
+
+        message = MessageFactory(point=self.point, user=self.user)
+        other = MessageFactory()
+        response = self.client.get(self.url, data={'username': self.user.username})
+        self.assertEqual(list(response.context['cl'].result_list), [message])
+        response = self.client.get(self.url, data={'point_id': other.point_id})
+        self.assertEqual(list(response.context['cl'].result_list), [other])
+        response = self.client.get(self.url, data={'q': str(other.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [other])
+
+    def test_estimated_count(self):
+        """Без фильтров число строк берется из статистики Postgres, с фильтром - ограниченный подсчет"""
+
+        if connection.vendor != 'postgresql':
+            self.skipTest('Оценка по pg_class только в Postgres')
+        MessageFactory.create_batch(5, point=self.point, user=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Message._meta.db_table}')
+        with mock.patch.object(EstimatedCountPaginator, 'EXACT_LIMIT', 2):
+            paginator = EstimatedCountPaginator(Message.objects.all(), 100)
+            self.assertEqual(paginator.count, EstimatedCountPaginator.table_estimate(Message.objects.all()))
+            paginator = EstimatedCountPaginator(Message.objects.filter(user=self.user), 100)
+            self.assertGreaterEqual(paginator.count, 3)
+
+
+class SpatialIndexTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.points = [
+            PointFactory(user=self.user, latitude=lat, longitude=lon)
+            for lat, lon in [(55.75, 37.61), (55.76, 37.65), (55.9, 37.4), (-33.86, 151.2), (10.0, 179.99), (10.0, -179.99)]
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/points.idx'
+        settings = override_settings(SPATIAL_INDEX={'PATH': self.path, 'CELL_SIZE': 0.1})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.locations = [Location(55.75, 37.61, 10), Location(55.75, 37.61, 50), Location(10.0, 180.0, 5)]
+
+    def expected_ids(self, location):
+        return set(location.filter_radius(location.get_candidates()).values_list('id', flat=True))
+
+    def search_ids(self, location):
+        return set(spatial_index.get_index().search(location).ids)
+
+    def test_search_matches_database(self):
+        """Поиск по файлу индекса совпадает с поиском в БД, включая переход через 180 меридиан"""
+
+        self.assertIsNone(spatial_index.get_index())
+        self.assertEqual(spatial_index.build(), len(self.points))
+        for location in self.locations:
+            self.assertEqual(self.search_ids(location), self.expected_ids(location))
+        self.assertEqual(self.search_ids(self.locations[2]), {self.points[4].id, self.points[5].id})
+
+    def test_log_applied_and_rebuild(self):
+        """Изменения после сборки видны из журнала, пересборка подменяет файл и переключает журнал"""
+
+        spatial_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            new_point = PointFactory(user=self.user, latitude=55.751, longitude=37.611)
+            self.points[0].delete()
+        location = self.locations[0]
+        self.assertEqual(self.search_ids(location), self.expected_ids(location))
+        self.assertIn(new_point.id, self.search_ids(location))
+
+        spatial_index.build()
+        spatial_index.build()
+        self.assertEqual(self.search_ids(location), self.expected_ids(location))
+        self.assertFalse(os.path.exists(spatial_index.log_path(self.path, 1)))
+        self.assertEqual(set(location.get_point_columns().ids), self.expected_ids(location))
+        self.assertEqual({point.id for point in location.get_points()}, self.expected_ids(location))
+
+    def test_overlay_limit_falls_back_to_database(self):
+        """Журнал больше MAX_OVERLAY: индекс не используется до пересборки, поиск идет через БД"""
+
+        spatial_index.build()
+        location = self.locations[0]
+        with override_settings(SPATIAL_INDEX={'PATH': self.path, 'MAX_OVERLAY': 1}):
+            index = spatial_index.SpatialIndex(self.path)
+            with self.captureOnCommitCallbacks(execute=True):
+                new_points = [PointFactory(user=self.user, latitude=55.751, longitude=37.611) for _ in range(2)]
+            with mock.patch.object(spatial_index, 'get_index', return_value=index):
+                with self.assertLogs('geopoints.spatial_index', 'WARNING'):
+                    self.assertIsNone(index.search(location))
+                self.assertEqual(index.overlay, {})
+                self.assertEqual({point.id for point in location.get_points()}, self.expected_ids(location))
+                self.assertEqual(set(location.get_point_columns().ids), self.expected_ids(location))
+                self.assertTrue({point.id for point in new_points} <= self.expected_ids(location))
+
+            spatial_index.build()
+            self.assertEqual(set(index.search(location).ids), self.expected_ids(location))
+
+    def test_large_result_filtered_in_database(self):
+        """Больше MAX_IDS точек: get_points не строит список id, а фильтрует радиус в БД"""
+
+        spatial_index.build()
+        location = self.locations[1]
+        with override_settings(SPATIAL_INDEX={'PATH': self.path, 'MAX_IDS': 1}):
+            query = str(location.get_points().query)
+        self.assertNotIn('"id" IN', query)
+        self.assertEqual({point.id for point in location.get_points()}, self.expected_ids(location))
+        self.assertIn('"id" IN', str(location.get_points().query))
+
+    def test_search_stops_at_limit(self):
+        """Поиск с limit прерывается без проверки точек, если в ячейках прямоугольника их больше limit"""
+
+        spatial_index.build()
+        index = spatial_index.get_index()
+        location = self.locations[1]
+        expected = self.expected_ids(location)
+        self.assertEqual(set(index.search(location, limit=len(expected)).ids), expected)
+        with mock.patch.object(spatial_index, 'unit_vector', wraps=unit_vector) as vectors:
+            self.assertIsNone(index.search(location, limit=1))
+        vectors.assert_not_called()
+
+
+class WarmupTest(TestCase):
+    def test_warm_worker(self):
+        """Прогрев воркера строит URL и поля сериализаторов, соединения с БД не прогреваются"""
+
+        timings = warmup.warm_worker()
+        self.assertIn('caches', timings)
+        self.assertNotIn('database', timings)
+        self.assertGreater(warmup.warm_urls(), 10)
+        self.assertGreater(warmup.warm_serializers(), 5)
+
+
+class HeatmapTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.heatmap_url = reverse('points-heatmap')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.moscow = [PointFactory(user=self.user, latitude=55.75 + i / 100, longitude=37.61) for i in range(3)]
+            self.paris = PointFactory(user=self.user, latitude=48.85, longitude=2.35)
+            self.east = PointFactory(user=self.user, latitude=0, longitude=179.5)
+            self.west = PointFactory(user=self.user, latitude=0, longitude=-179.5)
+
+    def get_counts(self):
+        return set(HeatmapCell.objects.filter(count__gt=0).values_list('zoom', 'x', 'y', 'count'))
+
+    def test_signals_match_rebuild(self):
+        """Счетчики, которые ведут сигналы при создании, переносе и удалении точек, совпадают с пересборкой"""
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paris.latitude, self.paris.longitude = 40.71, -74.0
+            self.paris.save()
+            self.moscow[0].delete()
+        incremental = self.get_counts()
+        self.assertEqual(HeatmapCell.objects.get(zoom=0).count, Point.objects.count())
+
+        call_command('rebuild_heatmap', stdout=io.StringIO())
+        self.assertEqual(self.get_counts(), incremental)
+
+    def test_counters_not_locked_in_point_transaction(self):
+        """Счетчики не меняются внутри транзакции точки, откат транзакции их не затрагивает"""
+
+        before = self.get_counts()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as queries:
+                PointFactory(user=self.user, latitude=10, longitude=10)
+        self.assertFalse(any('api_geopoints_heatmapcell' in query['sql'] for query in queries))
+        self.assertEqual(self.get_counts(), before)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(HeatmapCell.objects.get(zoom=0).count, Point.objects.count())
+
+    def test_heatmap_view(self):
+        """Тайлы области с числом точек, в том числе через антимеридиан"""
+
+        response = self.client.get(self.heatmap_url, data={'zoom': 6, 'bbox': '40,0,60,40'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(sorted(cell['count'] for cell in data['cells']), [1, 3])
+        x, y = heatmap.tile(55750000, 37610000, 6)
+        self.assertIn({'x': x, 'y': y, 'count': 3}, [
+            {key: cell[key] for key in ('x', 'y', 'count')} for cell in data['cells']
+        ])
+
+        response = self.client.get(self.heatmap_url, data={'zoom': 4, 'bbox': '-1,179,1,-179'})
+        self.assertEqual(response.json()['total'], 2)
+
+        response = self.client.get(self.heatmap_url, data={'zoom': 0})
+        self.assertEqual(response.json()['total'], Point.objects.count())
+
+    def test_heatmap_limits(self):
+        """Zoom больше MAX_ZOOM и слишком большая область отклоняются"""
+
+        max_zoom = heatmap.get_config()['MAX_ZOOM']
+        response = self.client.get(self.heatmap_url, data={'zoom': max_zoom + 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.heatmap_url, data={'zoom': max_zoom})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
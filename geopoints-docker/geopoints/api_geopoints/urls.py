@@ -1,10 +1,17 @@
 from django.urls import path
-from .views import PointView, PointSearchView, MessageView, MessageSearchView
+from .views import (
+    PointView, PointSearchView, PointBatchSearchView, PointWithinView, PointHeatmapView, MessageView, MessageSearchView,
+    message_stream
+)
 
 urlpatterns = [
     path('points/', PointView.as_view(), name='points'),
     path('points/search/', PointSearchView.as_view(), name='points-search_in_radius'),
+    path('points/search/batch/', PointBatchSearchView.as_view(), name='points-search_batch'),
+    path('points/within/', PointWithinView.as_view(), name='points-within'),
+    path('points/heatmap/', PointHeatmapView.as_view(), name='points-heatmap'),
     path('points/messages/', MessageView.as_view(), name='messages'),
     path('points/messages/search/', MessageSearchView.as_view(), name='messages-search_in_radius'),
+    path('points/messages/stream/', message_stream, name='messages-stream'),
 
 ]
@@ -1,17 +1,54 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from .serializers import PointSerializer, SearchSerializer, MessageSerializer
+from rest_framework.settings import api_settings
+from .serializers import (
+    PointSerializer, SearchSerializer, TextSearchSerializer, BatchSearchSerializer, WithinSerializer,
+    MessageSerializer, MessageSearchSerializer, HeatmapSerializer
+)
 from .models import Point, Message
-from .services import Location
+from .services import Location, Polygon, TextSearch, PointColumns, format_since
+from .renderers import ColumnarRenderer
+from .fragments import FragmentBuilder
+from .caching import get_point_ids_in_radius, get_user_list_response
+from . import readmodel
+from . import heatmap
+from .broadcast import hub, broker
+from api_auth.backends import AuthenticationJWT
+from geopoints.throttling import SearchThrottle, get_config as get_throttle_config
+from django.db.models import Q
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+fields_parameter = openapi.Parameter(
+    'fields',
+    openapi.IN_QUERY,
+    description="Список возвращаемых полей через запятую, вложенные через точку (id,latitude,user.username)",
+    type=openapi.TYPE_STRING,
+    required=False,
+)
+
+throttled_response = openapi.Response(
+    description="Превышен лимит стоимости запросов, повторить через Retry-After секунд",
+    schema=openapi.Schema(
+        type=openapi.TYPE_OBJECT,
+        properties={
+            'detail': openapi.Schema(type=openapi.TYPE_STRING)
+        }
+    )
+)
+
 
 class PointView(GenericAPIView):
     serializer_class = PointSerializer
     permission_classes = [IsAuthenticated]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
 
     def get_queryset(self):
         return Point.objects.filter(user=self.request.user).select_related('user')
@@ -21,7 +58,10 @@ class PointView(GenericAPIView):
         operation_description="""
             Получение точек текущего пользователя
             Доступно только для авторизованных
+            С Accept: application/vnd.geopoints.columnar (или format=columnar)
+            возвращаются только id и координаты в колоночном бинарном формате
         """,
+        manual_parameters=[fields_parameter],
         responses={
             401: openapi.Response(
                 description="Ошибка авторизации",
@@ -53,9 +93,16 @@ class PointView(GenericAPIView):
     )
     def get(self, request):
         """Возвращает точки текущего пользователя"""
+        response = get_user_list_response(request, self, 'points', self.get_list_data)
+        if response is not None:
+            return response
+        return Response(self.get_list_data())
+
+    def get_list_data(self):
         query = self.get_queryset()
-        serializer = self.get_serializer(query, many=True)
-        return Response(serializer.data)
+        if self.request.accepted_renderer.format == ColumnarRenderer.format:
+            return PointColumns.from_queryset(query)
+        return self.get_serializer(query, many=True).data
 
     @swagger_auto_schema(
         operation_summary="Создание точки",
@@ -103,10 +150,15 @@ class PointView(GenericAPIView):
 class PointSearchView(GenericAPIView):
     serializer_class = PointSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [SearchThrottle]
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [ColumnarRenderer]
 
     def get_queryset(self):
         return Point.objects.all().select_related('user')
 
+    def get_throttle_cost(self, request):
+        return SearchThrottle.radius_cost(request.query_params.get('radius'))
+
     @swagger_auto_schema(
         operation_summary="Поиск точек в радиусе",
         operation_description="""
@@ -115,6 +167,10 @@ class PointSearchView(GenericAPIView):
         - latitude - широта центра поиска (обязательный)
         - longitude - долгота центра поиска (обязательный)  
         - radius - радиус поиска в метрах (обязательный)
+        - q - поиск по названию и описанию точки
+
+        С Accept: application/vnd.geopoints.columnar (или format=columnar) возвращаются
+        только id и координаты в колоночном бинарном формате
         """,
         manual_parameters=[
             openapi.Parameter(
@@ -141,6 +197,14 @@ class PointSearchView(GenericAPIView):
                 format='float',
                 required=True,
             ),
+            openapi.Parameter(
+                'q',
+                openapi.IN_QUERY,
+                description="Текст для полнотекстового поиска",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
+            fields_parameter,
         ],
         responses={
             401: openapi.Response(
@@ -166,22 +230,322 @@ class PointSearchView(GenericAPIView):
                         )
                     }
                 )
-            )
+            ),
+            429: throttled_response
 
         },
         tags=['Точки']
     )
     def get(self, request):
         '''Возвращает точки по критериям отбора'''
-        serializer = SearchSerializer(data=request.query_params)
+        serializer = TextSearchSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        center_lat, center_lon, radius = serializer.validated_data.values()
-        loc = Location(center_lat, center_lon, radius)
+        data = serializer.validated_data
+        loc = Location(data['latitude'], data['longitude'], data['radius'], q=data.get('q'))
+        if request.accepted_renderer.format == ColumnarRenderer.format:
+            return Response(loc.get_point_columns())
         points = loc.get_points()
-        data = [self.get_serializer(obj[1]).data for obj in points]
+        builder = FragmentBuilder.for_request(request, self)
+        if builder is not None:
+            return builder.response(builder.points(points))
+        data = self.get_serializer(points, many=True).data
+        return Response(data)
+
+
+class PointBatchSearchView(GenericAPIView):
+    serializer_class = PointSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [SearchThrottle]
+
+    def get_queryset(self):
+        return Point.objects.all().select_related('user')
+
+    def get_throttle_cost(self, request):
+        '''Сумма стоимостей всех кругов пакета. Пакет дороже всего бакета отклоняется:
+        иначе стоимость обрезалась бы до емкости, и сотня наибольших кругов стоила бы как один
+        '''
+        queries = request.data.get('queries') if isinstance(request.data, dict) else None
+        if not isinstance(queries, list):
+            return 1
+        cost = sum(SearchThrottle.radius_cost(query.get('radius')) for query in queries if isinstance(query, dict))
+        capacity = get_throttle_config(SearchThrottle.scope)['CAPACITY']
+        if cost > capacity:
+            raise ValidationError({'queries': [
+                f'Суммарная площадь кругов пакета больше допустимой (стоимость {cost} из {capacity}), '
+                'уменьшите радиусы или разделите пакет'
+            ]})
+        return cost
+
+    @swagger_auto_schema(
+        operation_summary="Пакетный поиск точек в нескольких радиусах",
+        operation_description="""
+            Поиск точек сразу для списка кругов за один запрос к БД.
+
+        - queries - список объектов latitude, longitude, radius (не более 100)
+        - unique - если true, возвращается один список точек без повторов,
+          иначе список результатов на каждый круг в порядке queries
+        """,
+        request_body=BatchSearchSerializer,
+        responses={
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            429: throttled_response
+
+        },
+        tags=['Точки']
+    )
+    def post(self, request):
+        '''Возвращает точки для каждого круга поиска'''
+        serializer = BatchSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        locations = [
+            Location(query['latitude'], query['longitude'], query['radius'])
+            for query in serializer.validated_data['queries']
+        ]
+        results = Location.get_points_many(locations)
+        unique = serializer.validated_data['unique']
+
+        builder = FragmentBuilder.for_request(request, self)
+        if builder is not None:
+            if unique:
+                found = {}
+                for points in results:
+                    for point in points:
+                        found.setdefault(point.id, point)
+                return builder.response(builder.points(found.values()))
+            builder.load_users([point.user for points in results for point in points])
+            return builder.response(builder.join(builder.points(points) for points in results))
+
+        serialized = {}
+
+        def represent(point):
+            if point.id not in serialized:
+                serialized[point.id] = self.get_serializer(point).data
+            return serialized[point.id]
+
+        if unique:
+            data = [represent(point) for points in results for point in points if point.id not in serialized]
+        else:
+            data = [[represent(point) for point in points] for points in results]
+        return Response(data)
+
+
+class PointWithinView(GenericAPIView):
+    serializer_class = PointSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [SearchThrottle]
+    MAX_POINTS = 10000
+
+    def get_queryset(self):
+        return Point.objects.all().select_related('user')
+
+    def get_throttle_cost(self, request):
+        '''Стоимость по площади прямоугольника (для многоугольника - ограничивающего)'''
+        serializer = WithinSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return 1
+        return SearchThrottle.area_cost(Location.get_boxes_area(serializer.validated_data['boxes']))
+
+    @swagger_auto_schema(
+        operation_summary="Поиск точек в прямоугольнике или многоугольнике",
+        operation_description="""
+            Поиск точек в видимой области карты. Нужно передать один из параметров.
+
+        - bbox - южная широта,западная долгота,северная широта,восточная долгота.
+          Если западная долгота больше восточной, область пересекает антимеридиан
+        - polygon - вершины многоугольника "широта,долгота" через ";".
+          Многоугольник через антимеридиан нужно разделить на два
+
+        Площадь области (для многоугольника - ограничивающего прямоугольника) не больше 3 000 000 км²,
+        найденных точек не больше 10 000, иначе ответ 400.
+        Запрос расходует бакет поиска пропорционально площади области
+        """,
+        manual_parameters=[
+            openapi.Parameter(
+                'bbox',
+                openapi.IN_QUERY,
+                description="Прямоугольник: south,west,north,east",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
+            openapi.Parameter(
+                'polygon',
+                openapi.IN_QUERY,
+                description="Многоугольник: lat,lon;lat,lon;lat,lon",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
+            fields_parameter,
+        ],
+        responses={
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            429: throttled_response
+
+        },
+        tags=['Точки']
+    )
+    def get(self, request):
+        '''Возвращает точки внутри области'''
+        serializer = WithinSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        if 'bbox' in serializer.validated_data:
+            points = Location.get_points_bounding_boxes(serializer.validated_data['boxes'])
+        else:
+            points = Polygon(serializer.validated_data['polygon']).get_points()
+        points = list(points[:self.MAX_POINTS + 1])
+        if len(points) > self.MAX_POINTS:
+            return Response(
+                {'detail': f'Найдено больше {self.MAX_POINTS} точек, уменьшите область'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        builder = FragmentBuilder.for_request(request, self)
+        if builder is not None:
+            return builder.response(builder.points(points))
+        data = self.get_serializer(points, many=True).data
         return Response(data)
 
 
+class PointHeatmapView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        operation_summary="Тепловая карта точек",
+        operation_description="""
+            Число точек в тайлах карты (Web Mercator, x и y как у тайлов z/x/y) на заданном масштабе.
+        Счетчики берутся из заранее посчитанной пирамиды, а не из таблицы точек.
+
+        - zoom - уровень масштаба (обязательный, от 0 до HEATMAP MAX_ZOOM)
+        - bbox - южная широта,западная долгота,северная широта,восточная долгота, по умолчанию весь мир.
+          Если западная долгота больше восточной, область пересекает антимеридиан
+
+        Возвращаются только непустые тайлы с координатами их центров
+        """,
+        manual_parameters=[
+            openapi.Parameter(
+                'zoom',
+                openapi.IN_QUERY,
+                description="Уровень масштаба",
+                type=openapi.TYPE_INTEGER,
+                required=True,
+            ),
+            openapi.Parameter(
+                'bbox',
+                openapi.IN_QUERY,
+                description="Прямоугольник: south,west,north,east",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
+        ],
+        responses={
+            200: openapi.Response(
+                description="Счетчики тайлов",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'zoom': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'total': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'cells': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(
+                                type=openapi.TYPE_OBJECT,
+                                properties={
+                                    'x': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                    'y': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                    'latitude': openapi.Schema(type=openapi.TYPE_NUMBER),
+                                    'longitude': openapi.Schema(type=openapi.TYPE_NUMBER),
+                                    'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                }
+                            )
+                        )
+                    }
+                )
+            ),
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            )
+
+        },
+        tags=['Точки']
+    )
+    def get(self, request):
+        '''Возвращает счетчики точек в тайлах области'''
+        serializer = HeatmapSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        zoom = data['zoom']
+        cells = []
+        for x, y, count in heatmap.get_cells(zoom, data['x_ranges'], data['y_range']):
+            latitude, longitude = heatmap.tile_center(x, y, zoom)
+            cells.append({'x': x, 'y': y, 'latitude': latitude, 'longitude': longitude, 'count': count})
+        return Response({'zoom': zoom, 'total': sum(cell['count'] for cell in cells), 'cells': cells})
+
+
 class MessageView(GenericAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
@@ -237,6 +601,7 @@ class MessageView(GenericAPIView):
             Получение сообщений текущего пользователя
             Доступно только для авторизованных
         """,
+        manual_parameters=[fields_parameter],
         responses={
             401: openapi.Response(
                 description="Ошибка авторизации",
@@ -268,16 +633,24 @@ class MessageView(GenericAPIView):
     )
     def get(self, request):
         """Возвращает сообщения текущего пользователя"""
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True, context={'query': queryset})
-        return Response(serializer.data)
+        response = get_user_list_response(request, self, 'messages', self.get_list_data)
+        if response is not None:
+            return response
+        return Response(self.get_list_data())
+
+    def get_list_data(self):
+        return self.get_serializer(self.get_queryset(), many=True).data
 
 
 class MessageSearchView(GenericAPIView):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [SearchThrottle]
     queryset = Message.objects.all()
 
+    def get_throttle_cost(self, request):
+        return SearchThrottle.radius_cost(request.query_params.get('radius'))
+
     @swagger_auto_schema(
         operation_summary="Поиск сообщений в радиусе",
         operation_description="""
@@ -286,6 +659,9 @@ class MessageSearchView(GenericAPIView):
             - latitude - широта центра поиска (обязательный)
             - longitude - долгота центра поиска (обязательный)  
             - radius - радиус поиска в метрах (обязательный)
+            - q - поиск по тексту сообщения
+            - since - курсор из заголовка X-Next-Since прошлого ответа,
+              возвращаются только сообщения, созданные после него
             """,
         manual_parameters=[
             openapi.Parameter(
@@ -312,6 +688,21 @@ class MessageSearchView(GenericAPIView):
                 format='float',
                 required=True,
             ),
+            openapi.Parameter(
+                'q',
+                openapi.IN_QUERY,
+                description="Текст для полнотекстового поиска",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
+            fields_parameter,
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description="Курсор последнего полученного сообщения",
+                type=openapi.TYPE_STRING,
+                required=False,
+            ),
         ],
         responses={
             401: openapi.Response(
@@ -337,21 +728,96 @@ class MessageSearchView(GenericAPIView):
                         )
                     }
                 )
-            )
+            ),
+            429: throttled_response
 
         },
         tags=['Сообщения']
     )
+    @staticmethod
+    def search_messages(loc, data):
+        '''Поиск по Message с JOIN точек и пользователей'''
+        point_ids = get_point_ids_in_radius(loc)
+        messages = Message.objects.filter(
+            point_id__in=point_ids
+        )
+        if data.get('q'):
+            messages = TextSearch.filter(messages, data['q'])
+        if 'since' in data:
+            created_at, message_id = data['since']
+            messages = messages.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+            )
+        return list(messages.select_related('point', 'point__user').order_by('created_at', 'id'))
+
     def get(self, request):
         '''Возвращает сообщения найденные по критериям отбора'''
-        serializer = SearchSerializer(data=request.query_params)
+        serializer = MessageSearchSerializer(data=request.query_params)
         serializer.is_valid(raise_exception=True)
-        center_lat, center_lon, radius = serializer.validated_data.values()
-        loc = Location(center_lat, center_lon, radius)
-        points = loc.get_points()
-        point_ids = [point.id for _, point in points]
-        messages = Message.objects.filter(
-            point_id__in=point_ids
-        ).select_related('point', 'point__user')
-        message_serializer = MessageSerializer(messages, many=True, context={'query': messages})
-        return Response(message_serializer.data)
+        data = serializer.validated_data
+        loc = Location(data['latitude'], data['longitude'], data['radius'])
+        if readmodel.is_enabled():
+            messages = readmodel.search_messages(loc, q=data.get('q'), since=data.get('since'))
+        else:
+            messages = self.search_messages(loc, data)
+        builder = FragmentBuilder.for_request(request, self)
+        if builder is not None:
+            response = builder.response(builder.messages(messages))
+        else:
+            message_serializer = MessageSerializer(messages, many=True, context={'request': request})
+            response = Response(message_serializer.data)
+        if messages:
+            response['X-Next-Since'] = format_since(messages[-1])
+        elif 'since' in data:
+            response['X-Next-Since'] = request.query_params['since']
+        return response
+
+
+STREAM_HEARTBEAT = 15
+
+
+async def message_stream(request):
+    '''Server-sent events: новые сообщения в радиусе от точки.
+    Работает только через ASGI (geopoints.asgi), параметры как у поиска сообщений.
+    В compose.yml поток обслуживает сервис stream (uvicorn), nginx направляет туда этот путь,
+    сообщения из WSGI воркеров приходят через MESSAGE_BROKER=postgres.
+    Под WSGI (gunicorn с gevent) поток занял бы воркер целиком, поэтому возвращается 501
+    '''
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'detail': 'Поток сообщений доступен только через ASGI (geopoints.asgi).'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+    try:
+        user, _ = await sync_to_async(AuthenticationJWT().authenticate)(request)
+    except (AuthenticationFailed, Http404) as e:
+        return JsonResponse({'detail': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+    if user is None:
+        return JsonResponse({'detail': 'Учетные данные не были предоставлены.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    serializer = SearchSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    await sync_to_async(broker.start)()
+
+    async def events():
+        # подписка создается при первой итерации: если ответ так и не начнут читать,
+        # подписки нет, а начатая всегда снимается в finally
+        subscription = hub.subscribe(data['latitude'], data['longitude'], data['radius'])
+        try:
+            yield f'retry: {STREAM_HEARTBEAT * 1000}\n\n'
+            while True:
+                try:
+                    message_id, payload = await asyncio.wait_for(subscription.queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'id: {message_id}\nevent: message\ndata: {payload}\n\n'
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'attempts', 'created_at', 'finished_at']
+    list_display_links = ['id', 'kind']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['locked_by', 'locked_at', 'created_at', 'finished_at']
+    raw_id_fields = ['user']
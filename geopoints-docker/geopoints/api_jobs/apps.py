@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ApiJobsConfig(AppConfig):
+    name = 'api_jobs'
+
+    def ready(self):
+        from . import tasks  # noqa: F401
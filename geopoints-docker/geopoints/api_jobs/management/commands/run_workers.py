@@ -0,0 +1,40 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api_jobs.services import Worker, get_config, requeue_stale
+
+
+class Command(BaseCommand):
+    help = 'Воркеры фоновых задач: пул потоков забирает задачи из таблицы Job'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Количество потоков')
+        parser.add_argument('--poll-interval', type=float, default=get_config()['POLL_INTERVAL'],
+                            help='Пауза между проверками пустой очереди в секундах')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1:
+            raise CommandError('--threads должен быть больше 0')
+        stop = threading.Event()
+
+        def shutdown(signum, frame):
+            self.stdout.write('Остановка: текущие задачи будут доработаны')
+            stop.set()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, shutdown)
+            signal.signal(signal.SIGINT, shutdown)
+
+        requeued = requeue_stale()
+        if requeued:
+            self.stdout.write(f'Возвращено в очередь зависших задач: {requeued}')
+
+        workers = [Worker(stop, options['poll_interval'], options['once']) for _ in range(options['threads'])]
+        with ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix='geopoints-job') as pool:
+            for future in [pool.submit(worker.run) for worker in workers]:
+                future.result()
+        self.stdout.write(f'Выполнено задач: {sum(worker.processed for worker in workers)}')
@@ -0,0 +1,49 @@
+from rest_framework import serializers
+from .models import Job
+from .services import registry
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id',
+            'kind',
+            'status',
+            'progress',
+            'result',
+            'error',
+            'attempts',
+            'max_attempts',
+            'created_at',
+            'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class JobCreateSerializer(serializers.Serializer):
+    kind = serializers.CharField(
+        max_length=100,
+        help_text='Тип задачи, например points.import'
+    )
+    params = serializers.JSONField(
+        required=False,
+        default=dict,
+        help_text='Параметры задачи'
+    )
+
+    def validate_kind(self, value):
+        if value not in registry:
+            raise serializers.ValidationError(f'Неизвестный тип задачи. Доступны: {", ".join(sorted(registry))}')
+        return value
+
+    def validate(self, attrs):
+        if not isinstance(attrs['params'], dict):
+            raise serializers.ValidationError({'params': 'Ожидается объект'})
+        kind = registry[attrs['kind']]
+        request = self.context.get('request')
+        if kind.staff_only and not (request and request.user.is_staff):
+            raise serializers.ValidationError({'kind': 'Задача доступна только администраторам'})
+        if kind.validate is not None:
+            kind.validate(attrs['params'])
+        return attrs
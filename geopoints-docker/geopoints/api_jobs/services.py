@@ -0,0 +1,247 @@
+import logging
+import os
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from geopoints.db_router import use_primary
+from .models import Job
+
+logger = logging.getLogger('geopoints.jobs')
+
+DEFAULTS = {
+    'RETRY_DELAY': 10,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 3,
+    'POLL_INTERVAL': 1.0,
+}
+PROGRESS_INTERVAL = 1.0
+ERROR_LENGTH = 500
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'JOBS', {}))
+    return config
+
+
+@dataclass
+class JobKind:
+    handler: object
+    staff_only: bool = False
+    validate: object = None
+
+
+registry = {}
+
+
+def register(kind, staff_only=False, validate=None):
+    '''Регистрация обработчика задачи: handler(context, **params) -> результат (JSON).
+    validate(params) проверяет параметры при постановке в очередь и бросает ValidationError
+    '''
+    def decorator(handler):
+        registry[kind] = JobKind(handler, staff_only, validate)
+        return handler
+    return decorator
+
+
+def enqueue(kind, params=None, user=None, max_attempts=None):
+    '''Постановка задачи в очередь, возвращает Job сразу'''
+    if kind not in registry:
+        raise ValueError(f'Неизвестный тип задачи: {kind}')
+    return Job.objects.create(
+        kind=kind,
+        params=params or {},
+        user=user,
+        max_attempts=max_attempts or get_config()['MAX_ATTEMPTS'],
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim(worker_id):
+    '''Забирает следующую готовую задачу. В Postgres строки блокируются с SKIP LOCKED,
+    условный UPDATE по статусу не дает двум воркерам взять одну задачу и в остальных БД
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = Job.objects.filter(id=job.id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_by=worker_id, locked_at=now, attempts=job.attempts + 1
+        )
+    if not claimed:
+        return None
+    # значения из UPDATE, без повторного чтения (оно ушло бы на реплику)
+    job.status, job.locked_by, job.locked_at, job.attempts = Job.RUNNING, worker_id, now, job.attempts + 1
+    return job
+
+
+def requeue_stale(lease=None):
+    '''Возврат в очередь задач, воркер которых не подавал сигнал дольше lease секунд.
+    Задача, исчерпавшая попытки (например, воркер каждый раз падает по памяти), помечается failed.
+    Возвращает число задач, вернувшихся в очередь
+    '''
+    lease = get_config()['LEASE'] if lease is None else lease
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=lease))
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error='Воркер перестал подавать сигнал, попытки исчерпаны',
+        locked_by='', locked_at=None, finished_at=now
+    )
+    if failed:
+        logger.warning('Зависших задач без оставшихся попыток: %s', failed)
+    return stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, locked_by='', locked_at=None)
+
+
+class JobContext:
+    '''Передается обработчику: прогресс и продление аренды задачи'''
+
+    def __init__(self, job):
+        self.job = job
+        self.reported_at = 0.0
+
+    def set_progress(self, done, total):
+        '''Запись прогресса не чаще раза в PROGRESS_INTERVAL секунд'''
+        now = time.monotonic()
+        if now - self.reported_at < PROGRESS_INTERVAL and done < total:
+            return
+        self.reported_at = now
+        progress = min(1.0, done / total) if total else 1.0
+        Job.objects.filter(id=self.job.id).update(progress=progress, locked_at=timezone.now())
+        self.job.progress = progress
+
+    def checkpoint(self, state):
+        '''Сохранение состояния для продолжения после повтора или возврата в очередь: job.result.
+        Вызывается внутри транзакции обработчика, чтобы состояние фиксировалось вместе с данными
+        '''
+        Job.objects.filter(id=self.job.id).update(result=state)
+        self.job.result = state
+
+
+class Heartbeat:
+    '''Продление аренды задачи в отдельном потоке, пока работает обработчик,
+    в том числе если он не вызывает set_progress. Иначе задача дольше LEASE
+    вернулась бы в очередь и выполнялась бы дважды одновременно
+    '''
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = get_config()['LEASE'] / 3 if interval is None else interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f'geopoints-job-heartbeat-{job.id}', daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stop.wait(self.interval):
+                self.beat()
+        finally:
+            connections.close_all()
+
+    def beat(self):
+        return Job.objects.filter(id=self.job.id, locked_by=self.job.locked_by).update(locked_at=timezone.now())
+
+
+def error_message(exc):
+    '''Текст ошибки для job.error (его видит владелец задачи через API): класс и сообщение
+    исключения без traceback, полный traceback остается только в логе
+    '''
+    message = f'{type(exc).__name__}: {exc}'
+    return message if len(message) <= ERROR_LENGTH else message[:ERROR_LENGTH - 1] + '…'
+
+
+def execute(job):
+    '''Выполнение задачи с повтором при ошибке: задержка RETRY_DELAY * 2^(попытка-1)'''
+    kind = registry.get(job.kind)
+    now = timezone.now()
+    if kind is None:
+        Job.objects.filter(id=job.id).update(
+            status=Job.FAILED, error=f'Неизвестный тип задачи: {job.kind}', finished_at=now
+        )
+        return Job.FAILED
+    try:
+        with Heartbeat(job):
+            result = kind.handler(JobContext(job), **job.params)
+    except Exception as exc:
+        logger.exception('Задача %s #%s завершилась с ошибкой', job.kind, job.id)
+        fields = {'error': error_message(exc), 'locked_by': '', 'locked_at': None}
+        if job.attempts < job.max_attempts:
+            delay = get_config()['RETRY_DELAY'] * 2 ** (job.attempts - 1)
+            fields.update(status=Job.QUEUED, run_after=timezone.now() + timedelta(seconds=delay))
+        else:
+            fields.update(status=Job.FAILED, finished_at=timezone.now())
+        Job.objects.filter(id=job.id).update(**fields)
+        return fields['status']
+    Job.objects.filter(id=job.id).update(
+        status=Job.DONE, progress=1.0, result=result, error='', locked_by='', locked_at=None,
+        finished_at=timezone.now()
+    )
+    return Job.DONE
+
+
+class Worker:
+    '''Цикл воркера в отдельном потоке: берет задачи, пока не выставлен stop.
+    Раз в LEASE секунд возвращает в очередь зависшие задачи (requeue_stale): поток другого
+    воркера мог умереть, пока процесс продолжает работать, и тогда задача осталась бы running
+    '''
+
+    def __init__(self, stop, poll_interval=None, once=False):
+        self.stop = stop
+        self.poll_interval = get_config()['POLL_INTERVAL'] if poll_interval is None else poll_interval
+        self.once = once
+        self.processed = 0
+        # при запуске зависшие задачи возвращает run_workers
+        self.requeued_at = time.monotonic()
+
+    def requeue_stale_if_due(self):
+        now = time.monotonic()
+        if now - self.requeued_at < get_config()['LEASE']:
+            return
+        self.requeued_at = now
+        requeued = requeue_stale()
+        if requeued:
+            logger.info('Возвращено в очередь зависших задач: %s', requeued)
+
+    def run(self):
+        worker_id = worker_name()
+        # задачи читают то, что только что записали сами и API, отставание реплики здесь не нужно
+        token = use_primary.set(True)
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                self.requeue_stale_if_due()
+                job = claim(worker_id)
+                if job is None:
+                    if self.once:
+                        return
+                    self.stop.wait(self.poll_interval)
+                    continue
+                logger.info('Задача %s #%s взята воркером %s', job.kind, job.id, worker_id)
+                execute(job)
+                self.processed += 1
+        finally:
+            use_primary.reset(token)
+            close_old_connections()
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework import serializers
+
+from api_geopoints import readmodel
+from api_geopoints.serializers import PointSerializer
+from .services import register
+
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_POINTS = 100000
+MAX_REPORTED_ERRORS = 100
+
+
+def validate_import(params):
+    points = params.get('points')
+    if not isinstance(points, list) or not points:
+        raise serializers.ValidationError({'params': 'points - непустой список точек'})
+    if len(points) > IMPORT_MAX_POINTS:
+        raise serializers.ValidationError({'params': f'Не более {IMPORT_MAX_POINTS} точек за одну задачу'})
+
+
+@register('points.import', validate=validate_import)
+def import_points(context, points):
+    '''Импорт точек пользователя пачками, каждая пачка в своей транзакции.
+    Смещение следующей пачки сохраняется в той же транзакции (checkpoint), поэтому повтор
+    или возврат в очередь продолжает с него, не создавая точки повторно.
+    Невалидные точки пропускаются и перечисляются в результате
+    '''
+    user = get_user_model().objects.get(id=context.job.user_id)
+    state = context.job.result or {}
+    created = state.get('created', 0)
+    errors = state.get('errors', [])
+    for start in range(state.get('offset', 0), len(points), IMPORT_BATCH_SIZE):
+        with transaction.atomic():
+            for index, data in enumerate(points[start:start + IMPORT_BATCH_SIZE], start=start):
+                serializer = PointSerializer(data=data)
+                if serializer.is_valid():
+                    serializer.save(user=user)
+                    created += 1
+                elif len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({'index': index, 'errors': serializer.errors})
+            context.checkpoint({'offset': start + IMPORT_BATCH_SIZE, 'created': created, 'errors': errors})
+        context.set_progress(min(start + IMPORT_BATCH_SIZE, len(points)), len(points))
+    return {'created': created, 'failed': len(points) - created, 'errors': errors}
+
+
+@register('message_index.rebuild', staff_only=True)
+def rebuild_message_index(context):
+    '''Перестроение денормализованного индекса сообщений'''
+    return {'count': readmodel.rebuild()}
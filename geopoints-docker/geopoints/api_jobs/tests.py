@@ -0,0 +1,172 @@
+import threading
+from datetime import timedelta
+from unittest import mock
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from api_auth.services import TokenJWT
+from api_geopoints.factories import UserFactory
+from api_geopoints.models import Point
+from api_geopoints.serializers import PointSerializer
+from .models import Job
+from .services import Heartbeat, Worker, claim, execute, enqueue, get_config, register, requeue_stale
+
+failures = {'left': 0}
+
+
+@register('tests.flaky')
+def flaky(context):
+    if failures['left'] > 0:
+        failures['left'] -= 1
+        raise RuntimeError('временная ошибка')
+    return {'ok': True}
+
+
+class JobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.access_token = TokenJWT().create_token(user=self.user, token_typ='access')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.jobs_url = reverse('jobs')
+
+    def run_next(self):
+        job = claim('test-worker')
+        self.assertIsNotNone(job)
+        return execute(job)
+
+    def test_import_points(self):
+        """Импорт точек возвращает id задачи сразу, воркер выполняет его с прогрессом"""
+
+        points = [
+            {'name': f'Точка {i}', 'description': 'Описание', 'latitude': 10 + i * 0.01, 'longitude': 20}
+            for i in range(3)
+        ]
+        points.append({'name': 'Без координат'})
+        response = self.client.post(self.jobs_url, data={
+            'kind': 'points.import', 'params': {'points': points}
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['status'], Job.QUEUED)
+        self.assertFalse(Point.objects.exists())
+
+        self.assertEqual(self.run_next(), Job.DONE)
+        data = self.client.get(reverse('job-detail', args=[response.json()['id']])).json()
+        self.assertEqual((data['status'], data['progress']), (Job.DONE, 1.0))
+        self.assertEqual((data['result']['created'], data['result']['failed']), (3, 1))
+        self.assertEqual(data['result']['errors'][0]['index'], 3)
+        self.assertEqual(Point.objects.filter(user=self.user).count(), 3)
+
+    def test_validation_and_access(self):
+        """Неизвестный тип, задачи администратора и чужие задачи недоступны"""
+
+        response = self.client.post(self.jobs_url, data={'kind': 'unknown'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.jobs_url, data={'kind': 'message_index.rebuild'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        job = enqueue('tests.flaky', user=UserFactory())
+        response = self.client.get(reverse('job-detail', args=[job.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_retry_with_backoff(self):
+        """Ошибка возвращает задачу в очередь с задержкой, после последней попытки - failed"""
+
+        failures['left'] = 1
+        job = enqueue('tests.flaky', user=self.user, max_attempts=2)
+        with self.assertLogs('geopoints.jobs', level='ERROR'):
+            self.assertEqual(self.run_next(), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(claim('test-worker'))
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(self.run_next(), Job.DONE)
+
+        failures['left'] = 2
+        job = enqueue('tests.flaky', user=self.user, max_attempts=1)
+        with self.assertLogs('geopoints.jobs', level='ERROR'):
+            self.assertEqual(self.run_next(), Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.error, 'RuntimeError: временная ошибка')
+        response = self.client.get(reverse('job-detail', args=[job.id]))
+        self.assertNotIn('Traceback', response.json()['error'])
+        failures['left'] = 0
+
+    def test_stale_job_requeued(self):
+        """Задача упавшего воркера возвращается в очередь после аренды"""
+
+        job = enqueue('tests.flaky', user=self.user)
+        claim('dead-worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(lease=60), 1)
+        self.assertEqual(self.run_next(), Job.DONE)
+
+    @mock.patch('api_jobs.services.close_old_connections')
+    def test_worker_requeues_stale_jobs_periodically(self, close_old_connections):
+        """Работающий воркер раз в LEASE секунд возвращает зависшие задачи и выполняет их"""
+
+        job = enqueue('tests.flaky', user=self.user)
+        claim('dead-worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        worker = Worker(threading.Event(), poll_interval=0, once=True)
+        worker.run()
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.RUNNING)
+
+        worker.requeued_at -= get_config()['LEASE']
+        worker.run()
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.DONE)
+
+    def test_stale_job_without_attempts_fails(self):
+        """Задача, которая роняет воркер на каждой попытке, не возвращается в очередь бесконечно"""
+
+        job = enqueue('tests.flaky', user=self.user, max_attempts=1)
+        claim('dead-worker')
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('geopoints.jobs', level='WARNING'):
+            self.assertEqual(requeue_stale(lease=60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_heartbeat_extends_lease(self):
+        """Аренда продлевается, пока работает обработчик без set_progress"""
+
+        enqueue('tests.flaky', user=self.user)
+        job = claim('test-worker')
+        self.assertEqual((job.status, job.attempts), (Job.RUNNING, 1))
+        Job.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(Heartbeat(job).beat(), 1)
+        self.assertEqual(Heartbeat(Job(id=job.id, locked_by='other-worker')).beat(), 0)
+        self.assertEqual(requeue_stale(lease=60), 0)
+
+    @mock.patch('api_jobs.tasks.IMPORT_BATCH_SIZE', 2)
+    def test_import_resumes_after_failure(self):
+        """Повтор импорта продолжает с первой незакоммиченной пачки без дублей"""
+
+        points = [
+            {'name': f'Точка {i}', 'description': 'Описание', 'latitude': 10 + i * 0.01, 'longitude': 20}
+            for i in range(5)
+        ]
+        job = enqueue('points.import', params={'points': points}, user=self.user)
+        real_save = PointSerializer.save
+        calls = []
+
+        def save(serializer, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise RuntimeError('воркер упал')
+            return real_save(serializer, **kwargs)
+
+        with mock.patch.object(PointSerializer, 'save', save), self.assertLogs('geopoints.jobs', level='ERROR'):
+            self.assertEqual(self.run_next(), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertEqual(job.result['offset'], 2)
+        self.assertEqual(Point.objects.count(), 2)
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(self.run_next(), Job.DONE)
+        job.refresh_from_db()
+        self.assertEqual(job.result['created'], 5)
+        self.assertEqual(Point.objects.count(), 5)
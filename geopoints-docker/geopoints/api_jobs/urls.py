@@ -0,0 +1,7 @@
+from django.urls import path
+from .views import JobView, JobDetailView
+
+urlpatterns = [
+    path('', JobView.as_view(), name='jobs'),
+    path('<int:pk>/', JobDetailView.as_view(), name='job-detail'),
+]
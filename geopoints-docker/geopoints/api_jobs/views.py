@@ -0,0 +1,151 @@
+from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.generics import GenericAPIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from drf_yasg.utils import swagger_auto_schema
+from drf_yasg import openapi
+from .models import Job
+from .serializers import JobSerializer, JobCreateSerializer
+from .services import enqueue
+
+
+class JobView(GenericAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+    @swagger_auto_schema(
+        operation_summary="Задачи пользователя",
+        operation_description="""
+            Последние 100 фоновых задач текущего пользователя
+            Доступно только для авторизованных
+        """,
+        responses={
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            )
+        },
+        tags=['Задачи']
+    )
+    def get(self, request):
+        """Возвращает задачи текущего пользователя"""
+        serializer = self.get_serializer(self.get_queryset()[:100], many=True)
+        return Response(serializer.data)
+
+    @swagger_auto_schema(
+        operation_summary="Постановка задачи в очередь",
+        operation_description="""
+            Долгая операция выполняется процессом manage.py run_workers,
+            ответ с id задачи возвращается сразу. Статус и прогресс - GET jobs/<id>/
+            - points.import - импорт точек, params: {"points": [{"name", "description", "latitude", "longitude"}, ...]}
+            - message_index.rebuild - перестроение индекса сообщений (только администраторы)
+        """,
+        request_body=JobCreateSerializer,
+        responses={
+            202: JobSerializer,
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            )
+        },
+        tags=['Задачи']
+    )
+    def post(self, request):
+        """Создание задачи"""
+        serializer = JobCreateSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        job = enqueue(serializer.validated_data['kind'], serializer.validated_data['params'], user=request.user)
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class JobDetailView(GenericAPIView):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return Job.objects.all()
+        return Job.objects.filter(user=self.request.user)
+
+    @swagger_auto_schema(
+        operation_summary="Статус задачи",
+        operation_description="""
+            Статус (queued, running, done, failed), прогресс от 0 до 1, результат или ошибка
+            Доступно владельцу задачи и администраторам
+        """,
+        responses={
+            401: openapi.Response(
+                description="Ошибка авторизации",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            ),
+            403: openapi.Response(
+                description="Доступ запрещен",
+                schema=openapi.Schema(
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'detail': openapi.Schema(
+                            type=openapi.TYPE_ARRAY,
+                            items=openapi.Schema(type=openapi.TYPE_STRING)
+                        )
+                    }
+                )
+            )
+        },
+        tags=['Задачи']
+    )
+    def get(self, request, pk):
+        """Возвращает задачу"""
+        job = get_object_or_404(self.get_queryset(), pk=pk)
+        return Response(self.get_serializer(job).data)
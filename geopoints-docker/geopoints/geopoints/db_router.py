@@ -0,0 +1,135 @@
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+from django.utils.connection import ConnectionDoesNotExist
+
+logger = logging.getLogger('geopoints.db_router')
+
+DEFAULTS = {
+    'PIN_SECONDS': 5,
+    'HEALTH_INTERVAL': 10,
+    'COOKIE_NAME': 'geopoints_primary',
+}
+PIN_KEY = 'geopoints:primary-pin:{}'
+
+use_primary = ContextVar('geopoints_use_primary', default=False)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'DATABASE_REPLICA', {}))
+    return config
+
+
+class ReplicaHealth:
+    '''Доступность реплик с проверкой не чаще HEALTH_INTERVAL секунд на реплику'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            state = self.checked.get(alias)
+        if state is not None and now - state[1] < get_config()['HEALTH_INTERVAL']:
+            return state[0]
+        healthy = self.check(alias)
+        with self.lock:
+            self.checked[alias] = (healthy, now)
+        return healthy
+
+    @staticmethod
+    def check(alias):
+        try:
+            connections[alias].ensure_connection()
+        except (ConnectionDoesNotExist, DatabaseError):
+            logger.warning('Реплика %s недоступна, чтение идет с основной БД', alias)
+            return False
+        return True
+
+    def set(self, alias, healthy):
+        with self.lock:
+            self.checked[alias] = (healthy, time.monotonic())
+
+    def clear(self):
+        with self.lock:
+            self.checked.clear()
+
+
+health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    '''Чтение - со случайной доступной реплики из settings.DATABASE_REPLICAS, запись - в default.
+    Чтение остается на default, если запрос закреплен за основной БД (use_primary)
+    или идет внутри транзакции default
+    '''
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or use_primary.get() or connections['default'].in_atomic_block:
+            return 'default'
+        healthy = [alias for alias in replicas if health.is_healthy(alias)]
+        if not healthy:
+            return 'default'
+        return random.choice(healthy)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        '''Реплики получают схему через репликацию'''
+        return db == 'default'
+
+
+def pin_user(user_id):
+    '''Закрепление пользователя за основной БД на PIN_SECONDS секунд в кэше.
+    С общим кэшем (Redis) закрепление видят все воркеры, с локальным - только текущий
+    '''
+    cache.set(PIN_KEY.format(user_id), 1, timeout=get_config()['PIN_SECONDS'])
+
+
+def use_primary_if_pinned(user_id):
+    '''Вызывается после аутентификации: чтение до конца запроса идет с основной БД,
+    если пользователь недавно писал. Сбрасывает PrimaryPinMiddleware в конце запроса
+    '''
+    if not use_primary.get() and getattr(settings, 'DATABASE_REPLICAS', []) and cache.get(PIN_KEY.format(user_id)):
+        use_primary.set(True)
+
+
+class PrimaryPinMiddleware:
+    '''Read-your-writes: запрос с изменением данных и следующие PIN_SECONDS секунд читают
+    с основной БД, чтобы пользователь видел свою запись до репликации. Закрепление - по id
+    пользователя в кэше (JWT клиенты не возвращают cookie, см. use_primary_if_pinned) и по cookie
+    для браузера и анонимных запросов
+    '''
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        write = request.method not in self.SAFE_METHODS
+        token = use_primary.set(write or config['COOKIE_NAME'] in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_primary.reset(token)
+        if write:
+            # DRF записывает аутентифицированного пользователя и в исходный HttpRequest
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_user(user.id)
+            response.set_cookie(config['COOKIE_NAME'], '1', max_age=config['PIN_SECONDS'], httponly=True, samesite='Lax')
+        return response
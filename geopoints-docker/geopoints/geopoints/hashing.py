@@ -0,0 +1,87 @@
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.crypto import pbkdf2
+
+DEFAULTS = {
+    'POOL': 'auto',
+    'MAX_WORKERS': 2,
+}
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'PASSWORD_HASHING', {}))
+    return config
+
+
+def is_gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def get_pool():
+    '''Пул для вычисления хэшей, None - считать в текущем потоке.
+    auto: под gevent (gunicorn worker_class = 'gevent') - пул настоящих потоков ОС из gevent,
+    иначе без пула, т.к. запрос и так выполняется в своем потоке.
+    thread: ThreadPoolExecutor (без gevent), inline: без пула
+    '''
+    config = get_config()
+    kind, max_workers = config['POOL'], config['MAX_WORKERS']
+    if kind == 'auto':
+        kind = 'gevent' if is_gevent_patched() else 'inline'
+    if kind == 'inline':
+        return None
+    key = (kind, max_workers)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if kind == 'gevent':
+                from gevent.threadpool import ThreadPool
+                pool = ThreadPool(maxsize=max_workers)
+            else:
+                pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geopoints-hash')
+            _pools[key] = pool
+    return pool
+
+
+def reset_pools():
+    '''Пулы родительского процесса после fork непригодны: потоки в дочерний процесс не копируются'''
+    with _lock:
+        _pools.clear()
+
+
+def run(func, *args, **kwargs):
+    '''Вызов func в пуле хэширования. Не больше MAX_WORKERS вызовов одновременно на процесс,
+    остальные ждут в очереди пула, не блокируя другие гринлеты воркера
+    '''
+    pool = get_pool()
+    if pool is None:
+        return func(*args, **kwargs)
+    if isinstance(pool, ThreadPoolExecutor):
+        return pool.submit(func, *args, **kwargs).result()
+    return pool.apply(func, args, kwargs)
+
+
+class OffloadedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    '''PBKDF2 с вычислением в пуле потоков: hashlib.pbkdf2_hmac отпускает GIL,
+    поэтому под gevent хэш не блокирует цикл событий воркера.
+    Алгоритм и формат те же, что у PBKDF2PasswordHasher, сохраненные пароли остаются валидными.
+    Через хэшер проходят вход, регистрация, BasicAuthentication и админка
+    '''
+
+    def encode(self, password, salt, iterations=None):
+        self._check_encode_args(password, salt)
+        iterations = iterations or self.iterations
+        hash = run(pbkdf2, password, salt, iterations, digest=self.digest)
+        hash = base64.b64encode(hash).decode('ascii').strip()
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt, hash)
@@ -0,0 +1,131 @@
+import logging
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+logger = logging.getLogger('geopoints.querycheck')
+
+DEFAULTS = {
+    'ENABLED': False,
+    'THRESHOLD': 5,
+    'RAISE': False,
+}
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r'\s+')
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'QUERY_CHECK', {}))
+    return config
+
+
+def fingerprint(sql):
+    '''Нормализованный вид SQL: литералы и списки IN (...) заменены на заполнители'''
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def project_stack():
+    '''Стек вызовов, ограниченный файлами проекта'''
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and not frame.filename.endswith('querycheck.py')
+    ]
+    return ''.join(traceback.format_list(frames))
+
+
+class RepeatedQueriesError(AssertionError):
+    '''Одинаковый SQL запрос выполнен больше допустимого числа раз'''
+
+
+class QueryRecorder:
+    '''Обертка execute_wrapper, считающая запросы по отпечатку'''
+
+    def __init__(self):
+        self.counts = Counter()
+        self.samples = {}
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        self.counts[key] += 1
+        if key not in self.samples:
+            self.samples[key] = sql
+            self.stacks[key] = project_stack()
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        '''Список (отпечаток, количество, стек) для запросов выше порога'''
+        return [
+            (key, count, self.stacks[key])
+            for key, count in self.counts.most_common()
+            if count > threshold
+        ]
+
+    def report(self, threshold, label=''):
+        lines = [f'Повторяющиеся SQL запросы {label}'.strip() + ':']
+        for key, count, stack in self.repeated(threshold):
+            lines.append(f'{count}x {self.samples[key]}')
+            lines.append(stack)
+        return '\n'.join(lines)
+
+
+@contextmanager
+def detect_repeated_queries(threshold=None, raise_error=True, label=''):
+    '''Контекстный менеджер для поиска N+1: собирает запросы всех соединений
+    и логирует или бросает RepeatedQueriesError при превышении порога'''
+    config = get_config()
+    threshold = config['THRESHOLD'] if threshold is None else threshold
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+    if recorder.repeated(threshold):
+        message = recorder.report(threshold, label)
+        if raise_error:
+            raise RepeatedQueriesError(message)
+        logger.warning(message)
+
+
+class RepeatedQueriesMiddleware:
+    '''Отслеживает повторяющиеся запросы в пределах одного HTTP запроса.
+    Настраивается через settings.QUERY_CHECK'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        with detect_repeated_queries(
+                threshold=config['THRESHOLD'],
+                raise_error=config['RAISE'],
+                label=f'{request.method} {request.path}'
+        ):
+            response = self.get_response(request)
+        return response
+
+
+class QueryCheckTestRunner(DiscoverRunner):
+    '''Тестовый раннер, в котором повторяющиеся запросы в запросах к API роняют тест'''
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_CHECK = {**get_config(), 'ENABLED': True, 'RAISE': True}
+        # без фонового потока: он читал бы тестовую БД параллельно с тестами
+        settings.TOKEN_REVOCATION = {**getattr(settings, 'TOKEN_REVOCATION', {}), 'BACKGROUND_SYNC': False}
@@ -25,19 +25,22 @@ INSTALLED_APPS = [
     'drf_yasg',
     'debug_toolbar',
     'api_auth.apps.ApiAuthConfig',
-    'api_geopoints.apps.ApiGeopointsConfig'
+    'api_geopoints.apps.ApiGeopointsConfig',
+    'api_jobs.apps.ApiJobsConfig'
 
 ]
 
 MIDDLEWARE = [
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.middleware.security.SecurityMiddleware',
+    'geopoints.db_router.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'geopoints.querycheck.RepeatedQueriesMiddleware',
 
 ]
 
@@ -60,6 +63,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'geopoints.wsgi.application'
 
+TEST_RUNNER = 'geopoints.querycheck.QueryCheckTestRunner'
+
 load_dotenv()
 
 DATABASES = {
@@ -73,6 +78,89 @@ DATABASES = {
     }
 }
 
+# Реплики только для чтения: DB_REPLICA_HOSTS=host1,host2:5433, остальные параметры как у default
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['geopoints.db_router.ReplicaRouter']
+
+# Закрепление за основной БД после записи (read-your-writes) и интервал проверки реплик
+DATABASE_REPLICA = {
+    'PIN_SECONDS': int(os.getenv('DB_REPLICA_PIN_SECONDS', 5)),
+    'HEALTH_INTERVAL': 10,
+}
+
+# Кэш выборок точек. Локальный кэш у каждого воркера свой, для общего кэша задайте REDIS_URL
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Байты ответов списков пользователя в памяти воркера: общий лимит и лимит на один ответ.
+# Версии списков хранятся в CACHES, поэтому по умолчанию (ENABLED=None) кэш работает только с REDIS_URL:
+# с локальным кэшем запись через один воркер не сбрасывала бы ответы остальных
+RESPONSE_CACHE = {
+    'ENABLED': None,
+    'MAX_BYTES': int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    'MAX_ENTRY_BYTES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRY_BYTES', 1024 * 1024)),
+}
+
+# JSON фрагменты точек в памяти воркера для сборки ответов поиска
+FRAGMENT_CACHE = {
+    'MAX_BYTES': int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    'MAX_ENTRY_BYTES': 64 * 1024,
+}
+
+# Файл пространственного индекса точек, общий для воркеров через mmap (собрать: manage.py build_spatial_index)
+SPATIAL_INDEX = {
+    'PATH': os.getenv('SPATIAL_INDEX_PATH', ''),
+    'CELL_SIZE': 0.1,
+    # изменений после сборки в памяти воркера, больше - поиск через БД до пересборки
+    'MAX_OVERLAY': 100000,
+    # больше точек в радиусе - поиск по индексу прерывается, радиус фильтрует БД
+    'MAX_IDS': 5000,
+}
+
+# Пирамида счетчиков тепловой карты: zoom 0..MAX_ZOOM, не больше MAX_CELLS тайлов на запрос
+# (заполнить по существующим точкам: manage.py rebuild_heatmap)
+HEATMAP = {
+    'MAX_ZOOM': int(os.getenv('HEATMAP_MAX_ZOOM', 12)),
+    'MAX_CELLS': 65536,
+}
+
+PASSWORD_HASHERS = [
+    'geopoints.hashing.OffloadedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Хэширование паролей вне цикла событий gevent: auto - пул потоков gevent под gunicorn, thread, inline.
+# MAX_WORKERS - одновременных хэшей на процесс (gunicorn workers * MAX_WORKERS на сервер)
+PASSWORD_HASHING = {
+    'POOL': os.getenv('PASSWORD_HASH_POOL', 'auto'),
+    'MAX_WORKERS': int(os.getenv('PASSWORD_HASH_WORKERS', 2)),
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -90,11 +178,43 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'api_auth.backends.ThrottledBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'api_auth.backends.AuthenticationJWT'
 
-    ]
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api_geopoints.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # адрес клиента для ограничений - последний адрес X-Forwarded-For, добавленный nginx.
+    # Без прокси перед приложением задайте NUM_PROXIES=0 (REMOTE_ADDR), иначе адрес подделывается заголовком
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
+}
+
+# Token bucket для дорогих запросов: емкость и пополнение в секунду. Поиск в круге радиуса 1000 км
+# (или области той же площади) стоит всю емкость search, меньшие области - пропорционально площади.
+# Без REDIS_URL бакеты в LocMemCache у каждого воркера свои: реальный лимит - в число воркеров
+# (gunicorn.py: cpu_count()) раз больше указанного
+THROTTLE_BUCKETS = {
+    'search': {'CAPACITY': 300, 'REFILL': 5.0},
+    'login': {'CAPACITY': 20, 'REFILL': 0.2},
+}
+
+# Фоновые задачи: задержка первого повтора, аренда задачи воркером и число попыток
+JOBS = {
+    'RETRY_DELAY': 10,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Отозванные токены: проверка access по множеству в памяти воркера, синхронизация с БД в фоновом потоке
+# (версия в кэше - раз в POLL_INTERVAL, БД - при смене версии или раз в SYNC_INTERVAL)
+TOKEN_REVOCATION = {
+    'SYNC_INTERVAL': 5,
+    'PRUNE_INTERVAL': 60,
+    'POLL_INTERVAL': 1,
+    'BACKGROUND_SYNC': True,
 }
 
 JWT = {
@@ -108,6 +228,19 @@ JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=20)
 }
 
+# Доставка новых сообщений подписчикам SSE: local - в пределах процесса, postgres - LISTEN/NOTIFY
+MESSAGE_BROKER = os.getenv('MESSAGE_BROKER', 'local')
+
+# Поиск сообщений по денормализованной таблице MessageIndex (заполнить: manage.py rebuild_message_index)
+MESSAGE_READ_MODEL = os.getenv('MESSAGE_READ_MODEL', 'False') == 'True'
+
+# Поиск N+1: одинаковые SQL запросы чаще THRESHOLD раз за HTTP запрос логируются (RAISE - исключение)
+QUERY_CHECK = {
+    'ENABLED': DEBUG,
+    'THRESHOLD': 5,
+    'RAISE': False,
+}
+
 LANGUAGE_CODE = 'ru'
 
 TIME_ZONE = 'UTC'
@@ -0,0 +1,109 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'search': {'CAPACITY': 300, 'REFILL': 5.0},
+    'login': {'CAPACITY': 20, 'REFILL': 0.2},
+}
+
+
+def get_config(scope):
+    config = dict(DEFAULTS[scope])
+    config.update(getattr(settings, 'THROTTLE_BUCKETS', {}).get(scope, {}))
+    return config
+
+
+class TokenBucketThrottle(BaseThrottle):
+    '''Token bucket в кэше Django: CAPACITY единиц, пополнение REFILL единиц в секунду.
+    Запрос списывает стоимость из view.get_throttle_cost(request) (по умолчанию 1),
+    но не больше CAPACITY, чтобы самый дорогой запрос проходил хотя бы при полном бакете.
+    Без REDIS_URL состояние хранится в локальном кэше воркера: бакет у каждого воркера свой,
+    и фактический лимит в число воркеров раз больше настроенного.
+    Адрес клиента - из X-Forwarded-For с учетом REST_FRAMEWORK NUM_PROXIES
+    '''
+    scope = None
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_cost(self, request, view):
+        get_throttle_cost = getattr(view, 'get_throttle_cost', None)
+        return get_throttle_cost(request) if get_throttle_cost else 1
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = f'user:{request.user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        return self.bucket_key(ident)
+
+    def bucket_key(self, ident):
+        return f'geopoints:throttle:{self.scope}:{ident}'
+
+    def allow_request(self, request, view):
+        return self.take(self.get_cache_key(request, view), self.get_cost(request, view))
+
+    def take(self, key, cost, peek=False):
+        '''Списание cost единиц из бакета key. peek - только проверить, что их хватает'''
+        config = get_config(self.scope)
+        capacity, refill = config['CAPACITY'], config['REFILL']
+        cost = min(max(cost, 1), capacity)
+        now = time.time()
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        timeout = math.ceil(capacity / refill) + 1
+        if tokens < cost:
+            self.wait_seconds = (cost - tokens) / refill
+            cache.set(key, (tokens, now), timeout=timeout)
+            return False
+        if not peek:
+            cache.set(key, (tokens - cost, now), timeout=timeout)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class SearchThrottle(TokenBucketThrottle):
+    '''Поиск по области: стоимость пропорциональна площади, круг наибольшего радиуса
+    MAX_RADIUS стоит весь бакет CAPACITY, любая область - не меньше 1
+    '''
+    scope = 'search'
+    MAX_RADIUS = 1000
+
+    @classmethod
+    def area_cost(cls, area):
+        '''Стоимость области площадью area км²'''
+        capacity = get_config(cls.scope)['CAPACITY']
+        max_area = math.pi * cls.MAX_RADIUS ** 2
+        return max(1, math.ceil(capacity * min(area, max_area) / max_area))
+
+    @classmethod
+    def radius_cost(cls, radius):
+        '''Стоимость круга радиуса radius км.
+        Некорректный радиус стоит 1, запрос все равно не пройдет валидацию
+        '''
+        try:
+            radius = float(radius)
+        except (TypeError, ValueError):
+            return 1
+        if not math.isfinite(radius):
+            return 1
+        # больше максимума сериализатора запрос не пройдет, а огромный радиус переполнил бы float
+        radius = min(abs(radius), cls.MAX_RADIUS)
+        return cls.area_cost(math.pi * radius ** 2)
+
+
+class LoginThrottle(TokenBucketThrottle):
+    '''Попытки входа с одного адреса. Тот же бакет расходуют неудачные проверки пароля
+    через BasicAuthentication (api_auth.backends.ThrottledBasicAuthentication)
+    '''
+    scope = 'login'
+
+    def ip_key(self, request):
+        '''Ключ по адресу: при аутентификации request.user еще не определен'''
+        return self.bucket_key(f'ip:{self.get_ident(request)}')
@@ -7,6 +7,7 @@ from debug_toolbar.toolbar import debug_toolbar_urls
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('api_auth.urls')),
+    path('api/jobs/', include('api_jobs.urls')),
     path('api/', include('api_geopoints.urls')),
 
 ]
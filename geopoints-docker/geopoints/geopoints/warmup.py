@@ -0,0 +1,135 @@
+import importlib
+import logging
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_backends
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.settings import IMPORT_STRINGS, api_settings
+
+logger = logging.getLogger('geopoints.warmup')
+
+_app_warmed = False
+
+
+def iter_views(patterns=None):
+    '''Классы представлений всех URL проекта'''
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_views(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            view_class = getattr(pattern.callback, 'cls', None) or getattr(pattern.callback, 'view_class', None)
+            if view_class is not None:
+                yield view_class
+
+
+def iter_serializers(base=serializers.Serializer):
+    for subclass in base.__subclasses__():
+        yield subclass
+        yield from iter_serializers(subclass)
+
+
+def warm_urls():
+    '''Построение URL resolver (разбор всех шаблонов и обратный словарь для reverse)'''
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return len(set(iter_views()))
+
+
+def warm_imports():
+    '''Классы, которые Django и DRF импортируют по строкам из настроек при первом запросе'''
+    for name in IMPORT_STRINGS:
+        getattr(api_settings, name)
+    import_string(settings.MESSAGE_STORAGE)
+    importlib.import_module(settings.SESSION_ENGINE)
+    return len(get_backends())
+
+
+def warm_serializers():
+    '''Импорт serializers и views приложений проекта и построение полей всех сериализаторов.
+    Поля ModelSerializer строятся по модели при первом обращении к fields
+    '''
+    for app_config in apps.get_app_configs():
+        if not app_config.name.startswith('api_'):
+            continue
+        for module in ('serializers', 'views'):
+            try:
+                importlib.import_module(f'{app_config.name}.{module}')
+            except ModuleNotFoundError:
+                pass
+    count = 0
+    for serializer_class in set(iter_serializers()):
+        if not serializer_class.__module__.startswith('api_'):
+            continue
+        try:
+            serializer_class().fields
+        except Exception:
+            logger.debug('Сериализатор %s не прогрет', serializer_class.__name__, exc_info=True)
+            continue
+        count += 1
+    return count
+
+
+def warm_caches():
+    '''Состояние процесса, которое иначе собирает первый запрос: отображение файла
+    пространственного индекса, множество отозванных токенов, пул хэширования паролей
+    '''
+    from api_auth.revocation import revoked_access
+    from api_geopoints import spatial_index
+    from geopoints import hashing
+
+    index = spatial_index.get_index()
+    if index is not None:
+        index.refresh()
+    revoked_access.sync_if_stale()
+    revoked_access.ensure_syncing()
+    hashing.get_pool()
+    return index is not None
+
+
+def warm_app():
+    '''Часть прогрева без соединений и потоков: можно выполнять в мастере gunicorn до fork'''
+    global _app_warmed
+    if _app_warmed:
+        return {}
+    timings = run_steps([('imports', warm_imports), ('urls', warm_urls), ('serializers', warm_serializers)])
+    _app_warmed = True
+    return timings
+
+
+def warm_worker():
+    '''Полный прогрев процесса перед приемом запросов.
+    Соединения с БД не прогреваются: под gevent соединение принадлежит гринлету (каждый запрос
+    открывает свое), а при CONN_MAX_AGE = 0 оно закрывается в конце запроса.
+    Соединение, открытое warm_caches, закрывает вызывающий (post_worker_init)
+    '''
+    timings = warm_app()
+    timings.update(run_steps([('caches', warm_caches)]))
+    return timings
+
+
+def run_steps(steps):
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        result = step()
+        timings[name] = (time.perf_counter() - start) * 1000
+        logger.info('Прогрев %s: %s за %.1f мс', name, result, timings[name])
+    return timings
+
+
+def after_fork():
+    '''Сброс унаследованного от мастера состояния, которое нельзя делить между процессами.
+    Соединения БД отбрасываются без закрытия: закрытие оборвало бы общий с мастером сокет
+    '''
+    from geopoints import hashing
+
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+    hashing.reset_pools()
@@ -15,5 +15,35 @@ env = {
     'DJANGO_SETTINGS_MODULE': 'geopoints.settings'
 }
 
-reload = True
+# GUNICORN_PRELOAD=True: приложение загружается и прогревается в мастере один раз,
+# воркеры получают его через fork. Перезагрузка кода при этом не работает
+preload_app = environ.get('GUNICORN_PRELOAD', 'False') == 'True'
+reload = not preload_app
 name = 'geopoints'
+
+if preload_app and worker_class == 'gevent':
+    # модули приложения импортируются в мастере, патч gevent должен быть до них
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    '''Мастер запущен: при preload_app прогреваются URL и сериализаторы, общие для всех воркеров'''
+    if server.cfg.preload_app:
+        from geopoints import warmup
+        warmup.warm_app()
+
+
+def post_fork(server, worker):
+    from geopoints import warmup
+    warmup.after_fork()
+
+
+def post_worker_init(worker):
+    '''Прогрев воркера до приема запросов: индекс точек, отозванные токены, пул хэширования'''
+    from django.db import connections
+    from geopoints import warmup
+    timings = warmup.warm_worker()
+    # соединение главного гринлета запросы не используют
+    connections.close_all()
+    worker.log.info('Воркер прогрет за %.1f мс', sum(timings.values()))